@@ -1,306 +1,190 @@
-from models import Operation
-from portfolio_value import get_portfolio_value
-from cointegration_functions import johansen
-from Kalman_structure import KalmanFilterReg
+from cointegration_monitor import adf_critical_value
+from models import BacktestResult, RECORD_LEVELS, storage_dtype
+from strategy import PairsStrategy
 import pandas as pd
 import numpy as np
 
 
 
-def backtest(data: pd.DataFrame,cash: float, initial_eig, theta) -> tuple[pd.Series, float, float, int, int, int, int, float]: 
+def backtest(data: pd.DataFrame,cash: float, initial_eig, theta, Q_filter: float = 0.01, R_filter: float = 0.0001,
+             norm_window: int = 252, profiler=None, record: str = 'full', max_pvalue: float = None,
+             monitor_window: int = 252, monitor_lag: int = 1, signals: dict = None, dtype=None,
+             process_noise: bool = False) -> BacktestResult: 
     """
     Backtest a pairs trading strategy based on VECM and Kalman Filter hedge ratio.
+
+    The bars are fed one by one to a PairsStrategy, the same object that can run on a live feed.
     
     Parameters:
     data (pd.DataFrame): DataFrame containing price data for two assets.
     cash (float): Initial cash for the portfolio.
     initial_eig: Initial eigenvector for the VECM.
     theta (float): Threshold for opening and closing positions based on normalized VECM.
+    Q_filter (float): Process noise covariance of both Kalman filters, only used with process_noise.
+    R_filter (float): Measurement noise covariance of both Kalman filters.
+    norm_window (int): Number of bars used to normalize the VECM.
+    profiler (StageProfiler): Optional profiler that times each stage of the loop, see profiling.py.
+                              Without it the loop runs uninstrumented. Its report is returned in result.profile.
+                              With max_pvalue the profiled run computes the ADF test on every bar inside
+                              'cointegration_monitor', an upper bound of the unprofiled cost, where the test
+                              only runs when an entry reads it.
+    record (str): What is recorded per bar: 'full' keeps the equity curve and every diagnostic trace,
+                  'equity' only the equity curve and 'none' neither. 'none' also drops the trade list
+                  (result.trades is None), keeping the final cash, costs, stats and leg P&L.
+    max_pvalue (float): Block new entries while the rolling ADF p-value of the pair is above this.
+                        None, the default, trades without the cointegration monitor.
+    monitor_window (int): Number of bars of the monitor's test window.
+    monitor_lag (int): Number of lagged differences of the monitor's ADF regression.
+    signals (dict): Precomputed signals of data, see signal_cache.compute_signals and SignalCache.
+                    Only the entries, exits and accounting run then, which is much cheaper.
+                    The signals already hold the filter, window and monitor settings, so those
+                    arguments are not used, and max_pvalue needs signals computed with a monitor.
+    dtype (str): Dtype of the recorded equity curve and traces, 'float64' (default) or 'float32' for half
+                 the memory. The strategy itself, cash and Kalman states included, always runs in float64.
+    process_noise (bool): Add Q_filter to the error covariance of both Kalman filters before each update.
+                          Off by default, so Q_filter has no effect unless it is set.
     
     Returns:
-    tuple: A tuple containing portfolio value series, final cash, trade statistics, p2 values
-           p2_hat values, vecm values, vecm_hat values, vecm_norm values, hr values, borrow costs, commission costs, and all trades.
+    BacktestResult: Portfolio value series, final cash, trade statistics, borrow costs, commission costs,
+                    all trades (None with record='none'), the P&L of each closed leg and, with record='full',
+                    the p2, p2_hat, vecm, vecm_hat, vecm_norm and hr traces (and the monitor's ADF statistic)
+                    as NumPy arrays.
+                    With the monitor, blocked_entries counts the bars whose entry signal it refused.
+                    With a profiler, profile holds its report.
+                    It still unpacks like the tuple backtest used to return.
     """
-    
-    n_shares = 100
-    COM = 0.125 / 100
-    BORROW_RATE = (0.25 / 100) / 252
-
-    data = data.copy().dropna()
-
-    active_long_positions: list[Operation] = []
-    active_short_positions: list[Operation] = []
-    all_trades = []
-
-    port_hist = []
-
-    hedge_ratio = KalmanFilterReg(Q_filter=0.01, R_filter=0.0001)
-    k_eigenvector = KalmanFilterReg(Q_filter=0.01, R_filter=0.0001)
-    k_eig = initial_eig
-
-    hr_values = []
-    p2_values = []
-    p2_hat_values = []
 
-    eig1_values = []
-    eig2_values = []
+    if record not in RECORD_LEVELS:
+        raise ValueError(f"record must be one of {RECORD_LEVELS}")
 
-    eig1_h_values = []
-    eig2_h_values = []
-
-    vecm_values = []
-    vecm_hat_values =[]
-    vecm_norm_values =[]
+    dtype = storage_dtype(dtype)
+    data = data.copy().dropna()
 
     y = data.columns[0]
     x = data.columns[1]
 
-    borrow_costs = []
-    commission_costs = []
-    pnl_values = []
-
-    for i, row in data.iterrows():
-
-        post = data.index.get_loc(i)
-        if post < 252:
-            port_hist.append(get_portfolio_value(cash, active_long_positions, active_short_positions, n_shares, y, x, row[y], row[x]))
-            continue
-
-        # Get prices
-        p1 = row[y]
-        p2 = row[x]
-
-        # Kalman Filter Hedge Ratio
-        y_k = p1
-        x_k = p2
-
-        hedge_ratio.update(x_k, y_k)
-        w0, w1 = hedge_ratio.params
-        hr = w1
-        hr_values.append(hr)
+    strategy = PairsStrategy((y, x), cash, initial_eig, theta, Q_filter=Q_filter, R_filter=R_filter,
+                             norm_window=norm_window, max_pvalue=max_pvalue if signals is None else None,
+                             monitor_window=monitor_window, monitor_lag=monitor_lag, process_noise=process_noise)
+    if profiler is not None:
+        profiler.instrument(strategy)
+        # The ADF test is lazy and would be timed under signals, where entries read it
+        strategy.eager_monitor = True
 
-        p2_hat = (p1 - w0) / w1
-        p2_hat_values.append(p2_hat)
-        p2_values.append(p2)
-
-
-        # Kalman Filter Eigenvector
-        x1 = p1
-        x2 = p2
-
-        if post >= 252:
-            try:
-                k_eig, _, _ = johansen(data.iloc[post - 252:post, :])
-            except:
-                pass
-
-        eig1, eig2 = k_eig
-        eig1_values.append(eig1)
-        eig2_values.append(eig2)
-
-        vecm = eig1 * x1 + eig2 * x2
-        vecm_values.append(vecm)
-        k_eigenvector.update(x1, x2, vecm)
-
-        eig1_h, eig2_h = k_eigenvector.params
-        eig1_h_values.append(eig1_h)
-        eig2_h_values.append(eig2_h)
-
-        vecm_hat = eig1_h * x1 + eig2_h * x2
-        vecm_hat_values.append(vecm_hat)
-        vecm_sample = vecm_hat_values[-252:]
-
-        # Normalize VECM
-        if len(vecm_sample) >= 252:
-            vecm_m = np.nanmean(vecm_sample)
-            vecm_std = np.nanstd(vecm_sample)
+    all_trades = [] if record != 'none' else None
+    pnl_values = []
 
-            if vecm_std != 0:
-                vecm_norm = (vecm_hat - vecm_m) / vecm_std
-            else:
-                vecm_norm = np.nan
+    dates = data.index
+    y_list = data[y].to_numpy(dtype=float).tolist()
+    x_list = data[x].to_numpy(dtype=float).tolist()
+    n_bars = len(data)
+    n_traded = max(n_bars - 252, 0)
+
+    if signals is not None:
+        if len(signals['vecm_norm']) != n_bars:
+            raise ValueError("signals were computed on different data")
+        hr_list = signals['hr'].tolist()
+        vecm_norm_list = signals['vecm_norm'].tolist()
+        if max_pvalue is None:
+            cointegrated = [True] * n_bars
+        elif 'adf_stat' in signals:
+            cointegrated = (signals['adf_stat'] <= adf_critical_value(max_pvalue)).tolist()
         else:
-            vecm_norm = np.nan
-
-        vecm_norm_values.append(vecm_norm)
-
-
-        # Check signals
-
-        #Open positions
-
-        if vecm_norm > theta and not active_long_positions and not active_short_positions:
-
-            #  Long ticker y
-
-            available_cash = cash * 0.4
-            n_shares_long_position = available_cash // (p1 * (1 + COM))
-
-            if available_cash > p1 * n_shares_long_position * (1 + COM) and n_shares_long_position > 0:
-                cost_y = p1 * n_shares_long_position * (1 + COM)
-                cash -= cost_y
-                long_y = Operation(
-                    ticker=y,
-                    time=i,
-                    entry_price=p1,
-                    exit_price=0.0,
-                        n_shares=n_shares_long_position,
-                        type='LONG'
-                    )
-                
-                active_long_positions.append(long_y)
-                all_trades.append(long_y)
-            
-            # Short ticker x
-            n_shares_short_position = int(n_shares_long_position * hr)
-            cost_x = p2 * n_shares_short_position * COM
-            if cash > cost_x and n_shares_short_position > 0:
-                cash -= cost_x
-                short_x = Operation(
-                    ticker=x,
-                    time=i,
-                    entry_price=p2,
-                    exit_price=0.0,
-                        n_shares=n_shares_short_position,
-                        type='SHORT'
-                    )
-                
-                active_short_positions.append(short_x)
-                all_trades.append(short_x)
-
-
-        if vecm_norm < -theta and not active_long_positions and not active_short_positions:
-
-            # Short ticker y
-
-            available_cash = cash * 0.4
-            n_shares_short_position = available_cash // (p1 * (1 + COM))
-
-            if available_cash > p1 * n_shares_short_position * (1 + COM) and n_shares_short_position > 0:
-                cost_y = p1 * n_shares_short_position * COM
-                cash -= cost_y
-                short_y = Operation(
-                    ticker=y,
-                    time=i,
-                    entry_price=p1,
-                    exit_price=0.0,
-                        n_shares=n_shares_short_position,
-                        type='SHORT'
-                    )
-                
-                active_short_positions.append(short_y)
-                all_trades.append(short_y)
-
-            # Long ticker x
-            n_shares_long_position = int(n_shares_short_position * hr)
-            cost_x = p2 * n_shares_long_position * (1 + COM)
-            if cash > cost_x and n_shares_long_position > 0:
-                cash -= cost_x
-                long_x = Operation(
-                    ticker=x,
-                    time=i,
-                    entry_price=p2,
-                    exit_price=0.0,
-                        n_shares=n_shares_long_position,
-                        type='LONG'
-                    )
-                
-                active_long_positions.append(long_x)
-                all_trades.append(long_x)
-
-        # Close positions
-        if abs(vecm_norm) < 0.05:
-
-            # Close long positions
-            for position in active_long_positions.copy():
-                if position.ticker == y:
-                    cash += row[y] * position.n_shares * (1 - COM)
-                    commission_costs.append(row[y] * position.n_shares * COM)
-                    pnl_values.append((row[y] * position.n_shares * (1 - COM)) - (position.entry_price * position.n_shares * (1+COM)))
-                    position.exit_price = row[y]
-
-                if position.ticker == x:
-                    cash += row[x] * position.n_shares * (1 - COM)
-                    commission_costs.append(row[x] * position.n_shares * COM)
-                    pnl_values.append((row[x] * position.n_shares * (1 - COM)) - (position.entry_price * position.n_shares * (1+COM)))
-                    position.exit_price = row[x]
-                    
-                active_long_positions.remove(position)
-
-            # Close short positions
-
-            # Borrow cost
-            for position in active_short_positions.copy():
-                if position.ticker == y:
-                    cash -= row[y] * position.n_shares * BORROW_RATE
-                    borrow_costs.append(row[y] * position.n_shares * BORROW_RATE)
-                if position.ticker == x:
-                    cash -= row[x] * position.n_shares * BORROW_RATE
-                    borrow_costs.append(row[x] * position.n_shares * BORROW_RATE)
-
-            # Close short positions
-            for position in active_short_positions.copy():
-                if position.ticker == y:
-                    pnl = (position.entry_price - row[y]) * position.n_shares
-                    com = row[y] * position.n_shares * COM
-                    cash += pnl - com
-                    commission_costs.append(com)
-                    pnl_values.append(pnl)
-                    position.exit_price = row[y]
-
-                if position.ticker == x:
-                    pnl = (position.entry_price - row[x]) * position.n_shares
-                    com = row[x] * position.n_shares * COM
-                    cash += pnl - com
-                    commission_costs.append(com)
-                    pnl_values.append(pnl)
-                    position.exit_price = row[x]
-
-                active_short_positions.remove(position)
-        
-
-        port_hist.append(get_portfolio_value(cash, active_long_positions, active_short_positions, n_shares, y, x, row[y], row[x]))
-
-    # Close remaining positions at the end of the backtest
-
-    for position in active_long_positions.copy():
-        if position.ticker == y:
-            cash += row[y] * position.n_shares * (1 - COM)
-            commission_costs.append(row[y] * position.n_shares * COM)
-            pnl_values.append((row[y] * position.n_shares * (1 - COM)) - (position.entry_price * position.n_shares * (1+COM)))
-            position.exit_price = row[y]
-
-        if position.ticker == x:
-            cash += row[x] * position.n_shares * (1 - COM)
-            commission_costs.append(row[x] * position.n_shares * COM)
-            pnl_values.append((row[x] * position.n_shares * (1 - COM)) - (position.entry_price * position.n_shares * (1+COM)))
-            position.exit_price = row[x]
-
-    for position in active_short_positions.copy():
-        if position.ticker == y:
-            pnl = (position.entry_price - row[y]) * position.n_shares
-            com = row[y] * position.n_shares * COM
-            cash += pnl - com
-            commission_costs.append(com)
-            pnl_values.append(pnl)
-            position.exit_price = row[y]
+            raise ValueError("max_pvalue needs signals computed with a monitor_window")
+
+    # Preallocated output columns, only for what is recorded
+    port_hist = np.empty(n_bars, dtype=dtype) if record != 'none' else None
+    record_traces = record == 'full' and signals is None
+    if record_traces:
+        traces = np.empty((5, n_traded), dtype=dtype)
+        hr_values, p2_hat_values, vecm_values, vecm_hat_values, vecm_norm_values = traces
+        monitor = strategy.monitor
+        adf_stat_values = np.empty(n_traded, dtype=dtype) if monitor is not None else None
+
+    def record_orders(orders):
+        for order in orders:
+            if order.action == 'OPEN':
+                if all_trades is not None:
+                    all_trades.append(order.operation)
+            else:
+                pnl_values.append(order.pnl)
+
+    if profiler is not None:
+        profiler.start()
+    try:
+        for post in range(n_bars):
+            if signals is None:
+                orders, value = strategy.on_bar(dates[post], y_list[post], x_list[post])
+            else:
+                orders, value = strategy.on_signals(dates[post], y_list[post], x_list[post], hr_list[post],
+                                                    vecm_norm_list[post], cointegrated[post])
+            if orders:
+                record_orders(orders)
+
+            if port_hist is not None:
+                port_hist[post] = value
+
+            if record_traces and post >= 252:
+                t = post - 252
+                hr_values[t] = strategy.hr
+                p2_hat_values[t] = strategy.p2_hat
+                vecm_values[t] = strategy.vecm
+                vecm_hat_values[t] = strategy.vecm_hat
+                vecm_norm_values[t] = strategy.vecm_norm
+                if monitor is not None:
+                    adf_stat_values[t] = monitor.stat
+
+        # Close remaining positions at the end of the backtest
+        record_orders(strategy.close_all())
+    finally:
+        # Always stop, so a failed run does not leave tracemalloc running
+        if profiler is not None:
+            profiler.stop(n_bars)
 
-        if position.ticker == x:
-            pnl = (position.entry_price - row[x]) * position.n_shares
-            com = row[x] * position.n_shares * COM
-            cash += pnl - com
-            commission_costs.append(com)
-            pnl_values.append(pnl)
-            position.exit_price = row[x]
+    # Trade statistics
+    stats = trade_statistics(pnl_values)
+
+    result = BacktestResult(
+        portfolio_value=pd.Series(port_hist) if port_hist is not None else None,
+        final_cash=strategy.cash,
+        stats=stats,
+        borrow_costs=strategy.borrow_costs,
+        commission_costs=strategy.commission_costs,
+        trades=all_trades,
+        record=record,
+        pnl_values=np.array(pnl_values),
+        profile=profiler.report() if profiler is not None else None,
+    )
+    if record == 'full' and signals is not None:
+        # The traces are the cached signals themselves
+        hr_values, p2_hat_values, vecm_values, vecm_hat_values, vecm_norm_values = (
+            np.array(signals[name][252:], dtype=dtype) for name in ('hr', 'p2_hat', 'vecm', 'vecm_hat', 'vecm_norm'))
+        adf_stat_values = np.array(signals['adf_stat'][252:], dtype=dtype) if max_pvalue is not None else None
+    if record == 'full':
+        result.p2_values = np.array(x_list[252:], dtype=dtype)
+        result.p2_hat_values = p2_hat_values
+        result.vecm_values = vecm_values
+        result.vecm_hat_values = vecm_hat_values
+        result.vecm_norm_values = vecm_norm_values
+        result.hr_values = hr_values
+        result.adf_stat_values = adf_stat_values
+    if max_pvalue is not None:
+        result.blocked_entries = strategy.blocked_entries
+
+    return result
+
+
+def trade_statistics(pnl_values: list) -> dict:
+    """
+    Compute the trade statistics of a backtest from the P&L of each closed leg.
 
-    active_long_positions = []
-    active_short_positions = []
+    Parameters:
+    pnl_values (list): The P&L of each closed leg.
 
-    # Cost summaries
-    borrow_costs = sum(borrow_costs)
-    commission_costs = sum(commission_costs)
+    Returns:
+    dict: Total trades, wins, losses, win rate, average win and loss, win/loss ratio and profit factor.
+    """
 
-    # Trade statistics
     pnl = np.array(pnl_values)
     stats = {
         "total_trades": pnl.size,
@@ -319,6 +203,4 @@ def backtest(data: pd.DataFrame,cash: float, initial_eig, theta) -> tuple[pd.Ser
         )
     }
 
-
-    return pd.Series(port_hist), cash, stats,  p2_values, p2_hat_values, vecm_values, vecm_hat_values, \
-    vecm_norm_values, hr_values, borrow_costs, commission_costs, all_trades
\ No newline at end of file
+    return stats
@@ -1,37 +1,82 @@
 import numpy as np
 
 class KalmanFilterReg():
-    def __init__(self, Q_filter: float = 0.01, R_filter: float = 10, P_filter: float = 0.1):
+    def __init__(self, Q_filter: float = 0.01, R_filter: float = 10, P_filter: float = 0.1,
+                 process_noise: bool = False):
         """
         Initialize the Kalman Filter for linear regression.
-        
+
         Parameters:
-        Q_filter : float: Process noise covariance.
+        Q_filter : float: Process noise covariance, only used with process_noise.
         R_filter : float: Measurement noise covariance.
         P_filter : float: Initial estimation error covariance.
-        
-        """
-        
-        self.w = np.zeros(2)
+        process_noise : bool: Run predict before each update so Q_filter is added to the error
+                        covariance. Off by default, which keeps the weights a random walk without noise.
 
-        # Transaction Matrix 
-        self.A = np.eye(2)  
+        """
 
-        # Noise in estimations
-        self.Q = np.eye(2) * Q_filter
+        # The transition matrix is the identity and the noises are scalars, so the state
+        # is kept as plain floats and each update runs without allocating arrays. The
+        # arithmetic is regrouped against the matrix form, so estimates differ by rounding
+        # (up to about 1e-7 on the eigenvector VECM over a few thousand bars)
+        self._q = float(Q_filter)
+        self._r = float(R_filter)
+        self.process_noise = process_noise
 
-        # Noise in observations
-        self.R = np.array([[1]]) * R_filter
+        # Estimations
+        self._w0 = 0.0
+        self._w1 = 0.0
 
         # Error in covariance prediction
-        self.P = np.eye(2) * P_filter
+        self._p00 = float(P_filter)
+        self._p01 = 0.0
+        self._p10 = 0.0
+        self._p11 = float(P_filter)
+
+    @property
+    def w(self) -> np.ndarray:
+        """
+        Get the current state estimate.
+
+        Returns:
+        np.ndarray: A read-only copy of the state vector (intercept and slope). Assign to w to change it.
+        """
+
+        w = np.array([self._w0, self._w1])
+        w.flags.writeable = False
+        return w
+
+    @w.setter
+    def w(self, value):
+        self._w0, self._w1 = (float(v) for v in value)
+
+    @property
+    def P(self) -> np.ndarray:
+        """
+        Get the current error covariance.
+
+        Returns:
+        np.ndarray: A read-only copy of the 2x2 error covariance matrix. Assign to P to change it.
+        """
+
+        P = np.array([[self._p00, self._p01], [self._p10, self._p11]])
+        P.flags.writeable = False
+        return P
+
+    @P.setter
+    def P(self, value):
+        value = np.asarray(value, dtype=float)
+        self._p00, self._p01 = float(value[0, 0]), float(value[0, 1])
+        self._p10, self._p11 = float(value[1, 0]), float(value[1, 1])
 
     def predict(self):
         """
         Predict the next state.
         """
-        
-        self.P = self.A @ self.P @ self.A.T + self.Q
+
+        # A is the identity, so A @ P @ A.T + Q only adds Q to the diagonal
+        self._p00 += self._q
+        self._p11 += self._q
 
     def update(self,x, y, vecm = None):
         """
@@ -43,35 +88,177 @@ class KalmanFilterReg():
         vecm : float or None: Optional vector error correction model value.
         """
 
+        if self.process_noise:
+            self.predict()
+
         if vecm is not None:
-            y_n = vecm  
-            C = np.array([[x, y]]) 
-        
+            y_n = vecm
+            c0, c1 = x, y
+
         else:
             y_n = y
-            C = np.array([[1, x]])
-        
-        y_pred = C @ self.w
+            c0, c1 = 1.0, x
 
-        S = C @ self.P @ C.T + self.R
-        K = self.P @ C.T @ np.linalg.inv(S)
+        p00, p01, p10, p11 = self._p00, self._p01, self._p10, self._p11
 
-        # Update error in covariance prediction
-        self.P = (np.eye(2) - K @ C) @ self.P
+        y_pred = c0 * self._w0 + c1 * self._w1
+
+        # Scalar innovation: S = C P C' + R and K = P C' / S
+        pc0 = p00 * c0 + p01 * c1
+        pc1 = p10 * c0 + p11 * c1
+        s = c0 * pc0 + c1 * pc1 + self._r
+        k0 = pc0 / s
+        k1 = pc1 / s
+
+        # Update error in covariance prediction => (I - K C) P
+        cp0 = c0 * p00 + c1 * p10
+        cp1 = c0 * p01 + c1 * p11
+        self._p00 = p00 - k0 * cp0
+        self._p01 = p01 - k0 * cp1
+        self._p10 = p10 - k1 * cp0
+        self._p11 = p11 - k1 * cp1
 
         # Update estimations => x_t| t
-        self.w = self.w + (K.flatten() * (y_n - y_pred))    
-        
+        e = y_n - y_pred
+        self._w0 += k0 * e
+        self._w1 += k1 * e
+
+    def filter(self, x, y, vecm = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Run update over whole series of observations.
+
+        PairsStrategy calls update bar by bar. This whole-series form is for offline
+        callers such as benchmarks.py.
+
+        Parameters:
+        x : array-like: The independent variable observations.
+        y : array-like: The dependent variable observations.
+        vecm : array-like or None: Optional vector error correction model values.
+
+        Returns:
+        tuple[np.ndarray, np.ndarray]: The (n, 2) weights and (n, 2, 2) covariances after each update.
+        """
+
+        x = np.asarray(x, dtype=float).tolist()
+        y = np.asarray(y, dtype=float).tolist()
+        if vecm is None:
+            obs = zip([1.0] * len(x), x, y)
+        else:
+            obs = zip(x, y, np.asarray(vecm, dtype=float).tolist())
+
+        n = len(x)
+        weights = np.empty((n, 2))
+        covariances = np.empty((n, 2, 2))
+
+        w0, w1 = self._w0, self._w1
+        p00, p01, p10, p11 = self._p00, self._p01, self._p10, self._p11
+        r = self._r
+        q = self._q if self.process_noise else 0.0
+
+        # Same recursion as update, kept in locals for the whole series
+        for t, (c0, c1, y_n) in enumerate(obs):
+            if q:
+                p00 += q
+                p11 += q
+
+            pc0 = p00 * c0 + p01 * c1
+            pc1 = p10 * c0 + p11 * c1
+            s = c0 * pc0 + c1 * pc1 + r
+            k0 = pc0 / s
+            k1 = pc1 / s
+
+            cp0 = c0 * p00 + c1 * p10
+            cp1 = c0 * p01 + c1 * p11
+            p00, p01, p10, p11 = p00 - k0 * cp0, p01 - k0 * cp1, p10 - k1 * cp0, p11 - k1 * cp1
+
+            e = y_n - (c0 * w0 + c1 * w1)
+            w0 += k0 * e
+            w1 += k1 * e
+
+            weights[t] = w0, w1
+            covariances[t] = (p00, p01), (p10, p11)
+
+        self._w0, self._w1 = w0, w1
+        self._p00, self._p01, self._p10, self._p11 = p00, p01, p10, p11
+
+        return weights, covariances
+
     @property
     def params(self):
         """
         Get the current parameters of the Kalman Filter.
-        
+
         Returns:
         tuple: The current parameters (intercept and slope).
         """
 
-        return self.w[0], self.w[1]
+        return self._w0, self._w1
+
+
+def kalman_filter_batch(x, y, vecm=None, Q_filter: float = 0.01, R_filter: float = 10, P_filter: float = 0.1,
+                        process_noise: bool = False) -> np.ndarray:
+    """
+    Run independent KalmanFilterReg filters over many series at once.
+
+    Each column is filtered exactly as KalmanFilterReg.filter would, with the
+    update vectorized across columns at every step.
+
+    Parameters:
+    x : np.ndarray: The (T, N) independent variable observations.
+    y : np.ndarray: The (T, N) dependent variable observations.
+    vecm : np.ndarray or None: Optional (T, N) vector error correction model values.
+    Q_filter : float: Process noise covariance, only used with process_noise.
+    R_filter : float: Measurement noise covariance.
+    P_filter : float: Initial estimation error covariance.
+    process_noise : bool: Add Q_filter to the error covariance before each update, as KalmanFilterReg does.
+
+    Returns:
+    np.ndarray: The (T, N, 2) weights after each update.
+    """
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n_obs, n_series = x.shape
+
+    if vecm is None:
+        c0_all, c1_all, target = np.ones_like(x), x, y
+    else:
+        c0_all, c1_all, target = x, y, np.asarray(vecm, dtype=float)
+
+    weights = np.empty((n_obs, n_series, 2))
+    w0 = np.zeros(n_series)
+    w1 = np.zeros(n_series)
+    p00 = np.full(n_series, float(P_filter))
+    p01 = np.zeros(n_series)
+    p10 = np.zeros(n_series)
+    p11 = np.full(n_series, float(P_filter))
+    r = float(R_filter)
+    q = float(Q_filter) if process_noise else 0.0
+
+    for t in range(n_obs):
+        c0, c1, y_n = c0_all[t], c1_all[t], target[t]
+
+        # Predict, A is the identity so only Q is added to the diagonal
+        if q:
+            p00 = p00 + q
+            p11 = p11 + q
+
+        pc0 = p00 * c0 + p01 * c1
+        pc1 = p10 * c0 + p11 * c1
+        s = c0 * pc0 + c1 * pc1 + r
+        k0 = pc0 / s
+        k1 = pc1 / s
+
+        cp0 = c0 * p00 + c1 * p10
+        cp1 = c0 * p01 + c1 * p11
+        p00, p01, p10, p11 = p00 - k0 * cp0, p01 - k0 * cp1, p10 - k1 * cp0, p11 - k1 * cp1
+
+        e = y_n - (c0 * w0 + c1 * w1)
+        w0 = w0 + k0 * e
+        w1 = w1 + k1 * e
 
+        weights[t, :, 0] = w0
+        weights[t, :, 1] = w1
 
+    return weights
 
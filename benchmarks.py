@@ -0,0 +1,468 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from synthetic_data import cointegrated_pair, cointegrated_universe
+
+
+# Data sizes of each benchmark, the quick set is used by --quick
+SIZES = {
+    'kalman_filter': [1000, 10000, 100000],
+    'johansen': [1000, 3000, 10000],
+    'rolling_johansen': [1000, 3000],
+    'backtest': [1000, 3000, 10000],
+    'screener': [8, 16],
+    'metrics_batch': [100, 1000],
+}
+QUICK_SIZES = {
+    'kalman_filter': [1000],
+    'johansen': [1000],
+    'rolling_johansen': [1000],
+    'backtest': [1000],
+    'screener': [8],
+    'metrics_batch': [100],
+}
+
+# Import time budgets in seconds, checked by --imports. Entry points and the modules worker
+# processes import may only load numpy and pandas eagerly, statsmodels, yfinance, seaborn
+# and matplotlib are imported by the code paths that use them.
+IMPORT_BUDGETS = {
+    'cli': 0.05,
+    'cointegration_functions': 0.3,
+    'strategy': 1.0,
+    'Backtesting': 1.0,
+    'metrics': 1.0,
+    'data_utils': 1.0,
+    'main': 1.0,
+    'sweep': 1.0,
+    'walk_forward': 1.0,
+    'cointegration_test': 1.0,
+    'portfolio_backtest': 1.0,
+}
+
+
+def _kalman_filter(size: int):
+    from Kalman_structure import KalmanFilterReg
+
+    data = cointegrated_pair(size, seed=0)
+    x, y = data['X'].to_numpy(), data['Y'].to_numpy()
+
+    def run():
+        return KalmanFilterReg(Q_filter=0.01, R_filter=0.0001).filter(x, y)[0]
+
+    def fingerprint(weights):
+        return [weights[-1, 0], weights[-1, 1], weights.sum()]
+
+    return run, fingerprint
+
+
+def _johansen(size: int):
+    from cointegration_functions import johansen
+
+    data = cointegrated_pair(size, seed=0)
+
+    def run():
+        return johansen(data)
+
+    def fingerprint(result):
+        eigenvector, critical_value95, trace_stat = result
+        return [*eigenvector, critical_value95, trace_stat]
+
+    return run, fingerprint
+
+
+def _rolling_johansen(size: int):
+    from rolling_johansen import RollingJohansen
+
+    values = cointegrated_pair(size, seed=0).to_numpy()
+
+    def run():
+        rolling_johansen = RollingJohansen(window=252)
+        result = None
+        for prices in values:
+            if rolling_johansen.ready:
+                result = rolling_johansen.result()
+            rolling_johansen.update(prices)
+        return result
+
+    def fingerprint(result):
+        eigenvector, critical_value95, trace_stat = result
+        return [*eigenvector, critical_value95, trace_stat]
+
+    return run, fingerprint
+
+
+def _backtest(size: int):
+    from Backtesting import backtest
+
+    data = cointegrated_pair(size, seed=0, breaks=size // 2000)
+
+    def run():
+        return backtest(data, 1_000_000, np.array([1.0, -1.3]), 0.5)
+
+    def fingerprint(result):
+        return [result.portfolio_value.iloc[-1], result.portfolio_value.sum(), result.final_cash,
+                result.borrow_costs, result.commission_costs, len(result.trades)]
+
+    return run, fingerprint
+
+
+def _screener(size: int):
+    from cointegration_test import cointegration_test
+    from price_store import PriceStore
+
+    prices, sectors = cointegrated_universe(size, n_bars=2000, n_sectors=2, seed=0, breaks=1)
+    # The store lives as long as run, which holds the directory
+    store_dir = tempfile.TemporaryDirectory(prefix="bench_store_")
+    store = PriceStore(store_dir.name)
+    for ticker in prices.columns:
+        store.write(ticker, prices[ticker])
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return cointegration_test(store_dir=store_dir.name, offline=True, tickers=sectors)
+
+    def fingerprint(result):
+        df_results, df_filtrado = result
+        return [df_results['Strength'].sum(), df_results['corr'].sum(), len(df_filtrado)]
+
+    return run, fingerprint
+
+
+def _metrics_batch(size: int):
+    from metrics import metrics_batch
+
+    rng = np.random.default_rng(0)
+    curves = 1_000_000 * np.cumprod(1 + rng.normal(2e-4, 0.01, (2520, size)), axis=0)
+
+    def run():
+        return metrics_batch(curves)
+
+    def fingerprint(table):
+        return np.nansum(table.to_numpy(), axis=0).tolist()
+
+    return run, fingerprint
+
+
+BENCHMARKS = {
+    'kalman_filter': _kalman_filter,
+    'johansen': _johansen,
+    'rolling_johansen': _rolling_johansen,
+    'backtest': _backtest,
+    'screener': _screener,
+    'metrics_batch': _metrics_batch,
+}
+
+
+def run_benchmark(name: str, size: int, repeat: int = 5) -> dict:
+    """
+    Time one benchmark at one data size and measure its peak memory.
+
+    The data is generated before timing starts. The timed runs are repeated
+    `repeat` times and a separate run is traced with tracemalloc for the peak memory.
+
+    Parameters:
+    name : str: Name of the benchmark, a key of BENCHMARKS.
+    size : int: Data size (bars, names or curves depending on the benchmark).
+    repeat : int: Number of timed runs.
+
+    Returns:
+    dict: Minimum and median time in seconds, peak memory in MB and the output fingerprint.
+    """
+
+    run, fingerprint = BENCHMARKS[name](size)
+
+    # Warm-up run, also gives the output fingerprint
+    result = run()
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'min': min(times),
+        'median': float(np.median(times)),
+        'peak_mb': peak / 2**20,
+        'fingerprint': [float(v) for v in fingerprint(result)],
+    }
+
+
+def run_suite(names: list = None, quick: bool = False, repeat: int = 5) -> dict:
+    """
+    Run the benchmarks at each of their data sizes.
+
+    Parameters:
+    names : list: Benchmarks to run. Defaults to all of them.
+    quick : bool: Run only the smallest size of each benchmark.
+    repeat : int: Number of timed runs of each benchmark.
+
+    Returns:
+    dict: Environment details and the results keyed by "name[size]".
+    """
+
+    sizes = QUICK_SIZES if quick else SIZES
+    results = {}
+    for name in names or BENCHMARKS:
+        for size in sizes[name]:
+            key = f"{name}[{size}]"
+            results[key] = run_benchmark(name, size, repeat=repeat)
+            res = results[key]
+            print(f"{key:<26} min {res['min'] * 1e3:10.2f} ms  median {res['median'] * 1e3:10.2f} ms  "
+                  f"peak {res['peak_mb']:8.2f} MB")
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+        },
+        'results': results,
+    }
+
+
+def import_time(module: str, repeat: int = 5) -> float:
+    """
+    Measure the import time of a module in a fresh interpreter with `python -X importtime`.
+
+    Parameters:
+    module : str: Name of the module, imported from the folder of this file.
+    repeat : int: Number of interpreters started.
+
+    Returns:
+    float: The minimum cumulative import time in seconds.
+    """
+
+    times = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True,
+                             text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        # Lines read "import time: self [us] | cumulative [us] | package"
+        for line in out.stderr.splitlines():
+            fields = line.split('|')
+            if len(fields) == 3 and fields[2].strip() == module:
+                times.append(int(fields[1]) / 1e6)
+
+    return min(times)
+
+
+def check_import_budgets(budgets: dict = None, repeat: int = 5) -> pd.DataFrame:
+    """
+    Check the import time of each module against its budget.
+
+    Parameters:
+    budgets : dict: Module names mapped to their budget in seconds. Defaults to IMPORT_BUDGETS.
+    repeat : int: Number of interpreters started per module.
+
+    Returns:
+    pd.DataFrame: One row per module with its import time, budget and whether it is over budget.
+    """
+
+    rows = []
+    for module, budget in (budgets or IMPORT_BUDGETS).items():
+        seconds = import_time(module, repeat=repeat)
+        rows.append({'module': module, 'import_ms': seconds * 1e3, 'budget_ms': budget * 1e3,
+                     'over_budget': seconds > budget})
+
+    return pd.DataFrame(rows)
+
+
+def _peak_mb(func):
+    # Result of func and the peak of the memory it allocated, numpy buffers included
+    tracemalloc.start()
+    try:
+        result = func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, peak / 2**20
+
+
+def compare_precision(n_names: int = 100, n_bars: int = 3780, seed: int = 0) -> pd.DataFrame:
+    """
+    Compare the float32 storage mode against the float64 path on synthetic data.
+
+    The batched screen runs on a universe of `n_names` names (every pair of each sector),
+    the backtest records every trace of one pair, and the sweep metrics are computed from
+    20 equity curves stored in either dtype.
+
+    Parameters:
+    n_names : int: Number of names of the screened universe.
+    n_bars : int: Number of daily bars, 3780 is 15 years.
+    seed : int: Seed of the synthetic data.
+
+    Returns:
+    pd.DataFrame: One row per output with its largest absolute and relative error, the share of
+                  pass/fail decisions (or trades) that agree, and the peak memory of both modes in MB.
+    """
+
+    from Backtesting import backtest
+    from cointegration_test import cointegration_test
+    from metrics import metrics_batch
+    from price_store import PriceStore
+
+    def errors(name, exact, compact, agree=np.nan, mb=(np.nan, np.nan)):
+        exact = np.asarray(exact, dtype=float)
+        compact = np.asarray(compact, dtype=float)
+        abs_error = np.abs(exact - compact)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rel_error = abs_error / np.abs(exact)
+        return {'output': name, 'max_abs_error': float(np.nanmax(abs_error)),
+                'max_rel_error': float(np.nanmax(rel_error[np.isfinite(rel_error)], initial=0.0)),
+                'agreement': agree, 'mb_float64': mb[0], 'mb_float32': mb[1]}
+
+    rows = []
+
+    # Universe screen
+    prices, sectors = cointegrated_universe(n_names, n_bars=n_bars, n_sectors=max(n_names // 25, 1), seed=seed,
+                                            breaks=1)
+    with tempfile.TemporaryDirectory(prefix="bench_store_") as store_dir:
+        store = PriceStore(store_dir)
+        for ticker in prices.columns:
+            store.write(ticker, prices[ticker])
+
+        screens = {}
+        for dtype in ('float64', 'float32'):
+            with contextlib.redirect_stdout(io.StringIO()):
+                screens[dtype] = _peak_mb(lambda: cointegration_test(store_dir=store_dir, offline=True, tickers=sectors,
+                                                                     batched=True, dtype=dtype)[0])
+
+    (exact, mb64), (compact, mb32) = screens['float64'], screens['float32']
+    rows.append(errors('screen corr', exact['corr'], compact['corr'], mb=(mb64, mb32)))
+    rows.append(errors('screen pvalue_adf', exact['pvalue_adf'], compact['pvalue_adf'],
+                       np.mean((exact['pvalue_adf'] < 0.05) == (compact['pvalue_adf'] < 0.05))))
+    rows.append(errors('screen Strength', exact['Strength'], compact['Strength'],
+                       np.mean(exact['johansen_pass'] == compact['johansen_pass'])))
+
+    # Backtest traces
+    pair = cointegrated_pair(n_bars, seed=seed, breaks=n_bars // 2000)
+    results = {dtype: _peak_mb(lambda: backtest(pair, 1_000_000, np.array([1.0, -1.3]), 0.5, dtype=dtype))
+               for dtype in ('float64', 'float32')}
+    (exact, mb64), (compact, mb32) = results['float64'], results['float32']
+    same_trades = float(exact.final_cash == compact.final_cash and np.array_equal(exact.pnl_values, compact.pnl_values))
+    rows.append(errors('backtest portfolio_value', exact.portfolio_value, compact.portfolio_value, same_trades,
+                       (mb64, mb32)))
+    for name in ('hr_values', 'vecm_norm_values'):
+        rows.append(errors(f"backtest {name}", getattr(exact, name), getattr(compact, name)))
+
+    # Sweep metrics from the stored equity curves
+    rng = np.random.default_rng(seed)
+    curves = 1_000_000 * np.cumprod(1 + rng.normal(2e-4, 0.01, (n_bars, 20)), axis=0)
+    exact = metrics_batch(curves)
+    compact = metrics_batch(curves.astype(np.float32))
+    for column in exact.columns:
+        rows.append(errors(f"sweep {column}", exact[column], compact[column]))
+
+    return pd.DataFrame(rows)
+
+
+def compare(current: dict, baseline: dict, tolerance: float = 0.25) -> pd.DataFrame:
+    """
+    Compare a benchmark run against a stored baseline.
+
+    A benchmark regresses when its minimum time is more than `tolerance` slower than
+    the baseline, and its output changed when the fingerprints differ beyond float rounding.
+
+    Parameters:
+    current : dict: Output of run_suite.
+    baseline : dict: Output of run_suite stored earlier.
+    tolerance : float: Allowed relative slowdown.
+
+    Returns:
+    pd.DataFrame: One row per benchmark found in both runs.
+    """
+
+    rows = []
+    for key, res in current['results'].items():
+        base = baseline['results'].get(key)
+        if base is None:
+            continue
+
+        ratio = res['min'] / base['min'] if base['min'] > 0 else np.nan
+        same_output = (len(res['fingerprint']) == len(base['fingerprint'])
+                       and np.allclose(res['fingerprint'], base['fingerprint'], rtol=1e-9, atol=1e-9, equal_nan=True))
+        rows.append({
+            'benchmark': key,
+            'baseline_ms': base['min'] * 1e3,
+            'current_ms': res['min'] * 1e3,
+            'speedup': 1 / ratio if ratio else np.nan,
+            'baseline_mb': base['peak_mb'],
+            'current_mb': res['peak_mb'],
+            'same_output': same_output,
+            'regression': bool(ratio > 1 + tolerance),
+        })
+
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the hot paths on synthetic data.")
+    parser.add_argument('names', nargs='*', help=f"Benchmarks to run, all by default: {', '.join(BENCHMARKS)}.")
+    parser.add_argument('--quick', action='store_true', help="Only the smallest data size of each benchmark.")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', default=None, help="Write the results to this JSON file.")
+    parser.add_argument('--compare', default=None, help="Baseline JSON file to compare against.")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed relative slowdown.")
+    parser.add_argument('--imports', action='store_true', help="Only check the import time budgets.")
+    parser.add_argument('--precision', action='store_true', help="Only compare the float32 mode against float64.")
+    args = parser.parse_args()
+
+    if args.precision:
+        warnings.simplefilter('ignore', FutureWarning)
+        table = compare_precision()
+        print(table.to_string(index=False, float_format=lambda v: f"{v:.3g}"))
+        return
+
+    if args.imports:
+        table = check_import_budgets(repeat=args.repeat)
+        print(table.to_string(index=False, float_format=lambda v: f"{v:.1f}"))
+        if table['over_budget'].any():
+            sys.exit(1)
+        return
+
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    warnings.simplefilter('ignore', FutureWarning)
+
+    current = run_suite(args.names or None, quick=args.quick, repeat=args.repeat)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(current, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        table = compare(current, baseline, tolerance=args.tolerance)
+        print()
+        print(table.to_string(index=False, float_format=lambda v: f"{v:.2f}"))
+        if not table.empty and (table['regression'].any() or not table['same_output'].all()):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import os
+from array import array
+
+import numpy as np
+import pandas as pd
+
+from Backtesting import trade_statistics
+from models import BacktestResult, RECORD_LEVELS, storage_dtype
+from price_store import PriceStore
+from strategy import PairsStrategy
+
+
+# Diagnostic traces backtest_chunked writes with record='full', next to dates and portfolio_value
+TRACE_COLUMNS = ('p2_values', 'p2_hat_values', 'vecm_values', 'vecm_hat_values', 'vecm_norm_values', 'hr_values')
+
+
+def _open_column(out_dir: str, name: str, n: int, dtype):
+    # A .npy file memory-mapped for writing, or a plain array without an output folder
+    if out_dir is None:
+        return np.empty(n, dtype=dtype)
+    return np.lib.format.open_memmap(os.path.join(out_dir, f"{name}.npy"), mode='w+', dtype=dtype, shape=(n,))
+
+
+def backtest_chunked(store: PriceStore, tickers: list, cash: float, initial_eig, theta: float,
+                     Q_filter: float = 0.01, R_filter: float = 0.0001, norm_window: int = 252,
+                     chunk_size: int = 100_000, record: str = 'equity', out_dir: str = None,
+                     profiler=None, dtype=None, process_noise: bool = False) -> BacktestResult:
+    """
+    Backtest the pairs trading strategy on a price history streamed from a PriceStore in chunks.
+
+    The same PairsStrategy as backtest runs over every chunk, so the Kalman filters, the
+    Johansen and normalization windows, the cash and the open positions carry across
+    chunk boundaries and the result is the one backtest gives on the whole history.
+    Only one chunk of prices is in memory at a time. With `out_dir` the recorded columns
+    are written to .npy files as the chunks go and come back memory-mapped, so peak
+    memory is bounded by the chunk size rather than by the length of the history.
+
+    Parameters:
+    store : PriceStore: The store holding both tickers, e.g. years of minute bars.
+    tickers : list: The (y, x) ticker symbols, aligned on their common dates.
+    cash : float: Initial cash for the portfolio.
+    initial_eig : array-like: Initial eigenvector for the VECM.
+    theta : float: Threshold for opening and closing positions based on normalized VECM.
+    Q_filter : float: Process noise covariance of both Kalman filters, only used with process_noise.
+    R_filter : float: Measurement noise covariance of both Kalman filters.
+    norm_window : int: Number of bars used to normalize the VECM.
+    chunk_size : int: Maximum number of bars read from each ticker per chunk.
+    record : str: 'none', 'equity' or 'full', as in backtest. Opened legs are only kept from 'equity' on.
+    out_dir : str: Folder the recorded columns are written to (dates, portfolio_value and, with
+                   record='full', the traces). Without it they are kept in memory and the dates dropped.
+    profiler : StageProfiler: Optional profiler that times each stage of the loop, see profiling.py.
+               Its report is returned in result.profile.
+    dtype : str: Dtype of the recorded columns, 'float64' (default) or 'float32' for half the memory and disk.
+    process_noise : bool: Add Q_filter to the error covariance of both Kalman filters before each update.
+
+    Returns:
+    BacktestResult: The same fields as backtest, with the portfolio value indexed by bar number
+                    like backtest. Its dates are in dates.npy of `out_dir`.
+    """
+
+    if record not in RECORD_LEVELS:
+        raise ValueError(f"record must be one of {RECORD_LEVELS}")
+    dtype = storage_dtype(dtype)
+
+    y, x = tickers
+    strategy = PairsStrategy((y, x), cash, initial_eig, theta, Q_filter=Q_filter, R_filter=R_filter,
+                             norm_window=norm_window, process_noise=process_noise)
+    if profiler is not None:
+        profiler.instrument(strategy)
+
+    all_trades = [] if record != 'none' else None
+    pnl_values = array('d')
+
+    def record_orders(orders):
+        for order in orders:
+            if order.action == 'OPEN':
+                if all_trades is not None:
+                    all_trades.append(order.operation)
+            else:
+                pnl_values.append(order.pnl)
+
+    # Outputs are sized up front from a pass over the dates only
+    columns = {}
+    if record != 'none':
+        if out_dir is not None:
+            os.makedirs(out_dir, exist_ok=True)
+        n_bars = store.count_aligned(tickers, chunk_size)
+        n_traded = max(n_bars - 252, 0)
+        if out_dir is not None:
+            columns['dates'] = _open_column(out_dir, 'dates', n_bars, 'datetime64[ns]')
+        columns['portfolio_value'] = _open_column(out_dir, 'portfolio_value', n_bars, dtype)
+        if record == 'full':
+            for name in TRACE_COLUMNS:
+                columns[name] = _open_column(out_dir, name, n_traded, dtype)
+
+    post = 0
+    if profiler is not None:
+        profiler.start()
+    try:
+        for dates, prices_y, prices_x in store.iter_aligned(tickers, chunk_size):
+            n = len(dates)
+            y_list = prices_y.tolist()
+            x_list = prices_x.tolist()
+
+            # Per chunk buffers, copied to the output columns at the end of the chunk
+            port_hist = np.empty(n) if record != 'none' else None
+            if record == 'full':
+                traces = np.full((5, n), np.nan)
+                hr_values, p2_hat_values, vecm_values, vecm_hat_values, vecm_norm_values = traces
+
+            for k in range(n):
+                orders, value = strategy.on_bar(dates[k], y_list[k], x_list[k])
+                if orders:
+                    record_orders(orders)
+
+                if port_hist is not None:
+                    port_hist[k] = value
+
+                if record == 'full':
+                    hr_values[k] = strategy.hr
+                    p2_hat_values[k] = strategy.p2_hat
+                    vecm_values[k] = strategy.vecm
+                    vecm_hat_values[k] = strategy.vecm_hat
+                    vecm_norm_values[k] = strategy.vecm_norm
+
+            if record != 'none':
+                if out_dir is not None:
+                    columns['dates'][post:post + n] = dates
+                columns['portfolio_value'][post:post + n] = port_hist
+
+            if record == 'full':
+                # Traces start with the first traded bar
+                skip = min(max(252 - post, 0), n)
+                start = max(post - 252, 0)
+                stop = start + n - skip
+                columns['p2_values'][start:stop] = prices_x[skip:]
+                for name, values in zip(('hr_values', 'p2_hat_values', 'vecm_values', 'vecm_hat_values',
+                                         'vecm_norm_values'), traces):
+                    columns[name][start:stop] = values[skip:]
+
+            post += n
+
+        # Close remaining positions at the end of the backtest
+        record_orders(strategy.close_all())
+    finally:
+        # Always stop, so a failed run does not leave tracemalloc running
+        if profiler is not None:
+            profiler.stop(post)
+
+    for values in columns.values():
+        if isinstance(values, np.memmap):
+            values.flush()
+
+    result = BacktestResult(
+        portfolio_value=None,
+        final_cash=strategy.cash,
+        stats=trade_statistics(pnl_values),
+        borrow_costs=strategy.borrow_costs,
+        commission_costs=strategy.commission_costs,
+        trades=all_trades,
+        record=record,
+        pnl_values=np.array(pnl_values),
+        profile=profiler.report() if profiler is not None else None,
+    )
+    if record != 'none':
+        result.portfolio_value = pd.Series(columns['portfolio_value'], copy=False)
+    if record == 'full':
+        for name in TRACE_COLUMNS:
+            setattr(result, name, columns[name])
+
+    return result
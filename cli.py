@@ -0,0 +1,42 @@
+import argparse
+import importlib
+import sys
+
+
+# Subcommands and the module whose main(argv, prog) runs them. A module is only imported
+# when its subcommand runs, so `python cli.py --help` and short jobs start without numpy,
+# pandas, statsmodels or matplotlib.
+COMMANDS = {
+    'backtest': ('main', "Backtest one pair and show or save the charts."),
+    'screen': ('cointegration_test', "Cointegration screen of every pair in each sector."),
+    'sweep': ('sweep', "Parameter sweep of the backtest over a process pool."),
+    'walk-forward': ('walk_forward', "Walk-forward evaluation of the backtest."),
+    'robustness': ('robustness', "Bootstrap confidence intervals of the backtest metrics."),
+    'data-server': ('data_sources', "Serve a price store over the chart API protocol, or benchmark the loader."),
+}
+
+
+def main(argv: list = None):
+    """
+    Entry point of the command line tools, e.g. `python cli.py backtest --theta 0.5 --no-plots`.
+
+    The arguments after the subcommand go to the main function of its module, see
+    `python cli.py <command> --help`.
+
+    Parameters:
+    argv : list: Command line arguments. Defaults to sys.argv[1:].
+    """
+
+    parser = argparse.ArgumentParser(prog="cli.py", description="Pairs trading command line tools.")
+    commands = parser.add_subparsers(dest='command', metavar='command', required=True)
+    for name, (_, description) in COMMANDS.items():
+        commands.add_parser(name, help=description, add_help=False)
+
+    args, rest = parser.parse_known_args(sys.argv[1:] if argv is None else argv)
+
+    module = importlib.import_module(COMMANDS[args.command][0])
+    module.main(rest, prog=f"cli.py {args.command}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
-import statsmodels.api as sm
-from statsmodels.tsa.stattools import adfuller
-from statsmodels.tsa.vector_ar.vecm import coint_johansen
+import numpy as np
+
+# statsmodels takes seconds to import, so it is imported by the functions that need it
 
 
 def correlation(data, window):
@@ -32,6 +32,9 @@ def ols_adf(data):
     tuple: A tuple containing the residuals from the OLS regression and the p-value from the ADF test.
     """
 
+    import statsmodels.api as sm
+    from statsmodels.tsa.stattools import adfuller
+
     data = data.copy()
     y = data.iloc[:, 0]
     x = data.iloc[:, 1]
@@ -56,9 +59,281 @@ def johansen(data, det_order=0, k_ar_diff=1):
     tuple: A tuple containing the first eigenvector, the 95% critical value, and the trace statistic.
     """
 
+    from statsmodels.tsa.vector_ar.vecm import coint_johansen
+
     data = data.copy()
     johansen_res = coint_johansen(data, det_order, k_ar_diff)
     eigenvector = johansen_res.evec[:, 0]
     critical_value95 = johansen_res.cvt[0, 1]
     trace_stat = johansen_res.lr1[0]
     return eigenvector, critical_value95, trace_stat
+
+
+def _float_array(prices) -> np.ndarray:
+    # float32 stacks stay float32, the kernels accumulate their sums in float64 anyway
+    prices = np.asarray(prices)
+    return prices if prices.dtype == np.float32 else prices.astype(np.float64, copy=False)
+
+
+def correlation_batch(prices, window):
+    """
+    Calculate the average rolling correlation of many pairs at once.
+
+    Parameters:
+    prices : np.ndarray: A (T, N_pairs, 2) stack of aligned prices, float64 or float32.
+    window : int: The rolling window size.
+
+    Returns:
+    np.ndarray: The average rolling correlation of each pair, like correlation().
+    """
+
+    prices = _float_array(prices)
+    t_obs = prices.shape[0]
+    if t_obs < window:
+        return np.full(prices.shape[1], np.nan)
+
+    # Demean first so the windowed sums stay small
+    x = prices[:, :, 0] - prices[:, :, 0].mean(axis=0, dtype=np.float64).astype(prices.dtype)
+    y = prices[:, :, 1] - prices[:, :, 1].mean(axis=0, dtype=np.float64).astype(prices.dtype)
+
+    def window_sum(a, b=None):
+        # Products and running sums in float64 whatever the input dtype
+        v = a if b is None else np.multiply(a, b, dtype=np.float64)
+        c = np.concatenate([np.zeros((1, v.shape[1])), np.cumsum(v, axis=0, dtype=np.float64)])
+        return c[window:] - c[:-window]
+
+    sx, sy = window_sum(x), window_sum(y)
+    sxx, syy, sxy = window_sum(x, x), window_sum(y, y), window_sum(x, y)
+
+    cov = sxy - sx * sy / window
+    var_x = sxx - sx * sx / window
+    var_y = syy - sy * sy / window
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = cov / np.sqrt(var_x * var_y)
+    corr[~np.isfinite(corr)] = np.nan
+
+    return np.nanmean(corr, axis=0)
+
+
+def ols_adf_batch(prices, maxlag=None):
+    """
+    Perform the OLS regression and the ADF test on the residuals of many pairs at once.
+
+    The ADF lag length is chosen by AIC over the same sample for every lag, as adfuller does.
+
+    Parameters:
+    prices : np.ndarray: A (T, N_pairs, 2) stack of aligned prices, column 0 regressed on column 1.
+             With float32 prices the residuals and the ADF designs are float32 too.
+    maxlag : int or None: Largest ADF lag to consider. Defaults to adfuller's choice.
+
+    Returns:
+    tuple: A tuple containing the (T, N_pairs) residuals, the ADF statistics and the ADF p-values.
+    """
+
+    from statsmodels.tsa.adfvalues import mackinnonp
+
+    prices = _float_array(prices)
+    dtype = prices.dtype
+    t_obs, n_pairs, _ = prices.shape
+    y = prices[:, :, 0]
+    x = prices[:, :, 1]
+
+    # OLS with constant: y = a + b x
+    x_c = x - x.mean(axis=0, dtype=np.float64).astype(dtype)
+    y_c = y - y.mean(axis=0, dtype=np.float64).astype(dtype)
+    beta = np.multiply(x_c, y_c, dtype=np.float64).sum(axis=0) / np.multiply(x_c, x_c, dtype=np.float64).sum(axis=0)
+    res = (y_c - beta * x_c).astype(dtype, copy=False)
+
+    if maxlag is None:
+        maxlag = int(np.ceil(12.0 * np.power(t_obs / 100.0, 1 / 4.0)))
+        maxlag = min(t_obs // 2 - 2, maxlag)
+
+    # Lag selection: every lag is fit on the rows available to the largest one
+    dres = np.diff(res, axis=0)
+    n = t_obs - 1 - maxlag
+    design = _adf_design(res, dres, maxlag, n)
+    target = dres[-n:].T
+    coef, ssr_full, _ = _ols_basis(design, target)
+
+    # SSR of the nested model with the first j columns, for j = 2 (constant and level) .. K
+    tail = np.cumsum((coef ** 2)[:, ::-1], axis=1)[:, ::-1]
+    n_cols = np.arange(2, maxlag + 3)
+    ssr = ssr_full[:, None] + np.concatenate([tail[:, 2:], np.zeros((n_pairs, 1))], axis=1)
+    aic = n * (np.log(2 * np.pi) + np.log(ssr / n) + 1) + 2 * n_cols
+    best_lag = np.argmin(aic, axis=1)
+
+    # Refit each pair with its own lag on all the rows that lag allows
+    adf_stat = np.empty(n_pairs)
+    for lag in np.unique(best_lag):
+        idx = np.flatnonzero(best_lag == lag)
+        n_lag = t_obs - 1 - lag
+        design = _adf_design(res[:, idx], dres[:, idx], lag, n_lag)
+        # Move the level to the last column so its t-stat comes straight from the QR
+        design = np.concatenate([design[:, :, :1], design[:, :, 2:], design[:, :, 1:2]], axis=2)
+        target = dres[-n_lag:, idx].T
+        coef, ssr_lag, sign = _ols_basis(design, target)
+        sigma = np.sqrt(ssr_lag / (n_lag - design.shape[2]))
+        adf_stat[idx] = coef[:, -1] * sign / sigma
+
+    adf_pvalue = np.array([mackinnonp(stat, regression='c', N=1) for stat in adf_stat])
+
+    return res, adf_stat, adf_pvalue
+
+
+def _ols_basis(design, target):
+    """
+    Regress each target on its design through the orthonormal basis of the design columns.
+
+    Returns the coefficients of the target on the basis, the residual sum of squares and the
+    sign of the last diagonal element of R, so that coef[:, -1] * sign / sigma is the t-stat
+    of the last column. numpy's QR would factor a float64 copy of a float32 design, so float32
+    designs are regressed through their Gram matrices instead, summed in float64 a few pairs
+    at a time: their Cholesky factor is the R of the QR, with a positive diagonal.
+    """
+
+    if design.dtype == np.float32:
+        n_pairs, _, k = design.shape
+        gram = np.empty((n_pairs, k + 1, k + 1))
+        for start in range(0, n_pairs, 16):
+            block = np.concatenate([design[start:start + 16], target[start:start + 16, :, None]], axis=2)
+            block = block.astype(np.float64)
+            np.matmul(block.transpose(0, 2, 1), block, out=gram[start:start + 16])
+        try:
+            low = np.linalg.cholesky(gram[:, :k, :k])
+        except np.linalg.LinAlgError:
+            # Degenerate designs, e.g. a pair with itself, get NaN statistics like with the QR
+            low = np.full((n_pairs, k, k), np.nan)
+            for p in range(n_pairs):
+                try:
+                    low[p] = np.linalg.cholesky(gram[p, :k, :k])
+                except np.linalg.LinAlgError:
+                    pass
+        coef = np.linalg.solve(low, gram[:, :k, k:])[:, :, 0]
+        ssr = gram[:, k, k] - (coef ** 2).sum(axis=1)
+        return coef, ssr, np.ones(n_pairs)
+
+    q, r = np.linalg.qr(design)
+    coef = np.einsum('pnk,pn->pk', q, target)
+    ssr = ((target - np.einsum('pnk,pk->pn', q, coef)) ** 2).sum(axis=1)
+    return coef, ssr, np.sign(r[:, -1, -1])
+
+
+def _adf_design(res, dres, lag, n):
+    """
+    Build the (N_pairs, n, 2 + lag) ADF design: constant, lagged level and lagged differences.
+    """
+
+    n_pairs = res.shape[1]
+    design = np.empty((n_pairs, n, lag + 2), dtype=res.dtype)
+    design[:, :, 0] = 1.0
+    design[:, :, 1] = res[-n - 1:-1].T
+    for j in range(1, lag + 1):
+        design[:, :, j + 1] = dres[-n - j:-j].T
+    return design
+
+
+def johansen_batch(prices):
+    """
+    Perform the two-variable Johansen cointegration test (constant term, one lagged difference)
+    on many pairs at once.
+
+    Parameters:
+    prices : np.ndarray: A (T, N_pairs, 2) stack of aligned prices, float64 or float32.
+
+    Returns:
+    tuple: A tuple containing the (N_pairs, 2) first eigenvectors, the 95% critical value,
+           and the trace statistics, like johansen().
+    """
+
+    prices = _float_array(prices)
+    prices = prices - prices[0]
+
+    # Rows [dx_t, dx_t-1, x_t-1] of the VECM regression, demeaned. The moments are summed in float64
+    dx = np.diff(prices, axis=0)
+    rows = np.concatenate([dx[1:], dx[:-1], prices[1:-1]], axis=2)
+    m = rows.shape[0]
+    rows -= rows.mean(axis=0, dtype=np.float64).astype(rows.dtype)
+    cov = np.einsum('tpi,tpj->pij', rows, rows, dtype=np.float64)
+
+    eigenvectors, trace_stat = johansen_from_moments(cov, m)
+    critical_value95 = johansen_critical_value()
+
+    return eigenvectors, critical_value95, trace_stat
+
+
+def johansen_critical_value(n_vars: int = 2, det_order: int = 0) -> float:
+    """
+    Look up the 95% critical value of the Johansen trace test for the first eigenvalue.
+
+    Parameters:
+    n_vars : int: Number of variables in the system.
+    det_order : int: The deterministic trend order of the test.
+
+    Returns:
+    float: The 95% critical value, the same as cvt[0, 1] of coint_johansen.
+    """
+
+    from statsmodels.tsa.coint_tables import c_sjt
+
+    return c_sjt(n_vars, det_order)[1]
+
+
+def johansen_from_moments(cov, m):
+    """
+    Two-variable Johansen test with one lagged difference from stacked cross product matrices.
+
+    Parameters:
+    cov : np.ndarray: A (N_pairs, 6, 6) stack of the (demeaned) cross products of the rows [dx_t, dx_t-1, x_t-1].
+    m : int or np.ndarray: Number of rows behind the cross products, shared or one per pair.
+
+    Returns:
+    tuple: A tuple containing the (N_pairs, 2) first eigenvectors and the trace statistics.
+           Pairs with singular moment matrices get NaN.
+    """
+
+    d, z, lv = slice(0, 2), slice(2, 4), slice(4, 6)
+    m = np.asarray(m, dtype=float)
+    m_mat = m.reshape(-1, 1, 1) if m.ndim else m
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Partial the lagged difference out of dx_t and x_t-1
+        izz = _inv2_batch(cov[:, z, z])
+        b_d = izz @ cov[:, z, d]
+        b_l = izz @ cov[:, z, lv]
+        s00 = (cov[:, d, d] - cov[:, d, z] @ b_d) / m_mat
+        skk = (cov[:, lv, lv] - cov[:, lv, z] @ b_l) / m_mat
+        sk0 = (cov[:, lv, d] - cov[:, lv, z] @ b_d) / m_mat
+
+        sig = sk0 @ _inv2_batch(s00) @ np.swapaxes(sk0, 1, 2)
+        mat = _inv2_batch(skk) @ sig
+        a, b = mat[:, 0, 0], mat[:, 0, 1]
+        c, e = mat[:, 1, 0], mat[:, 1, 1]
+        half_tr = (a + e) / 2
+        det = a * e - b * c
+        lam = half_tr + np.sqrt(np.maximum(half_tr * half_tr - det, 0.0))
+
+        # Eigenvector of the largest eigenvalue, normalized so v' skk v = 1 and v[0] > 0
+        use_first = np.abs(b) + np.abs(lam - a) >= np.abs(lam - e) + np.abs(c)
+        v0 = np.where(use_first, b, lam - e)
+        v1 = np.where(use_first, lam - a, c)
+        quad = skk[:, 0, 0] * v0 * v0 + (skk[:, 0, 1] + skk[:, 1, 0]) * v0 * v1 + skk[:, 1, 1] * v1 * v1
+        scale = np.where(quad > 0, np.sign(v0) / np.sqrt(quad), np.nan)
+        eigenvectors = np.stack([v0 * scale, v1 * scale], axis=1)
+
+        trace_stat = -m * np.log(1 - 2 * half_tr + det)
+
+    return eigenvectors, trace_stat
+
+
+def _inv2_batch(a):
+    """
+    Invert a stack of 2x2 matrices, giving inf/NaN for singular ones instead of raising.
+    """
+
+    det = a[:, 0, 0] * a[:, 1, 1] - a[:, 0, 1] * a[:, 1, 0]
+    inv = np.empty_like(a)
+    inv[:, 0, 0] = a[:, 1, 1] / det
+    inv[:, 0, 1] = -a[:, 0, 1] / det
+    inv[:, 1, 0] = -a[:, 1, 0] / det
+    inv[:, 1, 1] = a[:, 0, 0] / det
+    return inv
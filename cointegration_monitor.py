@@ -0,0 +1,322 @@
+import math
+from collections import deque
+import numpy as np
+
+
+def adf_pvalue(stat: float) -> float:
+    """
+    MacKinnon p-value of an ADF statistic with a constant, as adfuller reports it.
+
+    Parameters:
+    stat : float: The ADF t-statistic.
+
+    Returns:
+    float: The approximate p-value.
+    """
+
+    from statsmodels.tsa.adfvalues import mackinnonp
+
+    return float(mackinnonp(stat, regression='c', N=1))
+
+
+def adf_critical_value(pvalue: float) -> float:
+    """
+    ADF statistic whose MacKinnon p-value equals `pvalue`, so p-values can be compared as statistics.
+
+    Parameters:
+    pvalue : float: The p-value, between 0 and 1.
+
+    Returns:
+    float: The statistic. Statistics above it have larger p-values.
+    """
+
+    from scipy.optimize import brentq
+
+    return float(brentq(lambda stat: adf_pvalue(stat) - pvalue, -30.0, 10.0, xtol=1e-10))
+
+
+class CointegrationMonitor():
+    def __init__(self, window: int = 252, lag: int = 1, max_pvalue: float = 0.05, resync: int = None):
+        """
+        Initialize a rolling Engle-Granger health check of a pair.
+
+        Over the last `window` prices the monitor regresses y on x by OLS and runs a
+        fixed-lag ADF test, with a constant, on the residuals, the same test as
+        cointegration_functions.ols_adf without the lag search. The residuals change
+        with the OLS slope b every bar, but every ADF variable is (row of y) - b (row of x),
+        so the monitor keeps the windowed sums and cross products of the rows
+        [dy_t, dx_t, ... dy_t-lag, dx_t-lag, y_t-1, x_t-1] and of the prices, and
+        rebuilds the ADF moments from them in O(1) per bar. update only stores the bar:
+        the sums catch up with the pending bars and the statistic is computed when it is
+        read, so a strategy that checks it before opening a position pays for the test
+        on entry bars only.
+
+        Parameters:
+        window : int: Number of prices in the test window.
+        lag : int: Number of lagged differences in the ADF regression.
+        max_pvalue : float: The pair counts as cointegrated while the ADF p-value is at most this.
+        resync : int or None: Recompute the sums from the stored rows every `resync` updates
+                 to bound floating point drift. Defaults to `window`.
+        """
+
+        if window < lag + 5:
+            raise ValueError("window is too short for the requested lag")
+
+        self.window = window
+        self.lag = lag
+        self.max_pvalue = max_pvalue
+        self.resync = window if resync is None else resync
+
+        # The p-value threshold as a statistic, so the check per bar is one comparison
+        self.max_stat = adf_critical_value(max_pvalue)
+
+        self.n_rows = window - 1 - lag
+        self.n_vars = lag + 2
+        # Previous price and the latest lag + 1 differences, newest first
+        self.previous = None
+        self.diffs = deque(maxlen=lag + 1)
+
+        # Ring buffers of the prices and of the ADF rows inside the window. The state is kept
+        # in plain floats, numpy calls on arrays this small cost more than the arithmetic
+        self.levels = [None] * window
+        self.level_head = 0
+        self.level_count = 0
+        self.rows = [None] * self.n_rows
+        self.head = 0
+        self.count = 0
+
+        # Windowed moments: sy, sx, syy, sxy, sxx of the prices, sums and cross products
+        # (upper triangle, row by row) of the rows
+        size = 2 * self.n_vars
+        self.pairs = [(i, j) for i in range(size) for j in range(i, size)]
+        self.position = {pair: k for k, pair in enumerate(self.pairs)}
+        self.level_sums = [0.0] * 5
+        self.row_sum = [0.0] * size
+        self.row_prod = [0.0] * len(self.pairs)
+        self.since_resync = 0
+
+        # Bars stored since the sums were last brought up to date, None once a resync is due
+        self.pending = []
+
+        # Positions in row_prod of the four moments behind each residual moment
+        # g_ij = cov(y_i, y_j) - b (cov(x_i, y_j) + cov(y_i, x_j)) + b^2 cov(x_i, x_j)
+        def at(a, c):
+            return self.position[min(a, c), max(a, c)]
+
+        self.g_pairs = [(i, j) for i in range(self.n_vars) for j in range(i, self.n_vars)]
+        self.g_terms = [(at(2 * i, 2 * j), at(2 * i + 1, 2 * j), at(2 * i, 2 * j + 1), at(2 * i + 1, 2 * j + 1))
+                        for i, j in self.g_pairs]
+
+        # Prices are shifted by the first observation to keep the sums small,
+        # the OLS intercept and the ADF constant absorb the shift
+        self.anchor = None
+
+        # OLS slope and ADF statistic of the current window, computed on demand
+        self._result = None
+
+    def update(self, p_y: float, p_x: float):
+        """
+        Add a new bar to the window, dropping the oldest one.
+
+        Only the prices and the ADF row of the bar are stored here. The windowed sums
+        catch up with the pending bars, and the statistic is recomputed, the next time
+        stat or beta is read.
+
+        Parameters:
+        p_y : float: Price of the dependent ticker.
+        p_x : float: Price of the regressor ticker.
+        """
+
+        if self.anchor is None:
+            self.anchor = (float(p_y), float(p_x))
+        y = float(p_y) - self.anchor[0]
+        x = float(p_x) - self.anchor[1]
+
+        level = (y, x)
+        old_level = None
+        if self.level_count == self.window:
+            old_level = self.levels[self.level_head]
+        else:
+            self.level_count += 1
+        self.levels[self.level_head] = level
+        self.level_head = (self.level_head + 1) % self.window
+
+        row = old_row = None
+        previous = self.previous
+        self.previous = level
+        if previous is not None:
+            self.diffs.appendleft((y - previous[0], x - previous[1]))
+        if len(self.diffs) == self.lag + 1:
+            # Differences, newest first, then the lagged level
+            row = [v for diff in self.diffs for v in diff]
+            row += previous
+
+            if self.count == self.n_rows:
+                old_row = self.rows[self.head]
+            else:
+                self.count += 1
+            self.rows[self.head] = row
+            self.head = (self.head + 1) % self.n_rows
+
+        # Once a resync is due the sums are rebuilt from the buffers, so the bars stop being queued
+        if self.pending is not None:
+            self.pending.append((level, old_level, row, old_row))
+            if self.since_resync + len(self.pending) >= self.resync:
+                self.pending = None
+
+        self._result = None
+
+    def _catch_up(self):
+        # Apply the bars added since the last read to the windowed sums
+        if self.pending is None:
+            self._resync()
+            return
+
+        for (y, x), old_level, row, old_row in self.pending:
+            level = (y, x, y * y, x * y, x * x)
+            if old_level is not None:
+                old_y, old_x = old_level
+                old = (old_y, old_x, old_y * old_y, old_x * old_y, old_x * old_x)
+                self.level_sums = [s + v - o for s, v, o in zip(self.level_sums, level, old)]
+            else:
+                self.level_sums = [s + v for s, v in zip(self.level_sums, level)]
+
+            if row is None:
+                continue
+            if old_row is not None:
+                self.row_sum = [s + v - o for s, v, o in zip(self.row_sum, row, old_row)]
+                self.row_prod = [p + row[i] * row[j] - old_row[i] * old_row[j]
+                                 for p, (i, j) in zip(self.row_prod, self.pairs)]
+            else:
+                self.row_sum = [s + v for s, v in zip(self.row_sum, row)]
+                self.row_prod = [p + row[i] * row[j] for p, (i, j) in zip(self.row_prod, self.pairs)]
+
+        self.since_resync += len(self.pending)
+        self.pending = []
+
+    def _resync(self):
+        # Recompute the sums from the stored prices and rows, which also bounds floating point drift
+        levels = np.array(self.levels[:self.level_count])
+        ly, lx = levels[:, 0], levels[:, 1]
+        self.level_sums = [float(ly.sum()), float(lx.sum()), float(ly @ ly), float(lx @ ly), float(lx @ lx)]
+        if self.count:
+            rows = np.array(self.rows[:self.count])
+            prod = rows.T @ rows
+            self.row_sum = rows.sum(axis=0).tolist()
+            self.row_prod = [float(prod[i, j]) for i, j in self.pairs]
+        self.since_resync = 0
+        self.pending = []
+
+    @property
+    def ready(self) -> bool:
+        """
+        Check whether the window is full.
+
+        Returns:
+        bool: True once `window` prices have been added.
+        """
+
+        return self.count == self.n_rows
+
+    @property
+    def stat(self) -> float:
+        """
+        Get the ADF statistic of the OLS residuals over the current window.
+
+        Returns:
+        float: The t-statistic of the lagged residual, NaN before the window is full.
+        """
+
+        if self._result is None:
+            self._result = self._refresh()
+        return self._result[1]
+
+    @property
+    def beta(self) -> float:
+        """
+        Get the OLS slope of y on x over the current window.
+
+        Returns:
+        float: The hedge ratio of the test, NaN before the window is full.
+        """
+
+        if self._result is None:
+            self._result = self._refresh()
+        return self._result[0]
+
+    @property
+    def pvalue(self) -> float:
+        """
+        Get the MacKinnon p-value of the current ADF statistic. Computed on demand.
+
+        Returns:
+        float: The p-value, NaN before the window is full.
+        """
+
+        stat = self.stat
+        return adf_pvalue(stat) if stat == stat else np.nan
+
+    @property
+    def cointegrated(self) -> bool:
+        """
+        Check whether the pair passes the test on the current window.
+
+        Returns:
+        bool: True if the ADF p-value is at most max_pvalue. False before the window is full.
+        """
+
+        return self.stat <= self.max_stat
+
+    def _refresh(self) -> tuple[float, float]:
+        if not self.ready:
+            return np.nan, np.nan
+        self._catch_up()
+
+        # OLS slope of y on x over the window
+        n = self.level_count
+        sy, sx, syy, sxy, sxx = self.level_sums
+        var_x = sxx - sx * sx / n
+        if var_x <= 0:
+            return np.nan, np.nan
+        b = (sxy - sx * sy / n) / var_x
+
+        # Centered moments of the rows, the centering is the ADF constant
+        m = self.count
+        row_sum = self.row_sum
+        cov = [p - row_sum[i] * row_sum[j] / m for p, (i, j) in zip(self.row_prod, self.pairs)]
+
+        # Moments of the residual variables v_i = row[2i] - b row[2i + 1]:
+        # dv_t, its lags, then the lagged level
+        bb = b * b
+        k = self.n_vars
+        g = [[0.0] * k for _ in range(k)]
+        for (i, j), (yy, xy, yx, xx) in zip(self.g_pairs, self.g_terms):
+            g[i][j] = g[j][i] = cov[yy] - b * (cov[xy] + cov[yx]) + bb * cov[xx]
+
+        if k == 3:
+            # One lag: regress dv_t on (dv_t-1, v_t-1) in closed form
+            a11, a12, a22 = g[1][1], g[1][2], g[2][2]
+            r1, r2 = g[1][0], g[2][0]
+            det = a11 * a22 - a12 * a12
+            if det <= 0:
+                return b, np.nan
+            gamma = (a11 * r2 - a12 * r1) / det
+            coef1 = (a22 * r1 - a12 * r2) / det
+            ssr = g[0][0] - coef1 * r1 - gamma * r2
+            inv_level = a11 / det
+        else:
+            g = np.array(g)
+            gxx = g[1:, 1:]
+            gxy = g[1:, 0]
+            try:
+                coef = np.linalg.solve(gxx, gxy)
+                inv_level = np.linalg.solve(gxx, np.eye(k - 1)[-1])[-1]
+            except np.linalg.LinAlgError:
+                return b, np.nan
+            gamma = coef[-1]
+            ssr = g[0, 0] - gxy @ coef
+
+        dof = m - k
+        if ssr <= 0 or inv_level <= 0:
+            return b, np.nan
+        return b, float(gamma / math.sqrt(ssr / dof * inv_level))
@@ -1,52 +1,241 @@
+import argparse
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from itertools import combinations
+import numpy as np
 import pandas as pd
-import yfinance as yf
-from cointegration_functions import correlation, ols_adf, johansen
-from data_utils import split_data
+from cointegration_functions import correlation, ols_adf, johansen, correlation_batch, ols_adf_batch, johansen_batch
+from data_utils import split_data, get_universe_data
+from models import storage_dtype
 
-def cointegration_test():
-    ticker = {
+TICKERS = {
     "Clothing_and_Apparel": ["COLM", "CPRI", "DKS", "DECK", "BIRK", "ASO", "GES", "BOOT"],
-    "Financials":["MS", "SCHW", "CMA", "NTRS", "AMP", "BEN", "LPLA"],   
+    "Financials":["MS", "SCHW", "CMA", "NTRS", "AMP", "BEN", "LPLA"],
     "Airlines": ["CPA", "ALGT", "VLRS", "AER", "CHH"],
     "Food_and_Beverage": ["KHC", "HSY", "MNST", "CELH", "POST", "TAP"],
     "Entertainment_and_Media": ["NWSA", "CHTR", "SPOT", "IMAX",  "BILI"],
     "Automotive": ["HMC", "TM", "STLA", "VWAGY", "VLVLY", "LI", "XPEV", "BYDDY"]
     }
 
+RESULT_COLUMNS = ['sector', 'pair', 'corr', 'pvalue_adf', 'johansen_pass', 'eigenvector', 'Strength']
+
+
+def screen_pair(close: pd.DataFrame) -> dict:
+    """
+    Run the correlation, OLS-ADF and Johansen tests on the training part of a pair.
+
+    Parameters:
+    close : pd.DataFrame: A DataFrame with the aligned closing prices of the two tickers.
+
+    Returns:
+    dict: The correlation, ADF p-value, Johansen result, eigenvector and strength of the pair.
+    """
+
+    train_data, _ = split_data(close)
+
+    corr = correlation(train_data, window=252)
+    _, adf_pvalue = ols_adf(train_data)
+    eigenvector, critical_value95, trace_stat = johansen(train_data)
+    johansen_pass = 1 if trace_stat > critical_value95 else 0
+
+    return {
+        'corr': float(corr),
+        'pvalue_adf': float(adf_pvalue),
+        'johansen_pass': johansen_pass,
+        'eigenvector': eigenvector,
+        'Strength': trace_stat/critical_value95,
+    }
+
+
+def screen_pairs_batch(prices) -> list[dict]:
+    """
+    Run the correlation, OLS-ADF and Johansen tests on the training part of many pairs at once.
+
+    Parameters:
+    prices : np.ndarray: A (T, N_pairs, 2) stack of aligned closing prices sharing the same dates.
+
+    Returns:
+    list[dict]: The same fields as screen_pair for each pair.
+    """
+
+    train_size = int(prices.shape[0] * 0.6)
+    train_data = prices[:train_size]
+
+    corr = correlation_batch(train_data, window=252)
+    _, _, adf_pvalue = ols_adf_batch(train_data)
+    eigenvectors, critical_value95, trace_stat = johansen_batch(train_data)
+    johansen_pass = (trace_stat > critical_value95).astype(int)
+    strength = trace_stat / critical_value95
+
+    return [
+        {
+            'corr': float(corr[k]),
+            'pvalue_adf': float(adf_pvalue[k]),
+            'johansen_pass': int(johansen_pass[k]),
+            'eigenvector': eigenvectors[k],
+            'Strength': float(strength[k]),
+        }
+        for k in range(prices.shape[1])
+    ]
+
+
+def _screen_task(task: tuple) -> list[dict]:
+    sector, t1, t2, close = task
+    row = {'sector': sector, 'pair': f'{t1}-{t2}'}
+    row.update(screen_pair(close))
+    return [row]
+
+
+def _screen_batch_task(task: tuple) -> list[dict]:
+    members, prices = task
+    rows = screen_pairs_batch(prices)
+    for (sector, t1, t2), row in zip(members, rows):
+        row['sector'] = sector
+        row['pair'] = f'{t1}-{t2}'
+    return rows
+
+
+def _run_parallel(func, tasks, n_workers: int):
+    """
+    Run the screening tasks in a process pool, yielding result lists as they finish.
+
+    At most a few tasks per worker are in flight so large universes do not
+    queue every pair's prices at once.
+    """
+
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        pending = set()
+        for task in tasks:
+            pending.add(pool.submit(func, task))
+            if len(pending) >= 4 * n_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in pending:
+            yield future.result()
+
+
+def _load_results(results_path: str) -> pd.DataFrame:
+    """
+    Load the rows already written to a results file, dropping a partially written last line.
+
+    Parameters:
+    results_path : str: CSV file with the screening results.
+
+    Returns:
+    pd.DataFrame: The finished rows.
+    """
+
+    if not os.path.exists(results_path) or os.path.getsize(results_path) == 0:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+
+    # A crash can leave the last row without its newline, cut the file back to the last full row
+    with open(results_path, 'rb+') as f:
+        content = f.read()
+        if not content.endswith(b'\n'):
+            f.truncate(content.rfind(b'\n') + 1)
+
+    done = pd.read_csv(results_path)
+    done['eigenvector'] = done['eigenvector'].map(lambda v: np.array(json.loads(v)))
+    return done
+
+
+def cointegration_test(store_dir: str = None, offline: bool = False, n_workers: int = 1, results_path: str = None,
+                       tickers: dict = None, batched: bool = False, batch_size: int = 500, source=None, dtype=None):
+    """
+    Screen every pair of each sector for cointegration.
+
+    Parameters:
+    store_dir : str: Folder of a local PriceStore, see data_utils.get_asset_data.
+    offline : bool: Serve the data entirely from the local store, without downloading.
+    n_workers : int: Number of worker processes used to test the pairs.
+    results_path : str: CSV file where each result row is written as soon as it finishes.
+                   Pairs already in the file are skipped, so an interrupted screen can be resumed.
+    tickers : dict: Tickers of each sector. Defaults to TICKERS.
+    batched : bool: Test pairs that share the same dates together with the vectorized kernels.
+    batch_size : int: Maximum number of pairs per batch.
+    source : DataSource: Where prices are downloaded from, see data_sources.py. Defaults to yfinance.
+    dtype : str: 'float32' keeps the universe panel and the batched kernels' price stacks, residuals
+            and designs in float32, half the memory of the default 'float64'. Their sums stay float64.
+
+    Returns:
+    tuple[pd.DataFrame, pd.DataFrame]: All results and the pairs that pass the filters.
+    """
+
+    ticker = TICKERS if tickers is None else tickers
+
     pairs_tickers = {sec: list(combinations(tks, 2)) for sec, tks in ticker.items()}
 
-    results = []
+    done = _load_results(results_path) if results_path else pd.DataFrame(columns=RESULT_COLUMNS)
+    done_pairs = set(zip(done['sector'], done['pair']))
+
+    # Download the whole universe once, each pair is a column view into this panel
+    print("Descargando datos del universo...")
+    universe = get_universe_data([t for tks in ticker.values() for t in tks], store_dir=store_dir, offline=offline,
+                                 source=source, dtype=dtype)
+
+    def pending_pairs():
+        for sector, pairs in pairs_tickers.items():
+            print(f"\n=== Analizando el sector: {sector} ===")
+            for t1, t2 in pairs:
+                if (sector, f'{t1}-{t2}') in done_pairs:
+                    continue
+                if t1 not in universe.columns or t2 not in universe.columns:
+                    print(f"Sin datos para {t1} y {t2}")
+                    continue
 
-    for sector, pairs in pairs_tickers.items():
-        print(f"\n=== Descargando datos del sector: {sector} ===")
-        for t1, t2 in pairs:
-            print(f"Descargando {t1} y {t2}...")
+                yield sector, t1, t2
 
-            data = yf.download([t1, t2], period="15y", interval="1d", progress=False)
+    def tasks():
+        for sector, t1, t2 in pending_pairs():
+            yield sector, t1, t2, universe[[t1, t2]].dropna().astype(float)
 
-            close = data['Close'].dropna()
-            close.columns = [col[0] if isinstance(col, tuple) else col for col in close.columns]
-            close = close[[t1, t2]].dropna()
+    def batch_tasks():
+        # Pairs with the same dates after dropna are stacked into one (T, N_pairs, 2) array
+        groups = {}
+        valid = universe.notna().to_numpy()
+        position = {t: k for k, t in enumerate(universe.columns)}
+        for sector, t1, t2 in pending_pairs():
+            mask = valid[:, position[t1]] & valid[:, position[t2]]
+            groups.setdefault(mask.tobytes(), (mask, []))[1].append((sector, t1, t2))
 
-            train_data, _ = split_data(close)
+        values = universe.to_numpy(dtype=storage_dtype(dtype))
+        for mask, members in groups.values():
+            # Rows and columns are broadcast together, so only the chunk's block is copied
+            rows = np.flatnonzero(mask)[:, None, None]
+            for start in range(0, len(members), batch_size):
+                chunk = members[start:start + batch_size]
+                cols = np.array([[position[t1], position[t2]] for _, t1, t2 in chunk])
+                yield chunk, values[rows, cols]
 
-            corr = correlation(train_data, window=252)
-            _, adf_pvalue = ols_adf(train_data)
-            eigenvector, critical_value95, trace_stat = johansen(train_data)
-            johansen_pass = 1 if trace_stat > critical_value95 else 0
+    func, task_iter = (_screen_batch_task, batch_tasks()) if batched else (_screen_task, tasks())
+    batches = _run_parallel(func, task_iter, n_workers) if n_workers > 1 else map(func, task_iter)
+    rows = (row for batch in batches for row in batch)
 
-            results.append({
-                'sector': sector,
-                'pair': f'{t1}-{t2}',
-                'corr': float(corr),
-                'pvalue_adf': float(adf_pvalue),
-                'johansen_pass': johansen_pass,
-                'eigenvector': eigenvector,
-                'Strength': trace_stat/critical_value95,
-            })
+    results = done.to_dict('records')
 
-    df_results = pd.DataFrame(results)
+    writer = None
+    f = None
+    if results_path:
+        new_file = not os.path.exists(results_path) or os.path.getsize(results_path) == 0
+        f = open(results_path, 'a', newline='')
+        writer = csv.DictWriter(f, fieldnames=RESULT_COLUMNS)
+        if new_file:
+            writer.writeheader()
+
+    try:
+        for row in rows:
+            results.append(row)
+            if writer is not None:
+                writer.writerow({**row, 'eigenvector': json.dumps([float(v) for v in row['eigenvector']])})
+                f.flush()
+    finally:
+        if f is not None:
+            f.close()
+
+    df_results = pd.DataFrame(results, columns=RESULT_COLUMNS)
     df_filtrado = (
         df_results[
             (df_results['corr'] > 0.60) &
@@ -60,5 +249,27 @@ def cointegration_test():
     print(df_results)
     print(df_filtrado)
 
+    return df_results, df_filtrado
+
+
+def main(argv: list = None, prog: str = None):
+    parser = argparse.ArgumentParser(prog=prog, description="Cointegration screen of every pair in each sector.")
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--results', default=None, help="CSV file to stream results to and resume from.")
+    parser.add_argument('--store', default=None, help="Folder of the local price store.")
+    parser.add_argument('--offline', action='store_true')
+    parser.add_argument('--batched', action='store_true', help="Use the vectorized kernels.")
+    parser.add_argument('--float32', action='store_true', help="Hold the prices in float32, half the memory.")
+    parser.add_argument('--source', default=None, help="yfinance (default), yahoo for the concurrent loader, "
+                                                       "or the URL of a chart API server.")
+    args = parser.parse_args(argv)
+
+    from data_sources import get_source
+
+    cointegration_test(store_dir=args.store, offline=args.offline, n_workers=args.workers, results_path=args.results,
+                       batched=args.batched, source=get_source(args.source),
+                       dtype='float32' if args.float32 else None)
+
+
 if __name__ == "__main__":
-    cointegration_test()
\ No newline at end of file
+    main()
@@ -0,0 +1,514 @@
+import argparse
+import asyncio
+import gzip
+import importlib.util
+import json
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+import numpy as np
+import pandas as pd
+
+
+# Yahoo Finance chart API, the endpoint yfinance itself downloads from
+YAHOO_CHART_URL = "https://query1.finance.yahoo.com/v8/finance/chart/"
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0 Safari/537.36"
+
+# Statuses worth another try: rate limits and server side failures
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class FetchError(Exception):
+    def __init__(self, tickers: list, data: pd.DataFrame):
+        """
+        Raised when some tickers could not be downloaded after all the retries.
+
+        Parameters:
+        tickers : list: The tickers whose requests kept failing.
+        data : pd.DataFrame: The closing prices of the tickers that were downloaded.
+        """
+
+        super().__init__(f"Failed to download {len(tickers)} tickers: {', '.join(tickers)}")
+        self.tickers = tickers
+        self.data = data
+
+
+class DataSource(ABC):
+    """
+    Interface of the price providers. A source returns a wide DataFrame of daily closing
+    prices, one column per ticker it found, like yfinance.download(...)["Close"].
+    """
+
+    @abstractmethod
+    def fetch(self, tickers: list, period: str = "15y", start=None) -> pd.DataFrame:
+        """
+        Download the daily closing prices of some tickers.
+
+        Parameters:
+        tickers : list: A list of ticker symbols.
+        period : str: History to download, e.g. "15y". Ignored when `start` is given.
+        start : str or pd.Timestamp: First date to download.
+
+        Returns:
+        pd.DataFrame: The closing prices indexed by date. Tickers without data are left out.
+        """
+
+
+class YFinanceSource(DataSource):
+    """
+    The yfinance downloader, the default source.
+    """
+
+    def fetch(self, tickers: list, period: str = "15y", start=None) -> pd.DataFrame:
+        import yfinance as yf
+
+        tickers = list(tickers)
+        if start is not None:
+            close = yf.download(tickers, start=pd.Timestamp(start).strftime("%Y-%m-%d"), interval="1d",
+                                progress=False)["Close"]
+        else:
+            close = yf.download(tickers, period=period, interval="1d", progress=False)["Close"]
+
+        if isinstance(close, pd.Series):
+            close = close.to_frame(name=tickers[0])
+
+        return close.dropna(axis=1, how="all")
+
+
+def parse_chart(ticker: str, body: bytes) -> pd.Series:
+    """
+    Read the daily closing prices out of a chart API response.
+
+    The adjusted close is used when the response has it, as yfinance does by default.
+
+    Parameters:
+    ticker : str: The ticker symbol, used as the name of the series.
+    body : bytes: The JSON body of the response.
+
+    Returns:
+    pd.Series: The closing prices indexed by date, or None if the response has no data.
+    """
+
+    chart = json.loads(body)["chart"]
+    if chart.get("error") or not chart.get("result"):
+        return None
+
+    result = chart["result"][0]
+    timestamps = result.get("timestamp")
+    if not timestamps:
+        return None
+
+    indicators = result["indicators"]
+    adjclose = indicators.get("adjclose")
+    close = adjclose[0]["adjclose"] if adjclose else indicators["quote"][0]["close"]
+
+    # Bars are stamped at the exchange open in UTC, keep the local date only
+    offset = result.get("meta", {}).get("gmtoffset", 0)
+    days = (np.asarray(timestamps, dtype=np.int64) + offset) // 86400
+    index = pd.DatetimeIndex(days.astype("datetime64[D]").astype("datetime64[ns]"))
+
+    return pd.Series(np.array(close, dtype=float), index=index, name=ticker)
+
+
+def has_aiohttp() -> bool:
+    """
+    Check whether aiohttp, the optional dependency of ChartAPISource, is installed.
+
+    Returns:
+    bool: True if aiohttp can be imported.
+    """
+
+    return importlib.util.find_spec("aiohttp") is not None
+
+
+class ChartAPISource(DataSource):
+    def __init__(self, base_url: str = YAHOO_CHART_URL, max_connections: int = 16, retries: int = 3,
+                 backoff: float = 0.5, timeout: float = 30.0):
+        """
+        Initialize an asyncio source for the Yahoo Finance chart API, or anything serving
+        the same protocol such as StubChartServer.
+
+        Every ticker is one request and the requests run concurrently on an aiohttp.ClientSession
+        whose pool keeps up to `max_connections` keep-alive connections, so loading a large
+        universe costs about (tickers / max_connections) round trips instead of one round trip
+        per ticker. Failed requests are retried with exponential backoff, and if some tickers
+        still fail fetch raises FetchError, which holds them and the prices of the others.
+        Tickers the server has no data for are reported and left out of the result. The
+        responses are parsed on the default executor so the event loop keeps serving the
+        other requests meanwhile.
+
+        aiohttp is an optional dependency (pip install aiohttp), get_source falls back to
+        YFinanceSource without it.
+
+        Parameters:
+        base_url : str: URL the ticker is appended to.
+        max_connections : int: Maximum number of concurrent requests.
+        retries : int: Number of further attempts after a failed request.
+        backoff : float: Seconds to wait before the first retry, doubled on each retry.
+        timeout : float: Seconds allowed to connect and between two reads of a response. The
+                  wait for a free pooled connection does not count, so a small pool with
+                  many tickers does not time out.
+        """
+
+        if not has_aiohttp():
+            raise ImportError("ChartAPISource needs aiohttp, install it with pip install aiohttp")
+
+        self.base_url = base_url if base_url.endswith("/") else base_url + "/"
+        self.max_connections = max_connections
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+    def fetch(self, tickers: list, period: str = "15y", start=None) -> pd.DataFrame:
+        # From async code, await fetch_async instead
+        return asyncio.run(self.fetch_async(tickers, period, start))
+
+    async def fetch_async(self, tickers: list, period: str = "15y", start=None) -> pd.DataFrame:
+        """
+        Download the closing prices of all the tickers concurrently.
+
+        Raises FetchError if the requests of some tickers still failed after the retries.
+
+        Parameters:
+        tickers : list: A list of ticker symbols.
+        period : str: History to download, e.g. "15y". Ignored when `start` is given.
+        start : str or pd.Timestamp: First date to download.
+
+        Returns:
+        pd.DataFrame: The closing prices indexed by date. Tickers without data are left out.
+        """
+
+        import aiohttp
+
+        tickers = list(dict.fromkeys(tickers))
+        if start is not None:
+            query = f"period1={int(pd.Timestamp(start).timestamp())}&period2={int(time.time())}"
+        else:
+            query = f"range={period}"
+        query += "&interval=1d&includeAdjustedClose=true"
+
+        # Per connection and read timeouts, a total timeout would also count the wait for the pool
+        connector = aiohttp.TCPConnector(limit=self.max_connections)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.timeout, sock_read=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                         headers={"User-Agent": USER_AGENT, "Accept": "application/json"}) as session:
+            results = await asyncio.gather(*(self._fetch_one(session, f"{self.base_url}{quote(t)}?{query}", t)
+                                             for t in tickers))
+
+        missing = [t for t, (ok, series) in zip(tickers, results) if ok and series is None]
+        if missing:
+            print(f"Sin datos para {len(missing)} tickers: {', '.join(missing)}")
+
+        series = [s for _, s in results if s is not None]
+        data = pd.concat(series, axis=1).sort_index() if series else pd.DataFrame()
+
+        failed = [t for t, (ok, _) in zip(tickers, results) if not ok]
+        if failed:
+            raise FetchError(failed, data)
+        return data
+
+    async def _fetch_one(self, session: "aiohttp.ClientSession", url: str, ticker: str) -> tuple[bool, pd.Series]:
+        # (False, None) when the requests kept failing, (True, None) when the server has no data
+        import aiohttp
+
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.retries + 1):
+            if attempt:
+                # Exponential backoff with jitter so retries of many tickers do not arrive together
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+            try:
+                async with session.get(url) as response:
+                    status = response.status
+                    body = await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                continue
+
+            if status == 200:
+                try:
+                    return True, await loop.run_in_executor(None, parse_chart, ticker, body)
+                except (ValueError, KeyError, IndexError, TypeError):
+                    return True, None
+            if status not in RETRY_STATUSES:
+                return True, None
+
+        return False, None
+
+
+class StubChartServer():
+    def __init__(self, store_dir: str, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 failure_rate: float = 0.0, seed: int = 0):
+        """
+        Initialize a local HTTP server answering the chart API protocol from a PriceStore folder.
+
+        It lets ChartAPISource be tested and benchmarked offline: `latency` delays every
+        response to mimic the round trip to a remote server, and `failure_rate` answers
+        that share of the requests with 503 to exercise the retries. Ranges such as "15y"
+        count back from the last stored bar, so fixed test data always comes back whole.
+        The server is a small aiohttp.web app, so it needs aiohttp like ChartAPISource. It
+        runs on its own thread, see start and stop, or use it as a context manager.
+
+        Parameters:
+        store_dir : str: Folder of the PriceStore whose tickers are served.
+        host : str: Interface to listen on.
+        port : int: Port to listen on, 0 picks a free one.
+        latency : float: Seconds added before every response.
+        failure_rate : float: Probability of answering a request with 503.
+        seed : int: Seed of the failures.
+        """
+
+        from price_store import PriceStore
+
+        self.store = PriceStore(store_dir)
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+
+        self._bodies = {}
+        self._runner = None
+        self._loop = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """
+        Get the base URL of the served chart API, to pass to ChartAPISource.
+
+        Returns:
+        str: The URL tickers are appended to.
+        """
+
+        return f"http://{self.host}:{self.port}/v8/finance/chart/"
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        """
+        Start serving on a background thread, returns once the port is bound.
+        """
+
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_route("*", "/{path:.*}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None, shutdown_timeout=1.0)
+
+        ready = threading.Event()
+        errors = []
+        self._loop = asyncio.new_event_loop()
+
+        def serve():
+            asyncio.set_event_loop(self._loop)
+            try:
+                self._loop.run_until_complete(self._runner.setup())
+                self._loop.run_until_complete(web.TCPSite(self._runner, self.host, self.port).start())
+                self.port = self._runner.addresses[0][1]
+            except BaseException as error:
+                errors.append(error)
+                return
+            finally:
+                ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=serve, name="stub-chart-server", daemon=True)
+        self._thread.start()
+        ready.wait()
+        if errors:
+            self._thread.join()
+            self._loop.close()
+            self._loop = None
+            raise errors[0]
+
+    def stop(self):
+        """
+        Stop the server and its thread.
+        """
+
+        if self._loop is None:
+            return
+
+        # Closes the keep-alive connections and waits for their handlers before the loop stops
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+    async def _handle(self, request: "aiohttp.web.Request") -> "aiohttp.web.Response":
+        from aiohttp import web
+
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        compress = "gzip" in request.headers.get("Accept-Encoding", "")
+        status, body = self._respond(request.method, request.path_qs, compress)
+        headers = {"Content-Type": "application/json"}
+        if compress:
+            headers["Content-Encoding"] = "gzip"
+        return web.Response(status=status, body=body, headers=headers)
+
+    def _respond(self, method: str, target: str, compress: bool) -> tuple[int, bytes]:
+        status, body = 200, None
+        parts = urlsplit(target)
+        prefix = urlsplit(self.url).path
+        ticker = unquote(parts.path[len(prefix):])
+
+        if method != "GET":
+            status, body = 405, b"{}"
+        elif self.failure_rate and self.random.random() < self.failure_rate:
+            status, body = 503, b"{}"
+        elif not parts.path.startswith(prefix):
+            status, body = 404, b"{}"
+        elif not self.store.has(ticker):
+            error = {"code": "Not Found", "description": "No data found, symbol may be delisted"}
+            status, body = 404, json.dumps({"chart": {"result": None, "error": error}}).encode()
+
+        if body is not None:
+            return status, gzip.compress(body, compresslevel=1) if compress else body
+
+        # Responses are built and compressed once per ticker and query, the prices do not change while serving
+        key = (ticker, parts.query, compress)
+        if key not in self._bodies:
+            body = self._chart(ticker, parse_qs(parts.query))
+            self._bodies[key] = gzip.compress(body, compresslevel=1) if compress else body
+        return 200, self._bodies[key]
+
+    def _chart(self, ticker: str, query: dict) -> bytes:
+        prices = self.store.read(ticker)
+        dates = prices.index
+
+        if "period1" in query:
+            first = pd.to_datetime(int(query["period1"][0]), unit="s")
+            last = pd.to_datetime(int(query.get("period2", [2**40])[0]), unit="s")
+            prices = prices[(dates >= first) & (dates <= last)]
+        else:
+            period = query.get("range", ["max"])[0]
+            if period == "ytd":
+                prices = prices[dates >= pd.Timestamp(year=dates[-1].year, month=1, day=1)]
+            elif period != "max":
+                amount, unit = int(period.rstrip("dmoy")), period.lstrip("0123456789")
+                offset = {"d": pd.DateOffset(days=amount), "mo": pd.DateOffset(months=amount),
+                          "y": pd.DateOffset(years=amount)}[unit]
+                prices = prices[dates > dates[-1] - offset]
+
+        timestamps = (prices.index.asi8 // 10**9).tolist() if len(prices) else []
+        close = prices.to_numpy(dtype=float).tolist()
+        result = {
+            "meta": {"symbol": ticker, "currency": "USD", "gmtoffset": 0, "dataGranularity": "1d"},
+            "timestamp": timestamps,
+            "indicators": {"quote": [{"close": close}], "adjclose": [{"adjclose": close}]},
+        }
+        return json.dumps({"chart": {"result": [result], "error": None}}).encode()
+
+
+def get_source(name: str = None) -> DataSource:
+    """
+    Build a data source from its command line name.
+
+    Parameters:
+    name : str: "yfinance" (the default), "yahoo" for the async chart API client, or the
+                URL of a chart API server such as a StubChartServer. Without aiohttp "yahoo"
+                falls back to yfinance, which downloads from the same API.
+
+    Returns:
+    DataSource: The source.
+    """
+
+    if name is None or name == "yfinance":
+        return YFinanceSource()
+    if name == "yahoo":
+        if not has_aiohttp():
+            print("aiohttp is not installed, downloading with yfinance instead")
+            return YFinanceSource()
+        return ChartAPISource()
+    if name.startswith(("http://", "https://")):
+        return ChartAPISource(name)
+    raise ValueError(f"unknown data source: {name}")
+
+
+def benchmark_loader(n_tickers: int = 500, n_bars: int = 3780, latency: float = 0.05,
+                     connections: tuple = (1, 8, 64)) -> pd.DataFrame:
+    """
+    Time loading a synthetic universe from a local StubChartServer with simulated latency.
+
+    With one connection the load time is about n_tickers round trips. With a pool it
+    falls to about n_tickers / connections round trips, until it is bound by the
+    transfer and parsing of the prices.
+
+    Parameters:
+    n_tickers : int: Number of tickers of the universe.
+    n_bars : int: Number of daily bars per ticker, 3780 is 15 years.
+    latency : float: Seconds the server waits before each response.
+    connections : tuple: Pool sizes to time.
+
+    Returns:
+    pd.DataFrame: One row per pool size with the load time, tickers per second and MB of prices.
+    """
+
+    import tempfile
+    from price_store import PriceStore
+    from synthetic_data import cointegrated_universe
+
+    prices, _ = cointegrated_universe(n_tickers, n_bars=n_bars, n_sectors=max(n_tickers // 25, 1), seed=0)
+    tickers = list(prices.columns)
+
+    rows = []
+    with tempfile.TemporaryDirectory(prefix="stub_store_") as store_dir:
+        store = PriceStore(store_dir)
+        for ticker in tickers:
+            store.write(ticker, prices[ticker])
+
+        with StubChartServer(store_dir, latency=latency) as server:
+            # Warm-up load, so the server has built its responses before the timed runs
+            ChartAPISource(server.url, max_connections=max(connections)).fetch(tickers)
+            for n in connections:
+                source = ChartAPISource(server.url, max_connections=n)
+                start = time.perf_counter()
+                data = source.fetch(tickers)
+                seconds = time.perf_counter() - start
+                rows.append({'connections': n, 'seconds': seconds, 'tickers_per_s': len(tickers) / seconds,
+                             'mb': data.to_numpy().nbytes / 2**20, 'complete': data.shape == prices.shape})
+
+    return pd.DataFrame(rows)
+
+
+def main(argv: list = None, prog: str = None):
+    parser = argparse.ArgumentParser(prog=prog, description="Serve a price store over the chart API protocol, "
+                                                            "or benchmark the concurrent loader against it.")
+    parser.add_argument('--store', default=None, help="Folder of the price store to serve.")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added before every response.")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="Share of requests answered with 503.")
+    parser.add_argument('--benchmark', type=int, default=None, metavar='N', help="Load N synthetic tickers instead.")
+    args = parser.parse_args(argv)
+
+    if args.benchmark:
+        table = benchmark_loader(args.benchmark, latency=args.latency or 0.05)
+        print(table.to_string(index=False, float_format=lambda v: f"{v:.2f}"))
+        return
+
+    from price_store import DEFAULT_STORE_DIR
+
+    server = StubChartServer(args.store or DEFAULT_STORE_DIR, port=args.port, latency=args.latency,
+                             failure_rate=args.failure_rate)
+    with server:
+        print(f"Serving {server.store.root} at {server.url} (Ctrl+C to stop)")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,57 @@
-import yfinance as yf
 import pandas as pd
+from data_sources import DataSource, YFinanceSource
+from models import storage_dtype
+from price_store import PriceStore, DEFAULT_STORE_DIR
 
-def get_asset_data(tickers: list) -> pd.DataFrame:
+def get_asset_data(tickers: list, store_dir: str = None, offline: bool = False, source: DataSource = None,
+                   dtype=None) -> pd.DataFrame:
     """
     Download historical closing price data for given tickers.
 
     Parameters:
     tickers : list: A list of ticker symbols.
+    store_dir : str: Folder of a local PriceStore. When given, only the bars missing from the
+                store are downloaded and the data is read from disk.
+    offline : bool: Serve the data entirely from the local store, without downloading.
+    source : DataSource: Where prices are downloaded from, see data_sources.py. Defaults to yfinance.
+    dtype : str: 'float64' (default) or 'float32', which halves the memory of the panel.
 
     Returns:
-    pd.DataFrame: A DataFrame containing the closing prices of the tickers.
+    pd.DataFrame: A DataFrame containing the closing prices of the tickers, on the dates where all have one.
     """
 
-    data = yf.download(tickers, period="15y", interval="1d")["Close"]
+    return get_universe_data(tickers, store_dir, offline, source, dtype).dropna()
+
+
+
+def get_universe_data(tickers: list, store_dir: str = None, offline: bool = False, source: DataSource = None,
+                      dtype=None) -> pd.DataFrame:
+    """
+    Load the closing prices of a whole universe of tickers in one call.
+
+    Unlike get_asset_data, rows with missing prices are kept so each pair can be
+    aligned on its own dates with dropna.
+
+    Parameters:
+    tickers : list: A list of ticker symbols.
+    store_dir : str: Folder of a local PriceStore, see get_asset_data.
+    offline : bool: Serve the data entirely from the local store, without downloading.
+    source : DataSource: Where prices are downloaded from, see data_sources.py. ChartAPISource downloads the tickers concurrently.
+    dtype : str: 'float64' (default) or 'float32', which halves the memory of the panel.
+
+    Returns:
+    pd.DataFrame: A wide DataFrame with one column of closing prices per ticker.
+    """
+
+    tickers = list(dict.fromkeys(tickers))
+
+    if store_dir is not None or offline:
+        store = PriceStore(store_dir or DEFAULT_STORE_DIR)
+        if not offline:
+            store.update(tickers, source=source)
+        data = store.load_panel(tickers, dtype=dtype)
+    else:
+        data = (source or YFinanceSource()).fetch(tickers, period="15y")
 
     if isinstance(data, pd.Series):
         data = data.to_frame(name=tickers[0])
@@ -21,12 +60,9 @@ def get_asset_data(tickers: list) -> pd.DataFrame:
     data = data.sort_index()
 
     cols_presentes = [t for t in tickers if t in data.columns]
-    data = data.loc[:, cols_presentes]
-
-    data = data.dropna()
-
-    return data
+    data = data.loc[:, cols_presentes].astype(storage_dtype(dtype), copy=False)
 
+    return data.dropna(how="all")
 
 
 def split_data(data: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
@@ -48,6 +84,33 @@ def split_data(data: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
 
     return train_data, test_data
 
+
+def walk_forward_windows(n_obs: int, train_size: int, test_size: int) -> list[tuple[int, int, int]]:
+    """
+    Build rolling train/test windows for walk-forward evaluation.
+
+    Each window trains on `train_size` bars and tests on the `test_size` bars right after
+    them, and the next window moves forward by `test_size`, so the test parts are
+    contiguous and do not overlap.
+
+    Parameters:
+    n_obs : int: Number of observations in the data.
+    train_size : int: Number of training bars of each window.
+    test_size : int: Number of testing bars of each window.
+
+    Returns:
+    list[tuple[int, int, int]]: The (train start, test start, test end) positions of each window.
+                                The last test part is cut at the end of the data.
+    """
+
+    windows = []
+    start = 0
+    while start + train_size < n_obs:
+        windows.append((start, start + train_size, min(start + train_size + test_size, n_obs)))
+        start += test_size
+
+    return windows
+
 def add_overlay(train: pd.DataFrame, test: pd.DataFrame, overlay_size: int = 252):
     """
 
@@ -1,32 +1,55 @@
+import argparse
 from data_utils import get_asset_data, split_data, add_overlay
 from Backtesting import backtest
 from cointegration_functions import johansen
-from plots import plot_portfolio_value, plot_spread, plot_vecm_norm, plot_hr, plot_tickers, plot_returns_distribution, plot_real_vs_hat
 from metrics import all_metrics
 
 
-def main():
+def run(tickers: list = ("MS", "SCHW"), cash: float = 1000000, theta: float = 0.33, plots: bool = True,
+        report_dir: str = None, n_workers: int = 1, max_pvalue: float = None, source=None,
+        profile_path: str = None):
+    """
+    Backtest one pair on its testing data and print the results.
+
+    Parameters:
+    tickers : list: The (y, x) ticker symbols of the pair.
+    cash : float: Initial cash for the portfolio.
+    theta : float: Threshold for opening and closing positions based on normalized VECM.
+    plots : bool: Show the charts. The plotting libraries are only imported when charts are drawn.
+    report_dir : str: Write the charts to this folder instead of showing them.
+    n_workers : int: Number of worker processes rendering the report charts.
+    max_pvalue : float: Block new entries while the rolling ADF p-value of the pair is above this.
+    source : DataSource: Where prices are downloaded from, see data_sources.py. Defaults to yfinance.
+    profile_path : str: Profile the stages of the backtest loop and write the report to this JSON file.
+    """
 
     # Data Preparation
 
-    tickers = ["MS", "SCHW"]
-    data = get_asset_data(tickers)
+    data = get_asset_data(list(tickers), source=source)
     train_data, test_data = split_data(data)
     test_data_lp = add_overlay(train_data, test_data, overlay_size=252)
     eigenvector, _, _= johansen(train_data)
-    theta = 0.33
 
 
     # Backtesting
 
-    portfolio_value, final_cash, stats, p2_values, p2_hat_values, vecm_values, vecm_hat_values, vecm_norm_values, hr_values,\
-        borrow_costs, commission_costs, all_trades = backtest(test_data_lp,1000000, eigenvector, theta)
+    profiler = None
+    if profile_path is not None:
+        from profiling import StageProfiler
+        profiler = StageProfiler()
+
+    result = backtest(test_data_lp, cash, eigenvector, theta, profiler=profiler, record='full', max_pvalue=max_pvalue)
+    if profiler is not None:
+        profiler.save(profile_path)
+        print(f"Saved profile to {profile_path}")
+    portfolio_value = result.portfolio_value
+    stats = result.stats
 
     # Portfolio results
 
     print(f"\n--- PORTFOLIO VALUE ---")
     print(f"Final portfolio value: {portfolio_value.iloc[-1]:.2f}")
-    print(f"Final cash: {final_cash:.2f}")
+    print(f"Final cash: {result.final_cash:.2f}")
     
     # Metrics
 
@@ -36,8 +59,8 @@ def main():
     # Cost analysis
 
     print(f"\n--- COST ANALYSIS ---")
-    print(f"Borrow Costs: {borrow_costs:.2f}")
-    print(f"Commissions: {commission_costs:.2f}")
+    print(f"Borrow Costs: {result.borrow_costs:.2f}")
+    print(f"Commissions: {result.commission_costs:.2f}")
 
     # Trade statistics
 
@@ -50,18 +73,52 @@ def main():
     f"Win/Loss ratio: {stats['avg_win_loss']:.4f}\n"
     f"Profit factor: {stats['profit_factor']:.4f}"
     )
+    if result.blocked_entries is not None:
+        print(f"Entry signals blocked by the cointegration monitor: {result.blocked_entries}")
+
+    # Plots, written to image files in report mode
+    if report_dir is not None:
+        from plots import report_charts, render_charts
+
+        jobs = report_charts(report_dir, data, train_data, test_data, test_data_lp, result, theta)
+        for path in render_charts(jobs, n_workers=n_workers):
+            print(f"Saved {path}")
+        return
+
+    if not plots:
+        return
+
+    from plots import plot_portfolio_value, plot_spread, plot_vecm_norm, plot_hr, plot_tickers, plot_returns_distribution, plot_real_vs_hat
 
-    # Plots
     plot_tickers(data)
     plot_portfolio_value(test_data_lp, portfolio_value)
     plot_spread(train_data)
-    plot_real_vs_hat(test_data, p2_values, p2_hat_values)
-    plot_vecm_norm(test_data, vecm_norm_values, theta)
-    plot_real_vs_hat(test_data, vecm_values, vecm_hat_values)
-    plot_hr(test_data, hr_values)
-    plot_returns_distribution(all_trades)
+    plot_real_vs_hat(test_data, result.p2_values, result.p2_hat_values)
+    plot_vecm_norm(test_data, result.vecm_norm_values, theta)
+    plot_real_vs_hat(test_data, result.vecm_values, result.vecm_hat_values)
+    plot_hr(test_data, result.hr_values)
+    plot_returns_distribution(result.trades)
+
+
+def main(argv: list = None, prog: str = None):
+    parser = argparse.ArgumentParser(prog=prog, description="Pairs trading backtest of one pair.")
+    parser.add_argument('--tickers', nargs=2, default=["MS", "SCHW"])
+    parser.add_argument('--cash', type=float, default=1000000)
+    parser.add_argument('--theta', type=float, default=0.33)
+    parser.add_argument('--max-pvalue', type=float, default=None, help="Block entries while the rolling ADF p-value is above this.")
+    parser.add_argument('--no-plots', action='store_true', help="Only print the results.")
+    parser.add_argument('--report', default=None, metavar='DIR', help="Write the charts to this folder instead of showing them.")
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes rendering the report charts.")
+    parser.add_argument('--source', default=None, help="yfinance (default), yahoo for the concurrent loader, "
+                                                       "or the URL of a chart API server.")
+    parser.add_argument('--profile', default=None, metavar='PATH', help="Write a per-stage profile of the backtest loop to this JSON file.")
+    args = parser.parse_args(argv)
+
+    from data_sources import get_source
 
+    run(args.tickers, args.cash, args.theta, plots=not args.no_plots, report_dir=args.report, n_workers=args.workers,
+        max_pvalue=args.max_pvalue, source=get_source(args.source), profile_path=args.profile)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
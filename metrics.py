@@ -2,6 +2,9 @@ import numpy as np
 import pandas as pd
 
 
+METRIC_COLUMNS = ['Sharpe Ratio', 'Sortino Ratio', 'Maximum Drawdown', 'Calmar Ratio']
+
+
 def sharpe_ratio(portfolio_hist) -> float:
     """
     Calculate the Sharpe Ratio of a portfolio.
@@ -82,6 +85,92 @@ def calmar_ratio(portfolio_hist) -> float:
     return annual_return / max_drawdown if max_drawdown > 0 else 0
 
 
+def metrics_batch(equity_curves, index=None, chunk_size: int = 4096) -> pd.DataFrame:
+    """
+    Calculate all performance metrics for many portfolios at once.
+
+    Returns are computed once per curve and every metric is filled in from them and
+    from one running maximum, vectorized across the curves. NaN values are skipped
+    like the pandas versions above do.
+
+    Parameters:
+    equity_curves (np.ndarray or pd.DataFrame): Portfolio values, one column (configuration) per curve.
+                  A single 1-D curve is also accepted.
+    index (list): Labels of the curves. Defaults to the DataFrame columns or 0..N-1.
+    chunk_size (int): Number of curves processed together, bounds the temporary memory.
+
+    Returns:
+    pd.DataFrame: One row of metrics per curve.
+    """
+
+    if index is None and isinstance(equity_curves, pd.DataFrame):
+        index = equity_curves.columns
+    # float32 curves are kept as they are and converted one chunk at a time
+    values = np.asarray(equity_curves)
+    if values.dtype != np.float32:
+        values = values.astype(np.float64, copy=False)
+    if values.ndim == 1:
+        values = values[:, None]
+
+    n_curves = values.shape[1]
+    table = np.empty((n_curves, 4))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for start in range(0, n_curves, chunk_size):
+            v = values[:, start:start + chunk_size].astype(np.float64, copy=False)
+
+            # Returns, once
+            returns = v[1:] / v[:-1] - 1
+            valid = ~np.isnan(returns)
+            has_nan = not valid.all()
+            if has_nan:
+                returns[~valid] = 0.0
+            n = valid.sum(axis=0)
+            mean_return = returns.sum(axis=0) / n
+
+            # Sample standard deviations of the returns and of their downside
+            dev = returns - mean_return
+            if has_nan:
+                dev[~valid] = 0.0
+            std_return = np.sqrt(np.einsum('ij,ij->j', dev, dev) / (n - 1))
+            downside = np.minimum(0, returns, out=returns)
+            np.subtract(downside, downside.sum(axis=0) / n, out=dev)
+            if has_nan:
+                dev[~valid] = 0.0
+            downside_dev = np.sqrt(np.einsum('ij,ij->j', dev, dev) / (n - 1))
+
+            # Maximum drawdown. Wide blocks go one bar at a time so no (bars x curves)
+            # running maximum is stored, a few curves are cheaper with accumulate
+            if v.shape[1] < 64:
+                rolling_max = np.fmax.accumulate(v, axis=0)
+                drawdown = (rolling_max - v) / rolling_max
+                drawdown[np.isnan(drawdown)] = -np.inf
+                max_drawdown = drawdown.max(axis=0) if len(v) else np.full(v.shape[1], np.nan)
+                max_drawdown[np.isneginf(max_drawdown)] = np.nan
+            else:
+                peak = v[0].copy()
+                max_drawdown = np.full(v.shape[1], np.nan)
+                drawdown = np.empty(v.shape[1])
+                for row in v[1:]:
+                    np.fmax(peak, row, out=peak)
+                    np.subtract(peak, row, out=drawdown)
+                    np.divide(drawdown, peak, out=drawdown)
+                    np.fmax(max_drawdown, drawdown, out=max_drawdown)
+            max_drawdown = np.abs(max_drawdown)
+
+            annual_return = mean_return * 252
+            annual_std = std_return * np.sqrt(252)
+            annual_downside_dev = downside_dev * np.sqrt(252)
+
+            block = table[start:start + chunk_size]
+            block[:, 0] = np.where(annual_std > 0, annual_return / annual_std, 0)
+            block[:, 1] = np.where(annual_downside_dev > 0, annual_return / annual_downside_dev, 0)
+            block[:, 2] = max_drawdown
+            block[:, 3] = np.where(max_drawdown > 0, annual_return / max_drawdown, 0)
+
+    return pd.DataFrame(table, columns=METRIC_COLUMNS, index=index)
+
+
 def all_metrics(portfolio_value) -> pd.DataFrame:
     """
     Calculate all performance metrics for a portfolio.
@@ -93,11 +182,4 @@ def all_metrics(portfolio_value) -> pd.DataFrame:
     pd.DataFrame: DataFrame containing all performance metrics.
     """
 
-    metrics = pd.DataFrame({
-        'Sharpe Ratio': sharpe_ratio(portfolio_value),
-        'Sortino Ratio': sortino_ratio(portfolio_value),
-        'Maximum Drawdown': maximum_drawdown(portfolio_value),
-        'Calmar Ratio': calmar_ratio(portfolio_value)
-    }, index=['Metrics'])
-    
-    return metrics
\ No newline at end of file
+    return metrics_batch(np.asarray(portfolio_value, dtype=float), index=['Metrics'])
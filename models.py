@@ -1,10 +1,196 @@
 from dataclasses import dataclass
+import numpy as np
+import pandas as pd
 
-@dataclass
+@dataclass(slots=True)
 class Operation:
     ticker: str
     time: str
     entry_price: float
     exit_price: float
     n_shares: int
-    type: str
\ No newline at end of file
+    type: str
+
+
+@dataclass(slots=True)
+class Order:
+    action: str
+    operation: Operation
+    price: float
+    pnl: float = 0.0
+
+
+# What backtest records: nothing per bar, only the equity curve, or every diagnostic trace
+RECORD_LEVELS = ('none', 'equity', 'full')
+
+# Storage dtypes of price panels and recorded series. float32 halves their memory for universe
+# screens and sweeps, sums and filter states are still accumulated in float64
+STORAGE_DTYPES = ('float64', 'float32')
+
+
+def storage_dtype(dtype=None) -> np.dtype:
+    """
+    Validate a storage dtype.
+
+    Parameters:
+    dtype : str or np.dtype or None: 'float64' or 'float32'. None means float64.
+
+    Returns:
+    np.dtype: The dtype.
+    """
+
+    dtype = np.dtype(np.float64 if dtype is None else dtype)
+    if dtype.name not in STORAGE_DTYPES:
+        raise ValueError(f"dtype must be one of {STORAGE_DTYPES}")
+    return dtype
+
+
+@dataclass(slots=True)
+class BacktestResult:
+    portfolio_value: pd.Series
+    final_cash: float
+    stats: dict
+    borrow_costs: float
+    commission_costs: float
+    trades: list
+    record: str = 'full'
+    p2_values: np.ndarray = None
+    p2_hat_values: np.ndarray = None
+    vecm_values: np.ndarray = None
+    vecm_hat_values: np.ndarray = None
+    vecm_norm_values: np.ndarray = None
+    hr_values: np.ndarray = None
+    pnl_values: np.ndarray = None
+    adf_stat_values: np.ndarray = None
+    blocked_entries: int = None
+    profile: dict = None
+
+    def traces(self, index=None) -> pd.DataFrame:
+        """
+        Get the diagnostic traces as one DataFrame.
+
+        Parameters:
+        index : Optional index of the traded bars.
+
+        Returns:
+        pd.DataFrame: One column per trace, empty unless the backtest recorded 'full'.
+        """
+
+        columns = ('p2_values', 'p2_hat_values', 'vecm_values', 'vecm_hat_values', 'vecm_norm_values', 'hr_values',
+                   'adf_stat_values')
+        return pd.DataFrame({c: getattr(self, c) for c in columns if getattr(self, c) is not None}, index=index)
+
+    def __iter__(self):
+        # Unpacks in the order of the tuple backtest used to return
+        return iter((self.portfolio_value, self.final_cash, self.stats, self.p2_values, self.p2_hat_values,
+                     self.vecm_values, self.vecm_hat_values, self.vecm_norm_values, self.hr_values,
+                     self.borrow_costs, self.commission_costs, self.trades))
+
+
+@dataclass(slots=True)
+class PortfolioResult(BacktestResult):
+    """
+    Result of backtest_portfolio: the fields of BacktestResult, without the per pair traces.
+    """
+
+    def __iter__(self):
+        # Unpacks in the order of the tuple backtest_portfolio used to return
+        return iter((self.portfolio_value, self.final_cash, self.stats, self.borrow_costs, self.commission_costs,
+                     self.trades))
+
+
+class PositionBook:
+    __slots__ = ('tickers', 'index', 'net_shares', 'cost_basis', 'short_basis', 'longs', 'shorts', 'trades', 'keep_trades')
+
+    def __init__(self, tickers: list, keep_trades: bool = True):
+        """
+        Initialize a book of open positions over a fixed set of tickers.
+
+        Besides the open legs, the book keeps the net signed shares and the signed
+        entry value (cost basis) of each ticker up to date as legs are opened and
+        closed, so the portfolio can be valued with one dot product, see
+        portfolio_value.get_book_value for how that differs from a per-leg sum.
+
+        Parameters:
+        tickers : list: The ticker symbols the book can hold.
+        keep_trades : bool: Keep every opened leg in `trades`. Streaming users that
+                      collect the legs themselves can turn it off to keep the book's size bounded.
+        """
+
+        self.tickers = list(tickers)
+        self.index = {ticker: k for k, ticker in enumerate(self.tickers)}
+
+        self.net_shares = np.zeros(len(self.tickers))
+        self.cost_basis = np.zeros(len(self.tickers))
+        # Entry value of the open short legs, owed back when the shares are returned
+        self.short_basis = 0.0
+
+        self.longs: list[Operation] = []
+        self.shorts: list[Operation] = []
+        self.trades: list[Operation] = []
+        self.keep_trades = keep_trades
+
+    @property
+    def is_flat(self) -> bool:
+        """
+        Check whether the book has no open positions.
+
+        Returns:
+        bool: True if there are no open long or short legs.
+        """
+
+        return not self.longs and not self.shorts
+
+    def open(self, operation: Operation):
+        """
+        Add a new leg to the book.
+
+        Parameters:
+        operation : Operation: The leg being opened.
+        """
+
+        k = self.index[operation.ticker]
+        value = operation.entry_price * operation.n_shares
+
+        if operation.type == 'LONG':
+            self.longs.append(operation)
+            self.net_shares[k] += operation.n_shares
+            self.cost_basis[k] += value
+        else:
+            self.shorts.append(operation)
+            self.net_shares[k] -= operation.n_shares
+            self.cost_basis[k] -= value
+            self.short_basis += value
+
+        if self.keep_trades:
+            self.trades.append(operation)
+
+    def close(self, operation: Operation, exit_price: float):
+        """
+        Remove an open leg from the book.
+
+        Parameters:
+        operation : Operation: The leg being closed.
+        exit_price : float: The price the leg is closed at.
+        """
+
+        k = self.index[operation.ticker]
+        value = operation.entry_price * operation.n_shares
+
+        if operation.type == 'LONG':
+            self.longs.remove(operation)
+            self.net_shares[k] -= operation.n_shares
+            self.cost_basis[k] -= value
+        else:
+            self.shorts.remove(operation)
+            self.net_shares[k] += operation.n_shares
+            self.cost_basis[k] += value
+            self.short_basis -= value
+
+        operation.exit_price = exit_price
+
+        # Reset the running sums once flat so rounding does not build up across trades
+        if self.is_flat:
+            self.net_shares[:] = 0.0
+            self.cost_basis[:] = 0.0
+            self.short_basis = 0.0
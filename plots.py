@@ -1,22 +1,35 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
-import seaborn as sns
 from models import Operation
-import statsmodels.api as st
 
-def plot_tickers(data: pd.DataFrame):
+# seaborn and statsmodels are slow to import, the plots that use them import them
+
+# Report mode settings, long series are downsampled to about REPORT_MAX_POINTS points
+REPORT_MAX_POINTS = 2000
+REPORT_DPI = 100
+REPORT_FORMAT = "png"
+
+
+def plot_tickers(data: pd.DataFrame, path: str = None, max_points: int = None):
     """
     Plot the price data of two tickers.
     
     Parameters:
     data : pd.DataFrame: A DataFrame with two columns representing the tickers' prices
+    path : str: Save the chart to this file instead of showing it.
+    max_points : int: Downsample long series to about this many points with LTTB.
     """
 
     colors = ['cornflowerblue', 'rosybrown']
 
+    index, series = _downsample(data.index, [data[col] for col in data.columns], max_points)
+
     plt.figure(figsize=(8, 4))
     for i, col in enumerate(data.columns):
-        plt.plot(data.index, data[col], label=col, color=colors[i], linewidth=2)
+        plt.plot(index, series[i], label=col, color=colors[i], linewidth=2)
 
     plt.title("Prices of Tickers")
     plt.xlabel("Date")
@@ -24,36 +37,44 @@ def plot_tickers(data: pd.DataFrame):
     plt.legend(title="Tickers")
     plt.grid(True)
     plt.tight_layout()
-    plt.show()
+    _finish(path)
 
 
-def plot_portfolio_value(test_data: pd.DataFrame, portfolio_value: pd.Series):
+def plot_portfolio_value(test_data: pd.DataFrame, portfolio_value: pd.Series, path: str = None, max_points: int = None):
     """
     Plot the portfolio value over time.
 
     Parameters:
     test_data : pd.DataFrame: The testing DataFrame containing the dates.
     portfolio_value : pd.Series: Series representing the portfolio value over time.
+    path : str: Save the chart to this file instead of showing it.
+    max_points : int: Downsample long series to about this many points with LTTB.
     """
 
+    index, (portfolio_value,) = _downsample(test_data.index, [portfolio_value], max_points)
+
     plt.figure(figsize=(8, 4))
-    plt.plot(test_data.index, portfolio_value, label="Portfolio Value", color='cornflowerblue')
+    plt.plot(index, portfolio_value, label="Portfolio Value", color='cornflowerblue')
     plt.title("Portfolio Value Over Time")
     plt.xlabel("Date")
     plt.ylabel("Portfolio Value")
     plt.grid()
     plt.legend()
-    plt.show()
+    _finish(path)
 
 
-def plot_spread(data: pd.DataFrame):
+def plot_spread(data: pd.DataFrame, path: str = None, max_points: int = None):
     """
     Plot the spread between two tickers over time.
 
     Parameters:
     data : pd.DataFrame: A DataFrame with two columns representing the tickers' prices.
+    path : str: Save the chart to this file instead of showing it.
+    max_points : int: Downsample long series to about this many points with LTTB.
     """
 
+    import statsmodels.api as st
+
     data = data.copy()
     x_spread = st.add_constant(data.iloc[:, 0])
     y_spread = data.iloc[:, 1]
@@ -62,18 +83,20 @@ def plot_spread(data: pd.DataFrame):
     residuals_spread = model.resid
     mean_residuals_spread = residuals_spread.mean()
 
+    index, (residuals_spread,) = _downsample(data.index, [residuals_spread], max_points)
+
     plt.figure(figsize=(8, 4))
-    plt.plot(data.index, residuals_spread, label="Spread", color='cornflowerblue')
+    plt.plot(index, residuals_spread, label="Spread", color='cornflowerblue')
     plt.axhline(y=mean_residuals_spread, color='red', linestyle='--', linewidth=1.5, label='Mean Spread')
     plt.title("Spread Over Time")
     plt.xlabel("Date")
     plt.ylabel("Spread Value")
     plt.grid()
     plt.legend()
-    plt.show()
+    _finish(path)
 
 
-def plot_vecm_norm(test_data: pd.DataFrame, vecm: pd.Series, theta: float):
+def plot_vecm_norm(test_data: pd.DataFrame, vecm: pd.Series, theta: float, path: str = None, max_points: int = None):
     """
     Plot the normalized VECM values over time with threshold lines.
 
@@ -81,10 +104,14 @@ def plot_vecm_norm(test_data: pd.DataFrame, vecm: pd.Series, theta: float):
     test_data : pd.DataFrame: The testing DataFrame containing the dates.
     vecm : pd.Series: Series representing the normalized VECM values over time.
     theta : float: The threshold value for plotting horizontal lines.
+    path : str: Save the chart to this file instead of showing it.
+    max_points : int: Downsample long series to about this many points with LTTB.
     """
 
+    index, (vecm,) = _downsample(test_data.index, [vecm], max_points)
+
     plt.figure(figsize=(8, 4))
-    plt.plot(test_data.index, vecm, label="VECM_Norm", color='cornflowerblue')
+    plt.plot(index, vecm, label="VECM_Norm", color='cornflowerblue')
 
     
     plt.axhline(y=theta, color='green', linestyle='--', linewidth=1.5, label=f'+θ ({theta:.2f})')
@@ -94,29 +121,33 @@ def plot_vecm_norm(test_data: pd.DataFrame, vecm: pd.Series, theta: float):
     plt.ylabel("VECM_Norm Value")
     plt.grid(True)
     plt.legend()
-    plt.show()
+    _finish(path)
 
 
-def plot_hr(test_data: pd.DataFrame, hr_values: pd.Series):
+def plot_hr(test_data: pd.DataFrame, hr_values: pd.Series, path: str = None, max_points: int = None):
     """
     Plot the hedge ratio over time.
 
     Parameters:
     test_data : pd.DataFrame: The testing DataFrame containing the dates.
     hr_values : pd.Series: Series representing the hedge ratio over time.
+    path : str: Save the chart to this file instead of showing it.
+    max_points : int: Downsample long series to about this many points with LTTB.
     """
 
+    index, (hr_values,) = _downsample(test_data.index, [hr_values], max_points)
+
     plt.figure(figsize=(8, 4))
-    plt.plot(test_data.index, hr_values, label="Hedge Ratio", color='cornflowerblue')
+    plt.plot(index, hr_values, label="Hedge Ratio", color='cornflowerblue')
     plt.title("Hedge Ratio Over Time")
     plt.xlabel("Date")
     plt.ylabel("Hedge Ratio")
     plt.grid()
     plt.legend()
-    plt.show()
+    _finish(path)
 
 
-def plot_real_vs_hat(data: pd.DataFrame, y_real, y_hat):
+def plot_real_vs_hat(data: pd.DataFrame, y_real, y_hat, path: str = None, max_points: int = None):
     """
     Plot the real vs predicted values.
 
@@ -124,11 +155,15 @@ def plot_real_vs_hat(data: pd.DataFrame, y_real, y_hat):
     data : pd.DataFrame: A DataFrame containing the dates.
     y_real : pd.Series: Series representing the real values.
     y_hat : pd.Series: Series representing the predicted values.
+    path : str: Save the chart to this file instead of showing it.
+    max_points : int: Downsample long series to about this many points with LTTB.
     """
 
+    index, (y_real, y_hat) = _downsample(data.index, [y_real, y_hat], max_points)
+
     plt.figure(figsize=(12, 4))
-    plt.plot(data.index, y_real, label='Real', color='cornflowerblue', linewidth=2)
-    plt.plot(data.index, y_hat, label='Predicted', color='rosybrown', linestyle='--', linewidth=2)
+    plt.plot(index, y_real, label='Real', color='cornflowerblue', linewidth=2)
+    plt.plot(index, y_hat, label='Predicted', color='rosybrown', linestyle='--', linewidth=2)
     
     plt.title("Real vs Predicted")
     plt.xlabel("Date")
@@ -136,17 +171,20 @@ def plot_real_vs_hat(data: pd.DataFrame, y_real, y_hat):
     plt.legend()
     plt.grid(True)
     plt.tight_layout()
-    plt.show()
+    _finish(path)
 
 
-def plot_returns_distribution(all_trades: list[Operation]):
+def plot_returns_distribution(all_trades: list[Operation], path: str = None):
     """
     Plot the distribution of returns per trade.
 
     Parameters:
     all_trades : list[Operation]: A list of Operation objects representing all trades.
+    path : str: Save the chart to this file instead of showing it.
     """
 
+    import seaborn as sns
+
     returns = []
     for position in all_trades:
         returns_per_share = position.exit_price / position.entry_price - 1
@@ -162,5 +200,151 @@ def plot_returns_distribution(all_trades: list[Operation]):
     plt.ylabel("Frequency")
     plt.grid(True)
     plt.tight_layout()
-    plt.show()
+    _finish(path)
+
+
+
+def lttb_indices(x, y, n_out: int) -> np.ndarray:
+    """
+    Pick the points of a series to keep with Largest-Triangle-Three-Buckets downsampling.
+
+    The first and last points are always kept. The points in between are split into
+    n_out - 2 buckets and each bucket keeps the point forming the largest triangle with
+    the point kept before it and the average of the next bucket, which preserves peaks,
+    troughs and the overall shape. NaN points are never picked.
+
+    Parameters:
+    x : array-like: The x values (numbers or datetimes), increasing.
+    y : array-like: The y values.
+    n_out : int: Number of points to keep.
+
+    Returns:
+    np.ndarray: The sorted positions of the kept points.
+    """
+
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        x = x.astype('datetime64[ns]').astype(np.int64)
+    x = x.astype(float)
+    y = np.asarray(y, dtype=float)
+
+    valid = np.flatnonzero(np.isfinite(y))
+    n = valid.size
+    if n <= n_out or n_out < 3:
+        return valid
+    x, y = x[valid], y[valid]
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    kept = np.empty(n_out, dtype=int)
+    kept[0], kept[-1] = 0, n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_lo, next_hi = (edges[i + 1], edges[i + 2]) if i < n_out - 3 else (n - 1, n)
+        avg_x = x[next_lo:next_hi].mean()
+        avg_y = y[next_lo:next_hi].mean()
+
+        # Twice the area of the triangle (a, candidate, next bucket average)
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        kept[i + 1] = a
+
+    return valid[kept]
+
+
+def _downsample(index, series: list, max_points: int = None):
+    # Keep the union of the LTTB points of every series so all lines share the same x values
+    index = pd.Index(index)
+    values = [np.asarray(s, dtype=float) for s in series]
+    if max_points is None or len(index) <= max_points:
+        return index, values
+
+    kept = np.unique(np.concatenate([lttb_indices(index, v, max_points) for v in values]))
+    return index[kept], [v[kept] for v in values]
+
+
+def _finish(path: str = None):
+    # Show the chart, or write it to a file and free the figure in report mode
+    if path is None:
+        plt.show()
+    else:
+        plt.savefig(path, dpi=REPORT_DPI)
+        plt.close()
+
+
+def report_charts(out_dir: str, data: pd.DataFrame, train_data: pd.DataFrame, test_data: pd.DataFrame,
+                  test_data_lp: pd.DataFrame, result, theta: float, prefix: str = "",
+                  max_points: int = REPORT_MAX_POINTS) -> list[tuple]:
+    """
+    List the charts main.py shows for one backtest, as jobs writing image files.
+
+    Parameters:
+    out_dir : str: Folder of the image files.
+    data : pd.DataFrame: The full price data.
+    train_data : pd.DataFrame: The training data.
+    test_data : pd.DataFrame: The testing data.
+    test_data_lp : pd.DataFrame: The testing data with the training overlay that was backtested.
+    result : BacktestResult: The backtest result, recorded with record='full'.
+    theta : float: The threshold used in the backtest.
+    prefix : str: Prefix of the file names, to keep several configurations in one folder.
+    max_points : int: Downsample long series to about this many points.
+
+    Returns:
+    list[tuple]: (plot function name, args, kwargs) jobs for render_charts.
+    """
+
+    def path(name):
+        return os.path.join(out_dir, f"{prefix}{name}.{REPORT_FORMAT}")
+
+    return [
+        ('plot_tickers', (data,), {'path': path('tickers'), 'max_points': max_points}),
+        ('plot_portfolio_value', (test_data_lp, result.portfolio_value),
+         {'path': path('portfolio_value'), 'max_points': max_points}),
+        ('plot_spread', (train_data,), {'path': path('spread'), 'max_points': max_points}),
+        ('plot_real_vs_hat', (test_data, result.p2_values, result.p2_hat_values),
+         {'path': path('p2_real_vs_hat'), 'max_points': max_points}),
+        ('plot_vecm_norm', (test_data, result.vecm_norm_values, theta),
+         {'path': path('vecm_norm'), 'max_points': max_points}),
+        ('plot_real_vs_hat', (test_data, result.vecm_values, result.vecm_hat_values),
+         {'path': path('vecm_real_vs_hat'), 'max_points': max_points}),
+        ('plot_hr', (test_data, result.hr_values), {'path': path('hedge_ratio'), 'max_points': max_points}),
+        ('plot_returns_distribution', (result.trades,), {'path': path('returns_distribution')}),
+    ]
+
+
+def _init_render_worker():
+    plt.switch_backend('Agg')
+
+
+def _render_chart(job: tuple) -> str:
+    name, args, kwargs = job
+    globals()[name](*args, **kwargs)
+    return kwargs['path']
+
+
+def render_charts(jobs: list, n_workers: int = 1) -> list[str]:
+    """
+    Render chart jobs to image files on the non-interactive Agg backend.
+
+    Parameters:
+    jobs : list: (plot function name, args, kwargs) jobs, see report_charts. Every job needs a `path`.
+    n_workers : int: Number of worker processes rendering the charts.
+
+    Returns:
+    list[str]: The paths of the written files.
+    """
+
+    for _, _, kwargs in jobs:
+        os.makedirs(os.path.dirname(kwargs['path']) or '.', exist_ok=True)
+
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_render_worker) as pool:
+            return list(pool.map(_render_chart, jobs, chunksize=max(1, len(jobs) // (4 * n_workers))))
 
+    backend = plt.get_backend()
+    _init_render_worker()
+    try:
+        return [_render_chart(job) for job in jobs]
+    finally:
+        plt.switch_backend(backend)
@@ -0,0 +1,285 @@
+import warnings
+
+from models import Operation, PortfolioResult
+from rolling_johansen import RollingJohansenBatch
+from rolling_stats import rolling_zscore_batch
+from Kalman_structure import kalman_filter_batch
+from Backtesting import trade_statistics
+import pandas as pd
+import numpy as np
+
+
+def pair_signals(y_prices: np.ndarray, x_prices: np.ndarray, initial_eigs, Q_filter: float = 0.01,
+                 R_filter: float = 0.0001, norm_window: int = 252,
+                 process_noise: bool = False) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Compute the hedge ratio and normalized VECM of many pairs at once, as backtest does for one pair.
+
+    Parameters:
+    y_prices (np.ndarray): (T, N) prices of the first ticker of each pair.
+    x_prices (np.ndarray): (T, N) prices of the second ticker of each pair.
+    initial_eigs: (N, 2) initial eigenvectors for the VECM.
+    Q_filter (float): Process noise covariance of the Kalman filters, only used with process_noise.
+    R_filter (float): Measurement noise covariance of the Kalman filters.
+    norm_window (int): Number of bars used to normalize the VECM.
+    process_noise (bool): Add Q_filter to the error covariance of the Kalman filters before each update.
+
+    Returns:
+    tuple[np.ndarray, np.ndarray]: The (T - 252, N) hedge ratios and normalized VECM of the traded bars.
+    """
+
+    n_bars, n_pairs = y_prices.shape
+
+    # Kalman Filter Hedge Ratio
+    hr_weights = kalman_filter_batch(x_prices[252:], y_prices[252:], Q_filter=Q_filter, R_filter=R_filter,
+                                     process_noise=process_noise)
+    hr_values = hr_weights[:, :, 1]
+
+    # Eigenvector from the previous 252 bars, keeping the last good one where the test fails
+    k_eig = np.array(initial_eigs, dtype=float).reshape(n_pairs, 2)
+    eig_path = np.empty((max(n_bars - 252, 0), n_pairs, 2))
+    rolling_johansen = RollingJohansenBatch(n_pairs, window=252)
+    bar_prices = np.stack([y_prices, x_prices], axis=2)
+    for post in range(n_bars):
+        if post >= 252:
+            eig, _, _ = rolling_johansen.result()
+            ok = np.isfinite(eig).all(axis=1)
+            k_eig = np.where(ok[:, None], eig, k_eig)
+            eig_path[post - 252] = k_eig
+        rolling_johansen.update(bar_prices[post])
+
+    # Kalman Filter Eigenvector and normalized VECM
+    vecm_values = eig_path[:, :, 0] * y_prices[252:] + eig_path[:, :, 1] * x_prices[252:]
+    eig_h_weights = kalman_filter_batch(y_prices[252:], x_prices[252:], vecm_values, Q_filter=Q_filter, R_filter=R_filter,
+                                        process_noise=process_noise)
+    vecm_hat_values = eig_h_weights[:, :, 0] * y_prices[252:] + eig_h_weights[:, :, 1] * x_prices[252:]
+    vecm_norm_values = rolling_zscore_batch(vecm_hat_values, window=norm_window)
+
+    return hr_values, vecm_norm_values
+
+
+def backtest_portfolio(data: pd.DataFrame, pairs: list, cash: float, initial_eigs, theta: float,
+                       Q_filter: float = 0.01, R_filter: float = 0.0001, norm_window: int = 252,
+                       position_size: float = None, process_noise: bool = False) -> PortfolioResult:
+    """
+    Backtest the pairs trading strategy on many pairs at once with one shared cash balance.
+
+    Every pair keeps its own Kalman filters, rolling Johansen eigenvector and VECM
+    normalization, and trades exactly as in backtest. Pairs that open on the same bar are
+    sized from the same cash balance, each using `position_size` of it, and their legs are
+    paid in pair order, skipping the legs the remaining cash no longer covers, so cash never
+    goes negative even when position_size * len(pairs) > 1. With a single pair the results
+    match backtest.
+
+    All pairs run on one calendar: only the dates on which every ticker has a price are
+    kept, so one recent listing shortens the whole backtest. A warning says how many dates
+    were dropped and which ticker has the shortest history; leave such tickers out or
+    backtest their pairs on their own.
+
+    Parameters:
+    data (pd.DataFrame): DataFrame containing the price data of every ticker in the pairs.
+    pairs (list): List of (y ticker, x ticker) pairs.
+    cash (float): Initial cash for the portfolio.
+    initial_eigs: Initial eigenvector for the VECM of each pair.
+    theta (float): Threshold for opening and closing positions based on normalized VECM.
+    Q_filter (float): Process noise covariance of the Kalman filters, only used with process_noise.
+    R_filter (float): Measurement noise covariance of the Kalman filters.
+    norm_window (int): Number of bars used to normalize the VECM.
+    position_size (float): Fraction of cash used for the first leg of a new position. Defaults to 0.4 / len(pairs).
+    process_noise (bool): Add Q_filter to the error covariance of the Kalman filters before each update.
+
+    Returns:
+    PortfolioResult: A BacktestResult with the portfolio value series, final cash, trade statistics,
+                     borrow costs, commission costs, all trades and the P&L of each closed leg.
+                     It still unpacks like the tuple backtest_portfolio used to return.
+    """
+
+    COM = 0.125 / 100
+    BORROW_RATE = (0.25 / 100) / 252
+
+    pairs = [tuple(pair) for pair in pairs]
+    n_pairs = len(pairs)
+    if position_size is None:
+        position_size = 0.4 / n_pairs
+
+    tickers = list(dict.fromkeys(t for pair in pairs for t in pair))
+    panel = data.loc[:, tickers].dropna(how="all")
+    data = panel.dropna()
+    if len(data) < len(panel):
+        # Usually a recent listing, whose first date then starts the whole backtest
+        shortest = panel.notna().sum().idxmin()
+        warnings.warn(f"backtest_portfolio keeps only the {len(data)} dates all tickers have prices on, dropping "
+                      f"{len(panel) - len(data)} of {len(panel)}; {shortest} has the shortest history")
+    dates = data.index
+    y_prices = np.column_stack([data[y].to_numpy(dtype=float) for y, _ in pairs])
+    x_prices = np.column_stack([data[x].to_numpy(dtype=float) for _, x in pairs])
+    n_bars = len(data)
+
+    hr_values, vecm_norm_values = pair_signals(y_prices, x_prices, initial_eigs, Q_filter, R_filter, norm_window,
+                                               process_noise)
+
+    # Signed shares of the y and x legs of every pair
+    shares_y = np.zeros(n_pairs)
+    shares_x = np.zeros(n_pairs)
+    short_basis = 0.0
+    open_legs: list[list[Operation]] = [[] for _ in range(n_pairs)]
+
+    all_trades = []
+    borrow_costs = []
+    commission_costs = []
+    pnl_values = []
+    port_hist = np.empty(n_bars)
+
+    for post in range(n_bars):
+        p1 = y_prices[post]
+        p2 = x_prices[post]
+
+        if post < 252:
+            port_hist[post] = cash + short_basis + float(shares_y @ p1 + shares_x @ p2)
+            continue
+
+        i = dates[post]
+        t = post - 252
+        hr = hr_values[t]
+        vecm_norm = vecm_norm_values[t]
+
+        #Open positions
+        flat = (shares_y == 0) & (shares_x == 0)
+        up = flat & (vecm_norm > theta)
+        down = flat & (vecm_norm < -theta)
+        enter = up | down
+
+        if enter.any():
+            # y leg: long when the VECM is above theta, short when below
+            available_cash = cash * position_size
+            n_y = np.floor_divide(available_cash, p1 * (1 + COM))
+            ok_y = enter & (available_cash > p1 * n_y * (1 + COM)) & (n_y > 0)
+            cost_y = np.where(up, p1 * n_y * (1 + COM), p1 * n_y * COM)
+            # Pairs entering on the same bar are sized from the same cash, so each is
+            # checked again against what the pairs before it left
+            for k in np.flatnonzero(ok_y):
+                if cash > cost_y[k]:
+                    cash -= cost_y[k]
+                else:
+                    ok_y[k] = False
+
+            # x leg, hedged with the Kalman hedge ratio
+            n_x = np.trunc(n_y * hr)
+            cost_x = np.where(up, p2 * n_x * COM, p2 * n_x * (1 + COM))
+            ok_x = enter & (n_x > 0)
+            for k in np.flatnonzero(ok_x):
+                if cash > cost_x[k]:
+                    cash -= cost_x[k]
+                else:
+                    ok_x[k] = False
+
+            for k in np.flatnonzero(ok_y | ok_x):
+                y, x = pairs[k]
+                legs = []
+                if ok_y[k]:
+                    legs.append(Operation(ticker=y, time=i, entry_price=p1[k], exit_price=0.0, n_shares=n_y[k],
+                                          type='LONG' if up[k] else 'SHORT'))
+                    shares_y[k] = n_y[k] if up[k] else -n_y[k]
+                if ok_x[k]:
+                    legs.append(Operation(ticker=x, time=i, entry_price=p2[k], exit_price=0.0, n_shares=n_x[k],
+                                          type='SHORT' if up[k] else 'LONG'))
+                    shares_x[k] = -n_x[k] if up[k] else n_x[k]
+                for leg in legs:
+                    if leg.type == 'SHORT':
+                        short_basis += leg.entry_price * leg.n_shares
+                open_legs[k].extend(legs)
+                all_trades.extend(legs)
+
+        # Close positions
+        closing = (np.abs(vecm_norm) < 0.05) & ~((shares_y == 0) & (shares_x == 0))
+
+        if closing.any():
+            closing_pairs = np.flatnonzero(closing)
+            prices = {}
+            for k in closing_pairs:
+                y, x = pairs[k]
+                prices[k] = {y: p1[k], x: p2[k]}
+
+            # Close long positions
+            for k in closing_pairs:
+                for position in open_legs[k]:
+                    if position.type == 'LONG':
+                        price = prices[k][position.ticker]
+                        cash += price * position.n_shares * (1 - COM)
+                        commission_costs.append(price * position.n_shares * COM)
+                        pnl_values.append((price * position.n_shares * (1 - COM)) - (position.entry_price * position.n_shares * (1+COM)))
+                        position.exit_price = price
+
+            # Borrow cost
+            for k in closing_pairs:
+                for position in open_legs[k]:
+                    if position.type == 'SHORT':
+                        price = prices[k][position.ticker]
+                        cash -= price * position.n_shares * BORROW_RATE
+                        borrow_costs.append(price * position.n_shares * BORROW_RATE)
+
+            # Close short positions
+            for k in closing_pairs:
+                for position in open_legs[k]:
+                    if position.type == 'SHORT':
+                        price = prices[k][position.ticker]
+                        pnl = (position.entry_price - price) * position.n_shares
+                        com = price * position.n_shares * COM
+                        cash += pnl - com
+                        commission_costs.append(com)
+                        pnl_values.append(pnl)
+                        position.exit_price = price
+                        short_basis -= position.entry_price * position.n_shares
+                open_legs[k] = []
+
+            shares_y[closing] = 0.0
+            shares_x[closing] = 0.0
+
+            # Reset the running sum once flat so rounding does not build up across trades
+            if not (shares_y.any() or shares_x.any()):
+                short_basis = 0.0
+
+        port_hist[post] = cash + short_basis + float(shares_y @ p1 + shares_x @ p2)
+
+    # Close remaining positions at the end of the backtest
+    if n_bars:
+        for k in range(n_pairs):
+            y, x = pairs[k]
+            prices = {y: y_prices[-1, k], x: x_prices[-1, k]}
+            for position in open_legs[k]:
+                if position.type == 'LONG':
+                    price = prices[position.ticker]
+                    cash += price * position.n_shares * (1 - COM)
+                    commission_costs.append(price * position.n_shares * COM)
+                    pnl_values.append((price * position.n_shares * (1 - COM)) - (position.entry_price * position.n_shares * (1+COM)))
+                    position.exit_price = price
+        for k in range(n_pairs):
+            y, x = pairs[k]
+            prices = {y: y_prices[-1, k], x: x_prices[-1, k]}
+            for position in open_legs[k]:
+                if position.type == 'SHORT':
+                    price = prices[position.ticker]
+                    pnl = (position.entry_price - price) * position.n_shares
+                    com = price * position.n_shares * COM
+                    cash += pnl - com
+                    commission_costs.append(com)
+                    pnl_values.append(pnl)
+                    position.exit_price = price
+
+    # Cost summaries
+    borrow_costs = sum(borrow_costs)
+    commission_costs = sum(commission_costs)
+
+    # Trade statistics
+    stats = trade_statistics(pnl_values)
+
+    return PortfolioResult(
+        portfolio_value=pd.Series(port_hist),
+        final_cash=cash,
+        stats=stats,
+        borrow_costs=borrow_costs,
+        commission_costs=commission_costs,
+        trades=all_trades,
+        record='equity',
+        pnl_values=np.array(pnl_values),
+    )
@@ -1,37 +1,24 @@
-from models import Operation
+from models import PositionBook
 
-def get_portfolio_value(cash: float, long_ops: list[Operation], short_ops: list[Operation],n_shares: float, y_ticker: float, x_ticker: float, y_p: float, x_p: float) -> float:
+def get_book_value(cash: float, book: PositionBook, prices) -> float:
     """
-    Calculate the total portfolio value.
-    
+    Calculate the total portfolio value from a position book.
+
+    Longs are worth their shares at the current price and shorts their entry value
+    minus the current value of the shares, so the whole book is the short entry
+    value plus the net signed shares times the current prices.
+
+    The terms are summed in that order rather than leg by leg, so the value can differ
+    from a per-leg sum by a few ulp: a relative difference below 1e-15, under 1e-9 on
+    a 1,000,000 portfolio. Trades, cash and costs do not depend on it.
+
     Parameters:
     cash : float: The available cash in the portfolio.
-    long_ops : list[Operation]: List of long position operations.
-    short_ops : list[Operation]: List of short position operations.
-    n_shares : float: Number of shares held.
-    y_ticker : float: Ticker symbol for asset Y.
-    x_ticker : float: Ticker symbol for asset X.
-    y_p : float: Current price of asset Y.
-    x_p : float: Current price of asset X.
-    
+    book : PositionBook: The open positions.
+    prices : array-like: Current prices of the book's tickers, in the book's order.
+
     Returns:
     float: Total portfolio value.
     """
-    
-    port_val = cash
-
-    # add long positions value
-    for position in long_ops:
-        if position.ticker == x_ticker:
-            port_val += x_p * position.n_shares
-        if position.ticker == y_ticker:
-            port_val += y_p * position.n_shares
-
-    # add short positions value
-    for position in short_ops:
-        if position.ticker == x_ticker:
-            port_val += (position.entry_price - x_p) * position.n_shares
-        if position.ticker == y_ticker:
-            port_val += (position.entry_price - y_p) * position.n_shares
 
-    return port_val
+    return cash + book.short_basis + float(book.net_shares @ prices)
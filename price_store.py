@@ -0,0 +1,250 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from models import storage_dtype
+
+
+DEFAULT_STORE_DIR = "price_store"
+
+
+class PriceStore():
+    def __init__(self, root: str = DEFAULT_STORE_DIR):
+        """
+        Initialize a local columnar store of daily closing prices.
+
+        Each ticker is kept in its own folder as two .npy columns (dates and close),
+        which are memory-mapped on read.
+
+        Parameters:
+        root : str: Folder holding the store.
+        """
+
+        self.root = root
+
+    def _path(self, ticker: str, column: str) -> str:
+        return os.path.join(self.root, ticker, f"{column}.npy")
+
+    def has(self, ticker: str) -> bool:
+        """
+        Check whether a ticker is in the store.
+
+        Parameters:
+        ticker : str: The ticker symbol.
+
+        Returns:
+        bool: True if the ticker has stored prices.
+        """
+
+        return os.path.exists(self._path(ticker, "close"))
+
+    def read(self, ticker: str) -> pd.Series:
+        """
+        Read the stored closing prices of a ticker.
+
+        Parameters:
+        ticker : str: The ticker symbol.
+
+        Returns:
+        pd.Series: The closing prices indexed by date, backed by memory-mapped arrays.
+        """
+
+        dates = np.load(self._path(ticker, "dates"), mmap_mode="r")
+        close = np.load(self._path(ticker, "close"), mmap_mode="r")
+
+        return pd.Series(close, index=pd.DatetimeIndex(dates), name=ticker, copy=False)
+
+    def last_date(self, ticker: str):
+        """
+        Get the date of the last stored bar of a ticker.
+
+        Parameters:
+        ticker : str: The ticker symbol.
+
+        Returns:
+        pd.Timestamp or None: The last stored date, or None if the ticker is not stored.
+        """
+
+        if not self.has(ticker):
+            return None
+        dates = np.load(self._path(ticker, "dates"), mmap_mode="r")
+        return pd.Timestamp(dates[-1]) if dates.size else None
+
+    def write(self, ticker: str, prices: pd.Series):
+        """
+        Replace the stored closing prices of a ticker.
+
+        Parameters:
+        ticker : str: The ticker symbol.
+        prices : pd.Series: Closing prices indexed by date.
+        """
+
+        prices = prices.dropna().sort_index()
+        prices = prices[~prices.index.duplicated(keep="last")]
+        dates = pd.DatetimeIndex(prices.index).tz_localize(None).to_numpy(dtype="datetime64[ns]")
+        close = prices.to_numpy(dtype=np.float64)
+
+        os.makedirs(os.path.join(self.root, ticker), exist_ok=True)
+        for column, values in (("dates", dates), ("close", close)):
+            # Write to a temporary file of this writer first so readers never see a half written
+            # column and concurrent writers do not clash
+            path = self._path(ticker, column)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".npy")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    np.save(f, values)
+                os.replace(tmp, path)
+            except BaseException:
+                os.remove(tmp)
+                raise
+
+    def append(self, ticker: str, prices: pd.Series):
+        """
+        Append new bars to the stored closing prices of a ticker.
+
+        Bars before the last stored date are ignored. A bar on the last stored date
+        replaces it, so a close stored during the session is refreshed.
+
+        Parameters:
+        ticker : str: The ticker symbol.
+        prices : pd.Series: Closing prices indexed by date.
+        """
+
+        last = self.last_date(ticker)
+        if last is None:
+            self.write(ticker, prices)
+            return
+
+        prices = prices.dropna()
+        prices.index = pd.DatetimeIndex(prices.index).tz_localize(None)
+        new = prices[prices.index >= last]
+        if new.empty:
+            return
+
+        stored = self.read(ticker)
+        self.write(ticker, pd.concat([stored[stored.index < last], new]))
+
+    def update(self, tickers: list, period: str = "15y", source=None):
+        """
+        Download the missing history of each ticker and append it to the store.
+
+        Tickers not in the store get their full `period` history, stored tickers
+        only the bars from their last stored date on, that last bar included so a
+        partial close is refreshed. Stored tickers with the same last date are
+        downloaded together.
+
+        Parameters:
+        tickers : list: A list of ticker symbols.
+        period : str: History to download for tickers not in the store yet.
+        source : DataSource: Where prices are downloaded from, see data_sources.py. Defaults to yfinance.
+        """
+
+        from data_sources import YFinanceSource
+
+        source = source or YFinanceSource()
+
+        missing = [t for t in tickers if not self.has(t)]
+        if missing:
+            close = source.fetch(missing, period=period)
+            for ticker in missing:
+                if ticker in close.columns:
+                    self.write(ticker, close[ticker])
+
+        starts = {}
+        for ticker in tickers:
+            if ticker in missing or not self.has(ticker):
+                continue
+            start = self.last_date(ticker)
+            starts.setdefault(start, []).append(ticker)
+
+        for start, group in starts.items():
+            close = source.fetch(group, start=start)
+            for ticker in group:
+                if ticker in close.columns:
+                    self.append(ticker, close[ticker])
+
+    def iter_aligned(self, tickers: list, chunk_size: int = 100_000, prices: bool = True):
+        """
+        Stream the closing prices of two tickers, aligned on their common dates, in chunks.
+
+        The columns are memory-mapped and joined chunk by chunk, each side reading at most
+        `chunk_size` bars at a time, so memory stays bounded by the chunk size whatever
+        the length of the history. Suited to long intraday histories.
+
+        Parameters:
+        tickers : list: The (y, x) ticker symbols.
+        chunk_size : int: Maximum number of bars read from each ticker per chunk.
+        prices : bool: Also yield the prices. Without them only the dates are read.
+
+        Yields:
+        tuple: The dates of the chunk and, with `prices`, the prices of y and x on those dates.
+        """
+
+        y, x = tickers
+        dates_y = np.load(self._path(y, "dates"), mmap_mode="r")
+        dates_x = np.load(self._path(x, "dates"), mmap_mode="r")
+        if prices:
+            close_y = np.load(self._path(y, "close"), mmap_mode="r")
+            close_x = np.load(self._path(x, "close"), mmap_mode="r")
+
+        i = j = 0
+        while i < len(dates_y) and j < len(dates_x):
+            chunk_y = np.asarray(dates_y[i:i + chunk_size])
+            chunk_x = np.asarray(dates_x[j:j + chunk_size])
+
+            # Only the dates both chunks cover can be matched, the rest waits for the next chunk
+            last = min(chunk_y[-1], chunk_x[-1])
+            end_y = i + int(np.searchsorted(chunk_y, last, side="right"))
+            end_x = j + int(np.searchsorted(chunk_x, last, side="right"))
+
+            dates, idx_y, idx_x = np.intersect1d(chunk_y[:end_y - i], chunk_x[:end_x - j], assume_unique=True,
+                                                 return_indices=True)
+            if dates.size:
+                if prices:
+                    yield dates, np.asarray(close_y[i:end_y])[idx_y], np.asarray(close_x[j:end_x])[idx_x]
+                else:
+                    yield (dates,)
+
+            i, j = end_y, end_x
+
+    def count_aligned(self, tickers: list, chunk_size: int = 100_000) -> int:
+        """
+        Count the common dates of two tickers without loading their prices.
+
+        Parameters:
+        tickers : list: The (y, x) ticker symbols.
+        chunk_size : int: Maximum number of bars read from each ticker per chunk.
+
+        Returns:
+        int: Number of bars iter_aligned yields in total.
+        """
+
+        return sum(len(dates) for dates, in self.iter_aligned(tickers, chunk_size, prices=False))
+
+    def load_panel(self, tickers: list, years: int = 15, dtype=None) -> pd.DataFrame:
+        """
+        Load the stored closing prices of several tickers as one aligned DataFrame.
+
+        Parameters:
+        tickers : list: A list of ticker symbols.
+        years : int or None: Keep only the last `years` years of history. None keeps everything.
+        dtype : str: 'float64' (default) or 'float32'. Each column is converted as it is read,
+                so no float64 copy of the whole panel is made.
+
+        Returns:
+        pd.DataFrame: A DataFrame containing the closing prices of the stored tickers.
+        """
+
+        dtype = storage_dtype(dtype)
+        series = [self.read(t).astype(dtype, copy=False) for t in tickers if self.has(t)]
+        if not series:
+            return pd.DataFrame(columns=[])
+
+        data = pd.concat(series, axis=1)
+        if years is not None:
+            start = data.index.max() - pd.DateOffset(years=years)
+            data = data.loc[data.index >= start]
+
+        return data
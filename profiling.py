@@ -0,0 +1,151 @@
+import json
+import time
+import tracemalloc
+
+
+# on_bar stages of PairsStrategy and the methods that run them
+STRATEGY_STAGES = {
+    'johansen_refit': '_johansen_refit',
+    'johansen_update': '_johansen_update',
+    'cointegration_monitor': '_monitor',
+    'kalman_hedge_ratio': '_hedge_ratio',
+    'kalman_eigenvector': '_eigenvector',
+    'normalization': '_normalize',
+    'signals': '_trade',
+    'portfolio_value': '_portfolio_value',
+}
+
+
+class StageProfiler():
+    def __init__(self, track_memory: bool = False):
+        """
+        Initialize a profiler of the stages of the backtest loop.
+
+        The profiler wraps the stage methods of one object, so objects that are not
+        instrumented run their plain methods and pay nothing for it. For each stage
+        it records the number of calls and the cumulative wall time and, with
+        `track_memory`, the memory allocated through tracemalloc.
+
+        Parameters:
+        track_memory : bool: Also record allocations. tracemalloc slows everything down,
+                       so the times of a memory run are not representative.
+        """
+
+        self.track_memory = track_memory
+        self.stages = {}
+        self.total_seconds = 0.0
+        self.n_bars = 0
+        self._start = None
+        self._own_tracemalloc = False
+
+    def instrument(self, obj, stages: dict = None):
+        """
+        Replace the stage methods of an object with timed versions.
+
+        Parameters:
+        obj : The object to instrument, a PairsStrategy by default.
+        stages : dict: Stage names mapped to the method names that run them. Defaults to STRATEGY_STAGES.
+        """
+
+        for name, method in (stages or STRATEGY_STAGES).items():
+            setattr(obj, method, self._wrap(name, getattr(obj, method)))
+
+    def _wrap(self, name: str, func):
+        # [calls, seconds, allocated bytes, net bytes]
+        stat = self.stages.setdefault(name, [0, 0.0, 0, 0])
+        perf_counter = time.perf_counter
+
+        if not self.track_memory:
+            def timed(*args):
+                start = perf_counter()
+                result = func(*args)
+                stat[1] += perf_counter() - start
+                stat[0] += 1
+                return result
+
+            return timed
+
+        get_traced_memory = tracemalloc.get_traced_memory
+        reset_peak = tracemalloc.reset_peak
+
+        def traced(*args):
+            before = get_traced_memory()[0]
+            reset_peak()
+            start = perf_counter()
+            result = func(*args)
+            stat[1] += perf_counter() - start
+            current, peak = get_traced_memory()
+            stat[0] += 1
+            stat[2] += peak - before
+            stat[3] += current - before
+            return result
+
+        return traced
+
+    def start(self):
+        """
+        Start the wall clock of the whole run.
+        """
+
+        if self.track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._own_tracemalloc = True
+        self._start = time.perf_counter()
+
+    def stop(self, n_bars: int = 0):
+        """
+        Stop the wall clock of the whole run.
+
+        Parameters:
+        n_bars : int: Number of bars processed.
+        """
+
+        self.total_seconds += time.perf_counter() - self._start
+        self.n_bars += n_bars
+        if self._own_tracemalloc:
+            tracemalloc.stop()
+            self._own_tracemalloc = False
+
+    def report(self) -> dict:
+        """
+        Build the profiling report.
+
+        Returns:
+        dict: Total time and bars, and per stage the calls, seconds, microseconds per call,
+              share of the total time and, when tracked, the allocated bytes (the sum of the
+              peak allocation of each call) and the net bytes kept after the calls.
+              `other_seconds` is the time of the run not spent in any stage.
+        """
+
+        stages = {}
+        for name, (calls, seconds, allocated, net) in self.stages.items():
+            stage = {
+                'calls': calls,
+                'seconds': seconds,
+                'us_per_call': seconds / calls * 1e6 if calls else 0.0,
+                'share': seconds / self.total_seconds if self.total_seconds else 0.0,
+            }
+            if self.track_memory:
+                stage['allocated_bytes'] = allocated
+                stage['net_bytes'] = net
+            stages[name] = stage
+
+        staged = sum(stage['seconds'] for stage in stages.values())
+        return {
+            'total_seconds': self.total_seconds,
+            'n_bars': self.n_bars,
+            'track_memory': self.track_memory,
+            'stages': stages,
+            'other_seconds': max(self.total_seconds - staged, 0.0),
+        }
+
+    def save(self, path: str):
+        """
+        Write the report to a JSON file.
+
+        Parameters:
+        path : str: Output file.
+        """
+
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
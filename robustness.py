@@ -0,0 +1,241 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from metrics import metrics_batch, METRIC_COLUMNS
+
+
+BOOTSTRAP_METHODS = ('stationary', 'block')
+TRADE_COLUMNS = ['total_pnl', 'win_rate', 'avg_win_loss', 'profit_factor', 'Maximum Drawdown']
+
+
+def bootstrap_indices(n: int, n_samples: int, block_size: float, method: str = 'stationary',
+                      rng: np.random.Generator = None) -> np.ndarray:
+    """
+    Draw the positions of many block-bootstrap resamples of a series at once.
+
+    Both methods wrap around the end of the series. 'block' is the circular moving block
+    bootstrap with blocks of `block_size` bars. 'stationary' is the stationary bootstrap of
+    Politis and Romano, whose block lengths are geometric with mean `block_size`.
+
+    Parameters:
+    n : int: Length of the series.
+    n_samples : int: Number of resamples.
+    block_size : float: Block length, or mean block length of the stationary bootstrap.
+    method : str: 'stationary' or 'block'.
+    rng : np.random.Generator: Random generator. Defaults to a fresh unseeded one.
+
+    Returns:
+    np.ndarray: An (n, n_samples) array of positions in the series, one column per resample.
+    """
+
+    if method not in BOOTSTRAP_METHODS:
+        raise ValueError(f"method must be one of {BOOTSTRAP_METHODS}")
+    rng = rng or np.random.default_rng()
+    steps = np.arange(n)[:, None]
+
+    if method == 'block':
+        size = max(int(round(block_size)), 1)
+        n_blocks = -(-n // size)
+        starts = rng.integers(0, n, size=(n_blocks, n_samples))
+        return (np.repeat(starts, size, axis=0)[:n] + steps % size) % n
+
+    # A new block starts on each bar with probability 1 / block_size, and always on the first
+    new_block = rng.random((n, n_samples)) < 1 / max(block_size, 1)
+    new_block[0] = True
+    starts = rng.integers(0, n, size=(n, n_samples))
+
+    # Position of the bar that started the current block, then walk forward from its start
+    block_start = np.maximum.accumulate(np.where(new_block, steps, 0), axis=0)
+    return (np.take_along_axis(starts, block_start, axis=0) + steps - block_start) % n
+
+
+def resample_equity(portfolio_value, n_samples: int, block_size: float = None, method: str = 'stationary',
+                    rng: np.random.Generator = None) -> np.ndarray:
+    """
+    Build bootstrap equity curves from the returns of one equity curve.
+
+    The returns are resampled in blocks, which keeps their short-range dependence, and
+    compounded from the first value of the curve.
+
+    Parameters:
+    portfolio_value : array-like: The equity curve.
+    n_samples : int: Number of resampled curves.
+    block_size : float: Block length, or mean block length of the stationary bootstrap.
+                 Defaults to the cube root of the number of returns.
+    method : str: 'stationary' or 'block'.
+    rng : np.random.Generator: Random generator.
+
+    Returns:
+    np.ndarray: A (T, n_samples) array of equity curves, one column per resample.
+    """
+
+    values = np.asarray(portfolio_value, dtype=float)
+    values = values[~np.isnan(values)]
+    returns = values[1:] / values[:-1] - 1
+    if block_size is None:
+        block_size = max(round(len(returns) ** (1 / 3)), 1)
+
+    resampled = returns[bootstrap_indices(len(returns), n_samples, block_size, method, rng)]
+
+    curves = np.empty((len(values), n_samples))
+    curves[0] = values[0]
+    np.cumprod(1 + resampled, axis=0, out=curves[1:])
+    curves[1:] *= values[0]
+    return curves
+
+
+def _bootstrap_chunk(task: tuple) -> np.ndarray:
+    values, n_samples, block_size, method, seed = task
+    curves = resample_equity(values, n_samples, block_size, method, np.random.default_rng(seed))
+    return metrics_batch(curves).to_numpy()
+
+
+def bootstrap_metrics(portfolio_value, n_samples: int = 5000, block_size: float = None, method: str = 'stationary',
+                      seed: int = 0, n_workers: int = 1, chunk_size: int = 1000) -> pd.DataFrame:
+    """
+    Compute the metrics.py statistics of many bootstrap resamples of an equity curve.
+
+    The resamples are drawn and scored in chunks of `chunk_size` curves, each chunk as one
+    (T, chunk_size) array through metrics_batch. Each chunk has its own child seed, so the
+    result depends on `seed` but not on `n_workers`.
+
+    Parameters:
+    portfolio_value : array-like: The equity curve.
+    n_samples : int: Number of resamples.
+    block_size : float: Block length, or mean block length of the stationary bootstrap.
+                 Defaults to the cube root of the number of returns.
+    method : str: 'stationary' or 'block'.
+    seed : int: Seed of the resamples.
+    n_workers : int: Number of worker processes scoring the chunks.
+    chunk_size : int: Number of resamples per chunk, bounds the memory to T x chunk_size floats.
+
+    Returns:
+    pd.DataFrame: One row of metrics (the METRIC_COLUMNS) per resample.
+    """
+
+    values = np.asarray(portfolio_value, dtype=float)
+    sizes = [min(chunk_size, n_samples - start) for start in range(0, n_samples, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(values, size, block_size, method, child) for size, child in zip(sizes, seeds)]
+
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            tables = list(pool.map(_bootstrap_chunk, tasks))
+    else:
+        tables = [_bootstrap_chunk(task) for task in tasks]
+
+    table = np.concatenate(tables) if tables else np.empty((0, len(METRIC_COLUMNS)))
+    return pd.DataFrame(table, columns=METRIC_COLUMNS)
+
+
+def bootstrap_trades(pnl_values, n_samples: int = 5000, cash: float = 1000000, seed: int = 0) -> pd.DataFrame:
+    """
+    Monte Carlo of the trade statistics, resampling the closed legs with replacement.
+
+    Every resample is a new sequence of as many legs, so it also gives the spread of the
+    maximum drawdown of the cash curve that the order of the trades alone can cause.
+
+    Parameters:
+    pnl_values : array-like: The P&L of each closed leg, e.g. BacktestResult.pnl_values.
+    n_samples : int: Number of resamples.
+    cash : float: Initial cash the P&L is added to for the drawdown.
+    seed : int: Seed of the resamples.
+
+    Returns:
+    pd.DataFrame: One row per resample with the total P&L, win rate, win/loss ratio,
+                  profit factor (as in Backtesting.trade_statistics) and maximum drawdown.
+    """
+
+    pnl = np.asarray(pnl_values, dtype=float)
+    if pnl.size == 0:
+        return pd.DataFrame(np.full((n_samples, len(TRADE_COLUMNS)), np.nan), columns=TRADE_COLUMNS)
+
+    rng = np.random.default_rng(seed)
+    resampled = pnl[rng.integers(0, pnl.size, size=(n_samples, pnl.size))]
+
+    wins = resampled > 0
+    losses = resampled < 0
+    n_wins = wins.sum(axis=1)
+    n_losses = losses.sum(axis=1)
+    gross_win = np.where(wins, resampled, 0).sum(axis=1)
+    gross_loss = np.where(losses, resampled, 0).sum(axis=1)
+
+    equity = cash + np.cumsum(resampled, axis=1)
+    peak = np.maximum(np.maximum.accumulate(equity, axis=1), cash)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        table = np.column_stack([
+            resampled.sum(axis=1),
+            n_wins / pnl.size,
+            np.where(n_losses > 0, (gross_win / n_wins) / np.abs(gross_loss / n_losses), np.nan),
+            np.where(n_losses > 0, gross_win / np.abs(gross_loss), np.nan),
+            ((peak - equity) / peak).max(axis=1),
+        ])
+
+    return pd.DataFrame(table, columns=TRADE_COLUMNS)
+
+
+def confidence_intervals(samples: pd.DataFrame, confidence: float = 0.95) -> pd.DataFrame:
+    """
+    Percentile confidence intervals of bootstrap statistics.
+
+    Parameters:
+    samples : pd.DataFrame: One row per resample, one column per statistic.
+    confidence : float: Coverage of the intervals.
+
+    Returns:
+    pd.DataFrame: One row per statistic with its mean, standard error, lower bound, median and upper bound.
+    """
+
+    alpha = (1 - confidence) / 2
+    quantiles = samples.quantile([alpha, 0.5, 1 - alpha])
+
+    return pd.DataFrame({
+        'mean': samples.mean(),
+        'std_error': samples.std(),
+        'lower': quantiles.iloc[0],
+        'median': quantiles.iloc[1],
+        'upper': quantiles.iloc[2],
+    })
+
+
+def main(argv: list = None, prog: str = None):
+    parser = argparse.ArgumentParser(prog=prog, description="Bootstrap confidence intervals of the pairs trading backtest.")
+    parser.add_argument('--tickers', nargs=2, default=["MS", "SCHW"])
+    parser.add_argument('--cash', type=float, default=1000000)
+    parser.add_argument('--theta', type=float, default=0.33)
+    parser.add_argument('--samples', type=int, default=5000)
+    parser.add_argument('--block', type=float, default=None, help="Mean block length, cube root of the bars by default.")
+    parser.add_argument('--method', default='stationary', help=f"One of {', '.join(BOOTSTRAP_METHODS)}.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    if args.method not in BOOTSTRAP_METHODS:
+        parser.error(f"unknown method: {args.method}")
+
+    from Backtesting import backtest
+    from cointegration_functions import johansen
+    from data_utils import get_asset_data, split_data, add_overlay
+
+    data = get_asset_data(args.tickers)
+    train_data, test_data = split_data(data)
+    test_data_lp = add_overlay(train_data, test_data, overlay_size=252)
+    eigenvector, _, _ = johansen(train_data)
+    result = backtest(test_data_lp, args.cash, eigenvector, args.theta, record='equity')
+
+    equity = bootstrap_metrics(result.portfolio_value, args.samples, args.block, args.method, args.seed,
+                               n_workers=args.workers)
+    trades = bootstrap_trades(result.pnl_values, args.samples, args.cash, args.seed)
+
+    print(f"\n--- EQUITY BOOTSTRAP ({args.method}, {args.samples} resamples) ---")
+    print(confidence_intervals(equity))
+    print("\n--- TRADE BOOTSTRAP ---")
+    print(confidence_intervals(trades))
+
+
+if __name__ == "__main__":
+    main()
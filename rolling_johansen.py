@@ -0,0 +1,352 @@
+import math
+from collections import deque
+import numpy as np
+from cointegration_functions import johansen_from_moments, johansen_critical_value
+
+
+class RollingJohansen():
+    def __init__(self, window: int = 252, n_vars: int = 2, det_order: int = 0, k_ar_diff: int = 1, resync: int = None):
+        """
+        Initialize a rolling Johansen estimator over a fixed window of prices.
+
+        The estimator keeps the windowed sums and cross products of the rows
+        [dx_t, dx_t-1 ... dx_t-k, x_t-k] used by coint_johansen, so adding a
+        new bar and dropping the oldest one costs O(1).
+
+        Parameters:
+        window : int: Number of price observations in the estimation window.
+        n_vars : int: Number of price series.
+        det_order : int: Deterministic term, -1 (none) or 0 (constant).
+        k_ar_diff : int: The number of lagged differences to include in the test.
+        resync : int or None: Recompute the sums from the stored rows every `resync` updates
+                 to bound floating point drift. Defaults to `window`.
+        """
+
+        if det_order not in (-1, 0):
+            raise ValueError("RollingJohansen only supports det_order -1 or 0")
+        if window < k_ar_diff + 4:
+            raise ValueError("window is too short for the requested k_ar_diff")
+
+        self.window = window
+        self.n_vars = n_vars
+        self.det_order = det_order
+        self.k_ar_diff = k_ar_diff
+        self.resync = window if resync is None else resync
+
+        # Number of regression rows inside a full window
+        self.n_rows = window - 1 - k_ar_diff
+        self.row_size = n_vars * (k_ar_diff + 2)
+
+        # Last k_ar_diff + 2 prices, needed to build the next row
+        self.prices = deque(maxlen=k_ar_diff + 2)
+
+        # Ring buffer of the rows currently inside the window
+        self.rows = np.zeros((self.n_rows, self.row_size))
+        self.head = 0
+        self.count = 0
+
+        # Windowed moments
+        self.row_sum = np.zeros(self.row_size)
+        self.row_prod = np.zeros((self.row_size, self.row_size))
+        self.since_resync = 0
+
+        # Levels are shifted by the first observation to keep the cross products small.
+        # Only valid with a constant term, which removes the shift again.
+        self.anchor = None
+
+        self.critical_value95 = johansen_critical_value(n_vars, det_order)
+
+    def update(self, prices):
+        """
+        Add a new observation to the window, dropping the oldest one if the window is full.
+
+        Parameters:
+        prices : array-like: The prices of the n_vars series at the new bar.
+        """
+
+        prices = [float(v) for v in prices]
+        if self.anchor is None:
+            self.anchor = prices if self.det_order == 0 else [0.0] * self.n_vars
+
+        self.prices.append([v - a for v, a in zip(prices, self.anchor)])
+        if len(self.prices) < self.k_ar_diff + 2:
+            return
+
+        # dx_t followed by the lagged differences, newest first
+        window = list(self.prices)
+        row = []
+        for cur, prev in zip(window[:0:-1], window[-2::-1]):
+            row.extend(c - p for c, p in zip(cur, prev))
+        # Level aligned as in coint_johansen
+        row.extend(window[-1 - self.k_ar_diff])
+        row = np.array(row)
+
+        if self.count == self.n_rows:
+            old = self.rows[self.head]
+            self.row_sum += row - old
+            self.row_prod += np.outer(row, row) - np.outer(old, old)
+        else:
+            self.row_sum += row
+            self.row_prod += np.outer(row, row)
+            self.count += 1
+
+        self.rows[self.head] = row
+        self.head = (self.head + 1) % self.n_rows
+
+        self.since_resync += 1
+        if self.since_resync >= self.resync:
+            rows = self.rows[:self.count]
+            self.row_sum = rows.sum(axis=0)
+            self.row_prod = rows.T @ rows
+            self.since_resync = 0
+
+    @property
+    def ready(self) -> bool:
+        """
+        Check whether the window is full.
+
+        Returns:
+        bool: True once `window` observations have been added.
+        """
+
+        return self.count == self.n_rows
+
+    def result(self):
+        """
+        Run the Johansen test on the current window.
+
+        Returns:
+        tuple: A tuple containing the first eigenvector, the 95% critical value, and the trace statistic,
+               matching cointegration_functions.johansen on the same window.
+        """
+
+        if not self.ready:
+            raise ValueError("RollingJohansen window is not full yet")
+
+        p = self.n_vars
+        m = self.count
+        cov = self.row_prod
+        if self.det_order == 0:
+            cov = cov - np.outer(self.row_sum, self.row_sum) / m
+
+        if p == 2 and self.k_ar_diff <= 1:
+            return self._result_pair(cov.tolist(), m)
+
+        d = slice(0, p)
+        z = slice(p, p * (self.k_ar_diff + 1))
+        lv = slice(p * (self.k_ar_diff + 1), self.row_size)
+
+        # Partial the lagged differences out of dx_t and x_t-k
+        s00 = cov[d, d]
+        skk = cov[lv, lv]
+        sk0 = cov[lv, d]
+        if self.k_ar_diff > 0:
+            czz = cov[z, z]
+            b_d = np.linalg.solve(czz, cov[z, d])
+            b_l = np.linalg.solve(czz, cov[z, lv])
+            s00 = s00 - cov[d, z] @ b_d
+            skk = skk - cov[lv, z] @ b_l
+            sk0 = sk0 - cov[lv, z] @ b_d
+
+        s00 = s00 / m
+        skk = skk / m
+        sk0 = sk0 / m
+
+        # Same eigen decomposition and normalization as coint_johansen
+        sig = sk0 @ np.linalg.inv(s00) @ sk0.T
+        au, du = np.linalg.eig(np.linalg.inv(skk) @ sig)
+        temp = np.linalg.inv(np.linalg.cholesky(du.T @ skk @ du))
+        dt = du @ temp
+
+        aind = np.argsort(au)[::-1]
+        a = au[aind]
+        evec = dt[:, aind]
+        non_zero = evec.flat != 0
+        if np.any(non_zero):
+            evec *= np.sign(evec.flat[non_zero][0])
+
+        trace_stat = -m * np.sum(np.log(1 - a))
+
+        return evec[:, 0], self.critical_value95, trace_stat
+
+    def _result_pair(self, cov, m):
+        """
+        Closed-form Johansen test for two series with at most one lagged difference.
+
+        Parameters:
+        cov : list: The (centered) cross product matrix of the window rows as nested lists.
+        m : int: Number of rows in the window.
+
+        Returns:
+        tuple: A tuple containing the first eigenvector, the 95% critical value, and the trace statistic.
+        """
+
+        (d00, d01, *_), (d10, d11, *_) = cov[0], cov[1]
+        l = 2 * self.k_ar_diff + 2
+        s00 = [d00, d01, d10, d11]
+        skk = [cov[l][l], cov[l][l + 1], cov[l + 1][l], cov[l + 1][l + 1]]
+        sk0 = [cov[l][0], cov[l][1], cov[l + 1][0], cov[l + 1][1]]
+
+        # Partial the lagged difference out of dx_t and x_t-1
+        if self.k_ar_diff == 1:
+            izz = _inv2([cov[2][2], cov[2][3], cov[3][2], cov[3][3]])
+            zd = [cov[2][0], cov[2][1], cov[3][0], cov[3][1]]
+            zl = [cov[2][l], cov[2][l + 1], cov[3][l], cov[3][l + 1]]
+            b_d = _mul2(izz, zd)
+            b_l = _mul2(izz, zl)
+            s00 = _sub2(s00, _mul2(_t2(zd), b_d))
+            skk = _sub2(skk, _mul2(_t2(zl), b_l))
+            sk0 = _sub2(sk0, _mul2(_t2(zl), b_d))
+
+        s00 = [v / m for v in s00]
+        skk = [v / m for v in skk]
+        sk0 = [v / m for v in sk0]
+
+        # Largest eigenvalue of inv(skk) @ sk0 @ inv(s00) @ sk0'
+        sig = _mul2(_mul2(sk0, _inv2(s00)), _t2(sk0))
+        a, b, c, d = _mul2(_inv2(skk), sig)
+        half_tr = (a + d) / 2
+        det = a * d - b * c
+        lam = half_tr + math.sqrt(max(half_tr * half_tr - det, 0.0))
+
+        # Eigenvector from the better conditioned row of (M - lam I) v = 0
+        v0, v1 = (b, lam - a) if abs(b) + abs(lam - a) >= abs(lam - d) + abs(c) else (lam - d, c)
+        quad = skk[0] * v0 * v0 + (skk[1] + skk[2]) * v0 * v1 + skk[3] * v1 * v1
+        if not quad > 0:
+            raise np.linalg.LinAlgError("Matrix is not positive definite")
+        scale = 1 / math.sqrt(quad)
+        if v0 < 0:
+            scale = -scale
+
+        # Sum of log(1 - eigenvalue) is the log of the characteristic polynomial at 1
+        trace_stat = -m * math.log(1 - 2 * half_tr + det)
+
+        return np.array([v0 * scale, v1 * scale]), self.critical_value95, trace_stat
+
+
+
+class RollingJohansenBatch():
+    def __init__(self, n_pairs: int, window: int = 252, resync: int = None):
+        """
+        Initialize rolling Johansen estimators for many pairs that move bar by bar together.
+
+        Same test as RollingJohansen with two series, a constant term and one lagged
+        difference, with the windowed moments of every pair updated at once.
+
+        Parameters:
+        n_pairs : int: Number of pairs.
+        window : int: Number of price observations in the estimation window.
+        resync : int or None: Recompute the sums from the stored rows every `resync` updates.
+                 Defaults to `window`.
+        """
+
+        self.n_pairs = n_pairs
+        self.window = window
+        self.resync = window if resync is None else resync
+        self.n_rows = window - 2
+
+        self.prev = None
+        self.prev_diff = None
+        self.anchor = None
+
+        self.rows = np.zeros((self.n_rows, n_pairs, 6))
+        self.head = 0
+        self.count = 0
+
+        self.row_sum = np.zeros((n_pairs, 6))
+        self.row_prod = np.zeros((n_pairs, 6, 6))
+        self.since_resync = 0
+
+        self.critical_value95 = johansen_critical_value()
+
+    def update(self, prices):
+        """
+        Add a new observation of every pair to the windows.
+
+        Parameters:
+        prices : np.ndarray: A (n_pairs, 2) array with the prices of each pair at the new bar.
+        """
+
+        if self.anchor is None:
+            self.anchor = np.array(prices, dtype=float)
+        prices = prices - self.anchor
+
+        if self.prev is None:
+            self.prev = prices
+            return
+        diff = prices - self.prev
+        if self.prev_diff is None:
+            self.prev, self.prev_diff = prices, diff
+            return
+
+        row = np.concatenate([diff, self.prev_diff, self.prev], axis=1)
+        self.prev, self.prev_diff = prices, diff
+
+        prod = row[:, :, None] * row[:, None, :]
+        if self.count == self.n_rows:
+            old = self.rows[self.head]
+            self.row_sum += row - old
+            self.row_prod += prod - old[:, :, None] * old[:, None, :]
+        else:
+            self.row_sum += row
+            self.row_prod += prod
+            self.count += 1
+
+        self.rows[self.head] = row
+        self.head = (self.head + 1) % self.n_rows
+
+        self.since_resync += 1
+        if self.since_resync >= self.resync:
+            rows = self.rows[:self.count]
+            self.row_sum = rows.sum(axis=0)
+            self.row_prod = np.einsum('tpi,tpj->pij', rows, rows)
+            self.since_resync = 0
+
+    @property
+    def ready(self) -> bool:
+        """
+        Check whether the windows are full.
+
+        Returns:
+        bool: True once `window` observations have been added.
+        """
+
+        return self.count == self.n_rows
+
+    def result(self):
+        """
+        Run the Johansen test on the current window of every pair.
+
+        Returns:
+        tuple: A tuple containing the (n_pairs, 2) first eigenvectors, the 95% critical value,
+               and the trace statistics. Pairs whose test fails get NaN.
+        """
+
+        if not self.ready:
+            raise ValueError("RollingJohansenBatch window is not full yet")
+
+        m = self.count
+        cov = self.row_prod - self.row_sum[:, :, None] * self.row_sum[:, None, :] / m
+        eigenvectors, trace_stat = johansen_from_moments(cov, m)
+
+        return eigenvectors, self.critical_value95, trace_stat
+
+
+def _inv2(a):
+    det = a[0] * a[3] - a[1] * a[2]
+    if det == 0:
+        raise np.linalg.LinAlgError("Singular matrix")
+    return [a[3] / det, -a[1] / det, -a[2] / det, a[0] / det]
+
+
+def _mul2(a, b):
+    return [a[0] * b[0] + a[1] * b[2], a[0] * b[1] + a[1] * b[3],
+            a[2] * b[0] + a[3] * b[2], a[2] * b[1] + a[3] * b[3]]
+
+
+def _sub2(a, b):
+    return [a[0] - b[0], a[1] - b[1], a[2] - b[2], a[3] - b[3]]
+
+
+def _t2(a):
+    return [a[0], a[2], a[1], a[3]]
@@ -0,0 +1,190 @@
+import math
+import numpy as np
+
+
+# A window whose standard deviation is below this fraction of the size of its values is flat,
+# its z-score is NaN. Rounding leaves a flat window a tiny nonzero std, never exactly zero
+FLAT_TOL = 1e-7
+
+
+class RollingStats():
+    def __init__(self, window: int = 252, resync: int = None):
+        """
+        Initialize a rolling mean and standard deviation over the last `window` values.
+
+        Values are kept in a ring buffer and the running mean and sum of squared
+        deviations are updated with Welford's method as values enter and leave,
+        so each update costs O(1). NaN values take a slot in the window but are
+        left out of the statistics, like np.nanmean / np.nanstd.
+
+        Parameters:
+        window : int: Number of values in the window.
+        resync : int or None: Recompute the statistics from the buffer every `resync` updates
+                 to bound floating point drift. Defaults to `window`.
+        """
+
+        self.window = window
+        self.resync = window if resync is None else resync
+
+        self.buffer = np.full(window, np.nan)
+        self.head = 0
+        self.count = 0
+
+        # Welford state over the non-NaN values in the window
+        self.n = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self.since_resync = 0
+
+    def _add(self, value: float):
+        self.n += 1
+        delta = value - self._mean
+        self._mean += delta / self.n
+        self._m2 += delta * (value - self._mean)
+
+    def _remove(self, value: float):
+        self.n -= 1
+        if self.n == 0:
+            self._mean = 0.0
+            self._m2 = 0.0
+            return
+        delta = value - self._mean
+        self._mean -= delta / self.n
+        self._m2 -= delta * (value - self._mean)
+
+    def update(self, value: float):
+        """
+        Add a new value to the window, dropping the oldest one if the window is full.
+
+        Parameters:
+        value : float: The new value.
+        """
+
+        value = float(value)
+
+        if self.count == self.window:
+            old = float(self.buffer[self.head])
+            if old == old:
+                self._remove(old)
+        else:
+            self.count += 1
+
+        self.buffer[self.head] = value
+        self.head = (self.head + 1) % self.window
+        if value == value:
+            self._add(value)
+
+        self.since_resync += 1
+        if self.since_resync >= self.resync:
+            values = self.buffer[:self.count]
+            values = values[~np.isnan(values)]
+            self.n = values.size
+            self._mean = float(values.mean()) if self.n else 0.0
+            self._m2 = float(((values - self._mean) ** 2).sum()) if self.n else 0.0
+            self.since_resync = 0
+
+    @property
+    def ready(self) -> bool:
+        """
+        Check whether the window is full.
+
+        Returns:
+        bool: True once `window` values have been added.
+        """
+
+        return self.count == self.window
+
+    @property
+    def mean(self) -> float:
+        """
+        Get the mean of the non-NaN values in the window.
+
+        Returns:
+        float: The rolling mean, NaN if the window holds no values.
+        """
+
+        return self._mean if self.n else np.nan
+
+    @property
+    def std(self) -> float:
+        """
+        Get the population standard deviation of the non-NaN values in the window.
+
+        Returns:
+        float: The rolling standard deviation, NaN if the window holds no values.
+        """
+
+        return math.sqrt(max(self._m2, 0.0) / self.n) if self.n else np.nan
+
+    def zscore(self, value: float) -> float:
+        """
+        Normalize a value with the rolling mean and standard deviation.
+
+        Parameters:
+        value : float: The value to normalize.
+
+        Returns:
+        float: The z-score, NaN before the window is full or if the window is flat, see FLAT_TOL.
+        """
+
+        if not self.ready:
+            return np.nan
+
+        std = self.std
+        mean = self.mean
+        if std > FLAT_TOL * abs(mean):
+            return (value - mean) / std
+        return np.nan
+
+
+def rolling_zscore_batch(values, window: int = 252) -> np.ndarray:
+    """
+    Rolling z-score of many series at once, as RollingStats.zscore gives for each column.
+
+    The windowed sums come from cumulative sums, which lose precision as they grow, so
+    like RollingStats' resync they restart every `window` rows, and each block is
+    centered on the mean of the window it starts with so the sums stay small.
+
+    Parameters:
+    values : np.ndarray: The (T, N) values to normalize.
+    window : int: Number of values in the window.
+
+    Returns:
+    np.ndarray: The (T, N) z-scores, NaN before the window is full or where the window is flat, see FLAT_TOL.
+    """
+
+    values = np.asarray(values, dtype=float)
+    n_obs, n_series = values.shape
+    zscores = np.full((n_obs, n_series), np.nan)
+    if n_obs < window:
+        return zscores
+
+    def window_sum(v):
+        c = np.concatenate([np.zeros((1, n_series)), np.cumsum(v, axis=0)])
+        return c[window:] - c[:-window]
+
+    for start in range(window - 1, n_obs, window):
+        # Output rows start..stop-1 need the values from start - window + 1 on
+        stop = min(start + window, n_obs)
+        block = values[start - window + 1:stop]
+        valid = ~np.isnan(block)
+
+        with np.errstate(invalid='ignore'):
+            first = np.where(valid[:window], block[:window], 0.0)
+            offset = first.sum(axis=0) / np.maximum(valid[:window].sum(axis=0), 1)
+        centered = np.where(valid, block - offset, 0.0)
+
+        n = window_sum(valid.astype(float))
+        s1 = window_sum(centered)
+        s2 = window_sum(centered * centered)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = s1 / n
+            std = np.sqrt(np.maximum(s2 / n - mean * mean, 0.0))
+            z = (block[window - 1:] - offset - mean) / std
+            # The size of the values: their distance to the offset and the offset itself
+            flat = ~(std > FLAT_TOL * (np.sqrt(s2 / n) + np.abs(offset + mean)))
+        z[flat] = np.nan
+        zscores[start:stop] = z
+
+    return zscores
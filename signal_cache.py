@@ -0,0 +1,184 @@
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from cointegration_monitor import CointegrationMonitor
+from strategy import PairsStrategy
+
+
+# Per bar signals of PairsStrategy, NaN on the warm-up bars. adf_stat is only there with a monitor
+SIGNAL_COLUMNS = ('hr', 'p2_hat', 'vecm', 'vecm_hat', 'vecm_norm')
+
+
+def compute_signals(data: pd.DataFrame, initial_eig, Q_filter: float = 0.01, R_filter: float = 0.0001,
+                    norm_window: int = 252, monitor_window: int = None, monitor_lag: int = 1,
+                    process_noise: bool = False) -> dict:
+    """
+    Compute the signal stage of the backtest: the Kalman hedge ratio, the rolling Johansen
+    eigenvector and the VECM with its normalization.
+
+    None of them depend on theta or on the cash, so they are computed once, by a
+    PairsStrategy that never trades, and backtest(..., signals=...) replays only the
+    entries, exits and accounting against them for each theta.
+
+    Parameters:
+    data : pd.DataFrame: DataFrame containing price data for two assets.
+    initial_eig : array-like: Initial eigenvector for the VECM.
+    Q_filter : float: Process noise covariance of both Kalman filters, only used with process_noise.
+    R_filter : float: Measurement noise covariance of both Kalman filters.
+    norm_window : int: Number of bars used to normalize the VECM.
+    monitor_window : int or None: Also record the ADF statistic of a CointegrationMonitor over this
+                     many bars, so the replay can block entries with any max_pvalue.
+    monitor_lag : int: Number of lagged differences of the monitor's ADF regression.
+    process_noise : bool: Add Q_filter to the error covariance of both Kalman filters before each update.
+
+    Returns:
+    dict: One array per signal (SIGNAL_COLUMNS, plus adf_stat with a monitor), one value per bar of
+          data.dropna(), NaN before trading starts.
+    """
+
+    data = data.dropna()
+    y, x = data.columns[0], data.columns[1]
+    y_list = data[y].to_numpy(dtype=float).tolist()
+    x_list = data[x].to_numpy(dtype=float).tolist()
+    n_bars = len(data)
+
+    strategy = PairsStrategy((y, x), 0.0, initial_eig, np.inf, Q_filter=Q_filter, R_filter=R_filter,
+                             norm_window=norm_window, process_noise=process_noise)
+    monitor = CointegrationMonitor(monitor_window, monitor_lag) if monitor_window is not None else None
+
+    values = np.full((len(SIGNAL_COLUMNS), n_bars), np.nan)
+    hr, p2_hat, vecm, vecm_hat, vecm_norm = values
+    signals = dict(zip(SIGNAL_COLUMNS, values))
+    if monitor is not None:
+        adf_stat = signals['adf_stat'] = np.full(n_bars, np.nan)
+
+    for t in range(n_bars):
+        strategy.on_bar(None, y_list[t], x_list[t])
+        if monitor is not None:
+            monitor.update(y_list[t], x_list[t])
+
+        if t >= 252:
+            hr[t] = strategy.hr
+            p2_hat[t] = strategy.p2_hat
+            vecm[t] = strategy.vecm
+            vecm_hat[t] = strategy.vecm_hat
+            vecm_norm[t] = strategy.vecm_norm
+            if monitor is not None:
+                adf_stat[t] = monitor.stat
+
+    return signals
+
+
+def signal_key(data: pd.DataFrame, initial_eig, Q_filter: float = 0.01, R_filter: float = 0.0001,
+               norm_window: int = 252, monitor_window: int = None, monitor_lag: int = 1,
+               process_noise: bool = False) -> str:
+    """
+    Build the cache key of the signals of one price panel and signal configuration.
+
+    Parameters:
+    data : pd.DataFrame: DataFrame containing price data for two assets.
+    initial_eig, Q_filter, R_filter, norm_window, monitor_window, monitor_lag, process_noise: As in compute_signals.
+
+    Returns:
+    str: A hash of the prices, dates and tickers of data.dropna() and of the parameters. Without
+         process_noise Q_filter does not change the signals, so it is left out of the key.
+    """
+
+    data = data.dropna()
+    digest = hashlib.sha1()
+    digest.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    digest.update(repr([str(c) for c in data.columns[:2]]).encode())
+    params = (np.asarray(initial_eig, dtype=float).tolist(), float(Q_filter) if process_noise else None,
+              float(R_filter), int(norm_window),
+              monitor_window, monitor_lag if monitor_window is not None else None)
+    digest.update(repr(params).encode())
+
+    return digest.hexdigest()
+
+
+class SignalCache():
+    def __init__(self, maxsize: int = 16, cache_dir: str = None):
+        """
+        Initialize a cache of computed signals.
+
+        Signals are kept in memory with least recently used eviction and, with
+        `cache_dir`, also written to one .npz file per key so they survive the process.
+
+        Parameters:
+        maxsize : int: Number of signal sets kept in memory.
+        cache_dir : str or None: Folder of the files. None keeps the cache in memory only.
+        """
+
+        self.maxsize = maxsize
+        self.cache_dir = cache_dir
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"signals_{key}.npz")
+
+    def get(self, data: pd.DataFrame, initial_eig, Q_filter: float = 0.01, R_filter: float = 0.0001,
+            norm_window: int = 252, monitor_window: int = None, monitor_lag: int = 1,
+            process_noise: bool = False) -> dict:
+        """
+        Get the signals of a configuration, computing and storing them on a miss.
+
+        Parameters:
+        data, initial_eig, Q_filter, R_filter, norm_window, monitor_window, monitor_lag, process_noise:
+        As in compute_signals.
+
+        Returns:
+        dict: The signals, read-only arrays shared with the cache.
+        """
+
+        key = signal_key(data, initial_eig, Q_filter, R_filter, norm_window, monitor_window, monitor_lag,
+                         process_noise)
+
+        signals = self.memory.get(key)
+        if signals is not None:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return signals
+
+        if self.cache_dir is not None and os.path.exists(self._path(key)):
+            with np.load(self._path(key)) as stored:
+                signals = {name: stored[name] for name in stored.files}
+            self.hits += 1
+        else:
+            signals = compute_signals(data, initial_eig, Q_filter, R_filter, norm_window, monitor_window, monitor_lag,
+                                      process_noise)
+            self.misses += 1
+            if self.cache_dir is not None:
+                # Write to a temporary file of this writer first so readers never see a half written
+                # file and concurrent writers of the same key do not clash
+                os.makedirs(self.cache_dir, exist_ok=True)
+                fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".npz")
+                try:
+                    with os.fdopen(fd, "wb") as f:
+                        np.savez(f, **signals)
+                    os.replace(tmp, self._path(key))
+                except BaseException:
+                    os.remove(tmp)
+                    raise
+
+        for values in signals.values():
+            values.flags.writeable = False
+
+        self.memory[key] = signals
+        while len(self.memory) > self.maxsize:
+            self.memory.popitem(last=False)
+
+        return signals
+
+    def clear(self):
+        """
+        Empty the in-memory cache. Files in cache_dir are kept.
+        """
+
+        self.memory.clear()
@@ -0,0 +1,281 @@
+from cointegration_monitor import CointegrationMonitor
+from models import Operation, Order, PositionBook
+from portfolio_value import get_book_value
+from rolling_johansen import RollingJohansen
+from rolling_stats import RollingStats
+from Kalman_structure import KalmanFilterReg
+import numpy as np
+
+
+class PairsStrategy():
+    def __init__(self, tickers: tuple, cash: float, initial_eig, theta: float, Q_filter: float = 0.01,
+                 R_filter: float = 0.0001, norm_window: int = 252, max_pvalue: float = None,
+                 monitor_window: int = 252, monitor_lag: int = 1, process_noise: bool = False):
+        """
+        Initialize the pairs trading strategy for a stream of bars.
+
+        The strategy holds only the state needed for the next bar: both Kalman
+        filters, the rolling Johansen and normalization windows, the cash and the
+        open positions. The first 252 bars fill the Johansen window, trading starts
+        on the next one.
+
+        Parameters:
+        tickers : tuple: The (y, x) ticker symbols of the pair.
+        cash : float: Initial cash for the portfolio.
+        initial_eig : array-like: Initial eigenvector for the VECM.
+        theta : float: Threshold for opening and closing positions based on normalized VECM.
+        Q_filter : float: Process noise covariance of both Kalman filters, only used with process_noise.
+        R_filter : float: Measurement noise covariance of both Kalman filters.
+        norm_window : int: Number of bars used to normalize the VECM.
+        max_pvalue : float or None: Block new entries while the rolling ADF p-value of the pair is above this,
+                     see CointegrationMonitor. None disables the monitor.
+        monitor_window : int: Number of bars of the monitor's test window.
+        monitor_lag : int: Number of lagged differences of the monitor's ADF regression.
+        process_noise : bool: Add Q_filter to the error covariance of both filters before each update.
+        """
+
+        self.COM = 0.125 / 100
+        self.BORROW_RATE = (0.25 / 100) / 252
+
+        self.y, self.x = tickers
+        self.cash = cash
+        self.theta = theta
+
+        self.hedge_ratio = KalmanFilterReg(Q_filter=Q_filter, R_filter=R_filter, process_noise=process_noise)
+        self.k_eigenvector = KalmanFilterReg(Q_filter=Q_filter, R_filter=R_filter, process_noise=process_noise)
+        self.k_eig = initial_eig
+        self.rolling_johansen = RollingJohansen(window=252)
+        self.vecm_stats = RollingStats(window=norm_window)
+        self.monitor = CointegrationMonitor(monitor_window, monitor_lag, max_pvalue) if max_pvalue is not None else None
+        self.blocked_entries = 0
+        # Run the monitor's ADF test on every bar instead of when an entry reads it
+        self.eager_monitor = False
+
+        self.book = PositionBook([self.y, self.x], keep_trades=False)
+        self.n_bars = 0
+
+        # Running cost totals
+        self.borrow_costs = 0.0
+        self.commission_costs = 0.0
+
+        # Signals of the last traded bar
+        self.hr = np.nan
+        self.p2_hat = np.nan
+        self.vecm = np.nan
+        self.vecm_hat = np.nan
+        self.vecm_norm = np.nan
+
+        self._prices = np.zeros(2)
+
+    @property
+    def trading(self) -> bool:
+        """
+        Check whether the warm-up is over.
+
+        Returns:
+        bool: True once the Johansen window is full and the strategy trades.
+        """
+
+        return self.n_bars >= 252
+
+    def on_bar(self, timestamp, p_y: float, p_x: float) -> tuple[list[Order], float]:
+        """
+        Process a new bar: update the signals, open and close positions and value the portfolio.
+
+        Parameters:
+        timestamp : The time of the bar, stored on the opened legs.
+        p_y : float: Price of ticker y.
+        p_x : float: Price of ticker x.
+
+        Returns:
+        tuple[list[Order], float]: The orders filled on this bar and the portfolio value after them.
+        """
+
+        p1 = float(p_y)
+        p2 = float(p_x)
+        self._prices[0] = p1
+        self._prices[1] = p2
+
+        orders = []
+
+        if self.monitor is not None:
+            self._monitor(p1, p2)
+
+        if self.n_bars >= 252:
+            self._hedge_ratio(p1, p2)
+            self._johansen_refit()
+            self._eigenvector(p1, p2)
+            self._normalize()
+            self._trade(orders, timestamp, p1, p2)
+
+        # The Johansen window only sees the bars before the one being traded
+        self._johansen_update(p1, p2)
+        self.n_bars += 1
+
+        return orders, self._portfolio_value()
+
+    def on_signals(self, timestamp, p_y: float, p_x: float, hr: float, vecm_norm: float,
+                   cointegrated: bool = True) -> tuple[list[Order], float]:
+        """
+        Process a new bar whose signals were computed beforehand: only the entries, exits
+        and accounting run, see signal_cache.compute_signals.
+
+        The signals do not depend on theta or on the cash, so they can be computed once and
+        replayed here for any theta, with the same orders and values as on_bar.
+
+        Parameters:
+        timestamp : The time of the bar, stored on the opened legs.
+        p_y : float: Price of ticker y.
+        p_x : float: Price of ticker x.
+        hr : float: Kalman hedge ratio of the bar.
+        vecm_norm : float: Normalized VECM of the bar.
+        cointegrated : bool: Whether the cointegration monitor allows new entries on this bar.
+
+        Returns:
+        tuple[list[Order], float]: The orders filled on this bar and the portfolio value after them.
+        """
+
+        p1 = float(p_y)
+        p2 = float(p_x)
+        self._prices[0] = p1
+        self._prices[1] = p2
+
+        orders = []
+
+        if self.n_bars >= 252:
+            self.hr = hr
+            self.vecm_norm = vecm_norm
+            self._trade(orders, timestamp, p1, p2, cointegrated)
+
+        self.n_bars += 1
+
+        return orders, self._portfolio_value()
+
+    def close_all(self) -> list[Order]:
+        """
+        Close every open position at the last prices, as done at the end of a backtest.
+
+        Returns:
+        list[Order]: The closing orders.
+        """
+
+        orders = []
+        self._close(orders, self._prices[0], self._prices[1], borrow=False)
+        return orders
+
+    # Stages of on_bar, kept as separate methods so a StageProfiler can time each one
+
+    def _hedge_ratio(self, p1: float, p2: float):
+        # Kalman Filter Hedge Ratio
+        self.hedge_ratio.update(p2, p1)
+        w0, w1 = self.hedge_ratio.params
+        self.hr = w1
+        self.p2_hat = (p1 - w0) / w1
+
+    def _johansen_refit(self):
+        # Eigenvector from the previous 252 bars
+        try:
+            self.k_eig, _, _ = self.rolling_johansen.result()
+        except:
+            pass
+
+    def _monitor(self, p1: float, p2: float):
+        self.monitor.update(p1, p2)
+        if self.eager_monitor:
+            self.monitor.stat
+
+    def _entry_allowed(self, cointegrated: bool = None) -> bool:
+        # Only asked when a position would open, so the ADF test itself runs on entry bars only
+        if cointegrated is None:
+            cointegrated = self.monitor is None or self.monitor.cointegrated
+        if not cointegrated:
+            self.blocked_entries += 1
+        return cointegrated
+
+    def _johansen_update(self, p1: float, p2: float):
+        self.rolling_johansen.update((p1, p2))
+
+    def _eigenvector(self, p1: float, p2: float):
+        # Kalman Filter Eigenvector
+        self.vecm = self.k_eig[0] * p1 + self.k_eig[1] * p2
+        self.k_eigenvector.update(p1, p2, self.vecm)
+        e0, e1 = self.k_eigenvector.params
+        self.vecm_hat = e0 * p1 + e1 * p2
+
+    def _normalize(self):
+        # Normalize VECM
+        self.vecm_stats.update(self.vecm_hat)
+        self.vecm_norm = self.vecm_stats.zscore(self.vecm_hat)
+
+    def _trade(self, orders: list, timestamp, p1: float, p2: float, cointegrated: bool = None):
+        vecm_norm = self.vecm_norm
+
+        #Open positions
+        if vecm_norm > self.theta and self.book.is_flat and self._entry_allowed(cointegrated):
+            self._open(orders, timestamp, p1, p2, 'LONG')
+
+        if vecm_norm < -self.theta and self.book.is_flat and self._entry_allowed(cointegrated):
+            self._open(orders, timestamp, p1, p2, 'SHORT')
+
+        # Close positions
+        if abs(vecm_norm) < 0.05:
+            self._close(orders, p1, p2, borrow=True)
+
+    def _portfolio_value(self) -> float:
+        return get_book_value(self.cash, self.book, self._prices)
+
+    def _open(self, orders: list, timestamp, p1: float, p2: float, y_side: str):
+        COM = self.COM
+        x_side = 'SHORT' if y_side == 'LONG' else 'LONG'
+
+        # Ticker y, sized with 40% of the cash
+        available_cash = self.cash * 0.4
+        n_shares_y = available_cash // (p1 * (1 + COM))
+
+        if available_cash > p1 * n_shares_y * (1 + COM) and n_shares_y > 0:
+            cost_y = p1 * n_shares_y * (1 + COM) if y_side == 'LONG' else p1 * n_shares_y * COM
+            self.cash -= cost_y
+            leg_y = Operation(ticker=self.y, time=timestamp, entry_price=p1, exit_price=0.0,
+                              n_shares=n_shares_y, type=y_side)
+            self.book.open(leg_y)
+            orders.append(Order('OPEN', leg_y, p1))
+
+        # Ticker x, hedged with the Kalman hedge ratio
+        n_shares_x = int(n_shares_y * self.hr)
+        cost_x = p2 * n_shares_x * COM if x_side == 'SHORT' else p2 * n_shares_x * (1 + COM)
+        if self.cash > cost_x and n_shares_x > 0:
+            self.cash -= cost_x
+            leg_x = Operation(ticker=self.x, time=timestamp, entry_price=p2, exit_price=0.0,
+                              n_shares=n_shares_x, type=x_side)
+            self.book.open(leg_x)
+            orders.append(Order('OPEN', leg_x, p2))
+
+    def _close(self, orders: list, p1: float, p2: float, borrow: bool):
+        COM = self.COM
+        prices = {self.y: p1, self.x: p2}
+
+        # Close long positions
+        for position in self.book.longs.copy():
+            price = prices[position.ticker]
+            self.cash += price * position.n_shares * (1 - COM)
+            self.commission_costs += price * position.n_shares * COM
+            pnl = (price * position.n_shares * (1 - COM)) - (position.entry_price * position.n_shares * (1+COM))
+            self.book.close(position, price)
+            orders.append(Order('CLOSE', position, price, pnl))
+
+        # Borrow cost
+        if borrow:
+            for position in self.book.shorts:
+                price = prices[position.ticker]
+                self.cash -= price * position.n_shares * self.BORROW_RATE
+                self.borrow_costs += price * position.n_shares * self.BORROW_RATE
+
+        # Close short positions
+        for position in self.book.shorts.copy():
+            price = prices[position.ticker]
+            pnl = (position.entry_price - price) * position.n_shares
+            com = price * position.n_shares * COM
+            self.cash += pnl - com
+            self.commission_costs += com
+            self.book.close(position, price)
+            orders.append(Order('CLOSE', position, price, pnl))
@@ -0,0 +1,235 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, product
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from Backtesting import backtest
+from cointegration_functions import johansen
+from data_utils import get_asset_data, split_data, add_overlay
+from metrics import metrics_batch, METRIC_COLUMNS
+from signal_cache import SignalCache
+
+
+# Worker state, set once per process by _init_worker
+_shm = None
+_panel = None
+_cash = None
+_initial_eig = None
+_cache = None
+_dtype = None
+_process_noise = False
+
+
+def _init_worker(shm_name: str, shape: tuple, index: pd.Index, columns: pd.Index, cash: float, initial_eig,
+                 cache_dir: str = None, dtype=None, process_noise: bool = False):
+    """
+    Attach a worker process to the shared price panel.
+
+    Parameters:
+    shm_name : str: Name of the shared memory block holding the prices.
+    shape : tuple: Shape of the price panel.
+    index : pd.Index: Dates of the price panel.
+    columns : pd.Index: Tickers of the price panel.
+    cash : float: Initial cash for each backtest.
+    initial_eig : Initial eigenvector for the VECM.
+    cache_dir : str or None: Folder of the signal cache shared by the workers, see SignalCache.
+    dtype : str: Dtype of the equity curves sent back, see run_sweep.
+    process_noise : bool: Whether the Kalman filters use Q_filter, see run_sweep.
+    """
+
+    global _shm, _panel, _cash, _initial_eig, _cache, _dtype, _process_noise
+
+    _shm = shared_memory.SharedMemory(name=shm_name)
+    values = np.ndarray(shape, dtype=np.float64, buffer=_shm.buf)
+    _panel = pd.DataFrame(values, index=index, columns=columns, copy=False)
+    _cash = cash
+    _initial_eig = initial_eig
+    _cache = SignalCache(cache_dir=cache_dir)
+    _dtype = dtype
+    _process_noise = process_noise
+
+
+def _group_signals(params: tuple) -> dict:
+    """
+    Compute the signals of one (Q_filter, R_filter, norm_window) group from the worker's SignalCache.
+
+    Parameters:
+    params : tuple: The (Q_filter, R_filter, norm_window) signal parameters.
+
+    Returns:
+    dict: The signals, see signal_cache.compute_signals.
+    """
+
+    Q_filter, R_filter, norm_window = params
+    return _cache.get(_panel, _initial_eig, Q_filter, R_filter, norm_window, process_noise=_process_noise)
+
+
+def _run_group(task: tuple) -> list[tuple[dict, np.ndarray]]:
+    """
+    Run the backtests of several thetas sharing the same signal parameters.
+
+    The signals were computed once for the whole group by _group_signals, so each
+    theta only replays the trading.
+
+    Parameters:
+    task : tuple: The (Q_filter, R_filter, norm_window) signal parameters, their signals and the list of thetas.
+
+    Returns:
+    list[tuple[dict, np.ndarray]]: The result of _run_config for each theta, in order.
+    """
+
+    (Q_filter, R_filter, norm_window), signals, thetas = task
+
+    return [_run_config((theta, Q_filter, R_filter, norm_window), signals) for theta in thetas]
+
+
+def _run_config(config: tuple, signals: dict = None) -> tuple[dict, np.ndarray]:
+    """
+    Run one backtest configuration on the shared price panel.
+
+    Parameters:
+    config : tuple: The (theta, Q_filter, R_filter, norm_window) configuration.
+    signals : dict: Precomputed signals of the configuration, see signal_cache.compute_signals.
+
+    Returns:
+    tuple[dict, np.ndarray]: The configuration with its trade statistics, and its portfolio values.
+    """
+
+    theta, Q_filter, R_filter, norm_window = config
+    result = backtest(_panel, _cash, _initial_eig, theta, Q_filter=Q_filter, R_filter=R_filter,
+                      norm_window=norm_window, record='equity', signals=signals, dtype=_dtype,
+                      process_noise=_process_noise)
+
+    row = {
+        'theta': theta,
+        'Q_filter': Q_filter,
+        'R_filter': R_filter,
+        'norm_window': norm_window,
+        'final_value': result.portfolio_value.iloc[-1],
+        'final_cash': result.final_cash,
+        'borrow_costs': result.borrow_costs,
+        'commission_costs': result.commission_costs,
+    }
+    row.update({key: float(value) for key, value in result.stats.items()})
+
+    return row, result.portfolio_value.to_numpy()
+
+
+def run_sweep(data: pd.DataFrame, cash: float, initial_eig, thetas, Q_filters=(0.01,), R_filters=(0.0001,),
+              norm_windows=(252,), n_workers: int = None, cache_dir: str = None, dtype=None,
+              process_noise: bool = False) -> pd.DataFrame:
+    """
+    Run backtest over the grid of theta, Kalman Q/R and normalization window values in a process pool.
+
+    The price panel is copied once into shared memory and every worker reads it from there,
+    so only the configuration tuples are sent with each task. Theta only drives the entries
+    and exits, so the configurations are grouped by their signal parameters: the pool first
+    computes the Kalman, Johansen and VECM signals of each group once, one group per task,
+    and then replays them for every theta, the thetas of a group split over the workers,
+    see signal_cache.py.
+
+    Parameters:
+    data : pd.DataFrame: DataFrame containing price data for two assets.
+    cash : float: Initial cash for each backtest.
+    initial_eig : Initial eigenvector for the VECM.
+    thetas : list: Values of theta to test.
+    Q_filters : list: Values of the Kalman process noise to test. They only change the filters with
+                process_noise, so more than one value needs it.
+    R_filters : list: Values of the Kalman measurement noise to test.
+    norm_windows : list: Values of the VECM normalization window to test.
+    n_workers : int: Number of worker processes. Defaults to the number of cores.
+    cache_dir : str or None: Folder where the signals are also cached on disk, so later sweeps
+                on the same data and filter settings skip them entirely.
+    dtype : str: 'float32' returns and stacks the equity curves of the configurations in float32,
+            half the memory of the default 'float64'. The backtests themselves run in float64.
+    process_noise : bool: Add Q_filter to the error covariance of the Kalman filters before each update.
+
+    Returns:
+    pd.DataFrame: One row per configuration with its metrics and trade statistics.
+    """
+
+    if not process_noise and len(set(Q_filters)) > 1:
+        raise ValueError("Q_filters only change the Kalman filters with process_noise=True")
+
+    data = data.dropna()
+    values = data.to_numpy(dtype=np.float64)
+    configs = list(product(thetas, Q_filters, R_filters, norm_windows))
+    n_workers = n_workers or os.cpu_count()
+
+    # Thetas grouped by signal parameters, each group split so that every worker gets a share
+    groups = {}
+    for k, (_, Q_filter, R_filter, norm_window) in enumerate(configs):
+        groups.setdefault((Q_filter, R_filter, norm_window), []).append(k)
+    chunks = []
+    order = []
+    for params, positions in groups.items():
+        for chunk in np.array_split(positions, min(n_workers, len(positions))):
+            chunks.append((params, [configs[k][0] for k in chunk]))
+            order.extend(chunk.tolist())
+
+    shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+    try:
+        np.ndarray(values.shape, dtype=np.float64, buffer=shm.buf)[:] = values
+
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                 initargs=(shm.name, values.shape, data.index, data.columns, cash, initial_eig,
+                                           cache_dir, dtype, process_noise)) as pool:
+            signals = dict(zip(groups, pool.map(_group_signals, list(groups))))
+            tasks = [(params, signals[params], thetas) for params, thetas in chunks]
+            grouped = chain.from_iterable(pool.map(_run_group, tasks))
+            # Back to the order of the configuration grid
+            results = [None] * len(configs)
+            for k, result in zip(order, grouped):
+                results[k] = result
+    finally:
+        shm.close()
+        shm.unlink()
+
+    rows = [row for row, _ in results]
+    df = pd.DataFrame(rows)
+    if rows:
+        # Metrics of every configuration in one vectorized pass over the stacked equity curves
+        metrics = metrics_batch(np.column_stack([curve for _, curve in results]))
+        position = df.columns.get_loc('commission_costs') + 1
+        for k, column in enumerate(METRIC_COLUMNS):
+            df.insert(position + k, column, metrics[column].to_numpy())
+
+    return df
+
+
+def main(argv: list = None, prog: str = None):
+    parser = argparse.ArgumentParser(prog=prog, description="Parameter sweep of the pairs trading backtest.")
+    parser.add_argument('--tickers', nargs=2, default=["MS", "SCHW"])
+    parser.add_argument('--cash', type=float, default=1000000)
+    parser.add_argument('--theta', nargs='+', type=float, default=[0.33])
+    parser.add_argument('--Q', nargs='+', type=float, default=[0.01],
+                        help="Kalman process noise values, only used with --process-noise.")
+    parser.add_argument('--process-noise', action='store_true',
+                        help="Add Q to the Kalman error covariance before each update.")
+    parser.add_argument('--R', nargs='+', type=float, default=[0.0001])
+    parser.add_argument('--window', nargs='+', type=int, default=[252])
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', default=None, help="CSV file to write the results to.")
+    parser.add_argument('--cache-dir', default=None, help="Folder to cache the theta independent signals in.")
+    parser.add_argument('--float32', action='store_true', help="Keep the equity curves in float32, half the memory.")
+    args = parser.parse_args(argv)
+
+    data = get_asset_data(args.tickers)
+    train_data, test_data = split_data(data)
+    test_data_lp = add_overlay(train_data, test_data, overlay_size=252)
+    eigenvector, _, _ = johansen(train_data)
+
+    results = run_sweep(test_data_lp, args.cash, eigenvector, args.theta, args.Q, args.R, args.window, args.workers,
+                        args.cache_dir, 'float32' if args.float32 else None, args.process_noise)
+
+    print(results.sort_values(by='Sharpe Ratio', ascending=False).to_string(index=False))
+    if args.output:
+        results.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
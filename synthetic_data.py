@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+from scipy.signal import lfilter
+
+
+def _random_walk(rng: np.random.Generator, n_bars: int, start: float = 50.0, vol: float = 1.0) -> np.ndarray:
+    walk = start + np.cumsum(rng.normal(0, vol, n_bars))
+    # Shift the whole path up if needed so prices stay positive
+    return walk - min(walk.min() - 10.0, 0.0)
+
+
+def _ar1(rng: np.random.Generator, n_bars: int, phi: float, vol: float = 1.0) -> np.ndarray:
+    noise = rng.normal(0, vol, n_bars)
+    noise[0] = 0.0
+    # spread_t = phi * spread_t-1 + noise_t
+    return lfilter([1.0], [1.0, -phi], noise)
+
+
+def _break_points(rng: np.random.Generator, n_bars: int, breaks: int) -> np.ndarray:
+    # Breaks fall after the first 252 bars so the first Johansen window is clean
+    if breaks <= 0 or n_bars <= 504:
+        return np.array([], dtype=int)
+    return np.sort(rng.choice(np.arange(252, n_bars - 252), size=breaks, replace=False))
+
+
+def cointegrated_pair(n_bars: int = 3000, seed: int = 0, beta: float = 1.3, phi: float = 0.95, breaks: int = 0,
+                      tickers: tuple = ("Y", "X"), start: str = "2010-01-01") -> pd.DataFrame:
+    """
+    Generate a seeded pair of cointegrated prices, y = beta * x + c + spread.
+
+    x is a random walk and the spread a stationary AR(1). At each regime break the
+    hedge ratio and the level of the spread jump to new values.
+
+    Parameters:
+    n_bars : int: Number of daily bars.
+    seed : int: Seed of the random generator.
+    beta : float: Hedge ratio of the first regime.
+    phi : float: AR(1) coefficient of the spread, below 1 for a stationary spread.
+    breaks : int: Number of regime breaks.
+    tickers : tuple: Column names of the (y, x) prices.
+    start : str: Date of the first bar.
+
+    Returns:
+    pd.DataFrame: The y and x prices indexed by business day.
+    """
+
+    rng = np.random.default_rng(seed)
+
+    x = _random_walk(rng, n_bars)
+    spread = _ar1(rng, n_bars, phi)
+
+    betas = np.full(n_bars, beta)
+    levels = np.full(n_bars, 5.0)
+    for point in _break_points(rng, n_bars, breaks):
+        betas[point:] = beta * rng.uniform(0.6, 1.4)
+        levels[point:] = rng.uniform(-10.0, 20.0)
+
+    y = betas * x + levels + spread
+    y = y - min(y.min() - 10.0, 0.0)
+
+    index = pd.bdate_range(start, periods=n_bars)
+    return pd.DataFrame({tickers[0]: y, tickers[1]: x}, index=index)
+
+
+def cointegrated_universe(n_names: int = 20, n_bars: int = 3000, n_sectors: int = 4, seed: int = 0, phi: float = 0.95,
+                          breaks: int = 0, start: str = "2010-01-01") -> tuple[pd.DataFrame, dict]:
+    """
+    Generate a seeded universe of prices where the names of each sector are cointegrated.
+
+    Every sector has its own random walk and each name loads on it with its own
+    weight plus a stationary AR(1) deviation, so every pair inside a sector is
+    cointegrated and pairs across sectors are not. At each regime break the
+    loadings of a sector change.
+
+    Parameters:
+    n_names : int: Total number of names.
+    n_bars : int: Number of daily bars.
+    n_sectors : int: Number of sectors, names are spread evenly over them.
+    seed : int: Seed of the random generator.
+    phi : float: AR(1) coefficient of the deviations.
+    breaks : int: Number of regime breaks per sector.
+    start : str: Date of the first bar.
+
+    Returns:
+    tuple[pd.DataFrame, dict]: The prices of every name and the names of each sector,
+                               in the format of cointegration_test.TICKERS.
+    """
+
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range(start, periods=n_bars)
+
+    prices = {}
+    sectors = {}
+    for k in range(n_names):
+        sectors.setdefault(f"Sector_{k % n_sectors}", []).append(f"S{k % n_sectors}N{k // n_sectors}")
+
+    for sector, names in sectors.items():
+        trend = _random_walk(rng, n_bars)
+        points = _break_points(rng, n_bars, breaks)
+        for name in names:
+            loadings = np.full(n_bars, rng.uniform(0.5, 2.0))
+            for point in points:
+                loadings[point:] = rng.uniform(0.5, 2.0)
+            series = loadings * trend + rng.uniform(0.0, 20.0) + _ar1(rng, n_bars, phi)
+            prices[name] = series - min(series.min() - 10.0, 0.0)
+
+    return pd.DataFrame(prices, index=index), sectors
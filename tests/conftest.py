@@ -0,0 +1,30 @@
+import os
+import sys
+import warnings
+
+import numpy as np
+import pytest
+
+# The modules live at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic_data import cointegrated_pair
+
+
+@pytest.fixture(autouse=True)
+def _quiet_warnings():
+    # pandas and statsmodels FutureWarnings are not what the tests check
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', FutureWarning)
+        yield
+
+
+@pytest.fixture(scope='session')
+def pair():
+    # Long enough for the 252-bar warm-up plus a regime break the strategy trades through
+    return cointegrated_pair(1200, seed=1, breaks=1)
+
+
+@pytest.fixture(scope='session')
+def initial_eig():
+    return np.array([1.0, -1.3])
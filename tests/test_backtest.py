@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from Backtesting import backtest
+from chunked_backtest import backtest_chunked
+from portfolio_backtest import backtest_portfolio
+from price_store import PriceStore
+
+TRACES = ('p2_values', 'p2_hat_values', 'vecm_values', 'vecm_hat_values', 'vecm_norm_values', 'hr_values')
+
+
+def test_chunked_matches_backtest(pair, initial_eig, tmp_path):
+    store = PriceStore(str(tmp_path / 'store'))
+    for ticker in pair.columns:
+        store.write(ticker, pair[ticker])
+
+    ref = backtest(pair, 1_000_000, initial_eig, 0.5, record='full')
+    assert len(ref.trades) > 0
+
+    # Chunk boundaries inside the warm-up, inside the trading and past the end
+    for chunk_size in (97, 700, 5000):
+        for out_dir in (None, str(tmp_path / f'out{chunk_size}')):
+            res = backtest_chunked(store, list(pair.columns), 1_000_000, initial_eig, 0.5,
+                                   chunk_size=chunk_size, record='full', out_dir=out_dir)
+            np.testing.assert_array_equal(res.portfolio_value.to_numpy(), ref.portfolio_value.to_numpy())
+            assert res.final_cash == ref.final_cash
+            assert res.borrow_costs == ref.borrow_costs
+            assert res.commission_costs == ref.commission_costs
+            assert len(res.trades) == len(ref.trades)
+            for name in TRACES:
+                np.testing.assert_array_equal(getattr(res, name), getattr(ref, name))
+
+
+def test_portfolio_of_one_pair_matches_backtest(pair, initial_eig):
+    for process_noise in (False, True):
+        ref = backtest(pair, 1_000_000, initial_eig, 0.5, Q_filter=1e-3, record='equity',
+                       process_noise=process_noise)
+        res = backtest_portfolio(pair, [tuple(pair.columns)], 1_000_000, [initial_eig], 0.5, Q_filter=1e-3,
+                                 position_size=0.4, process_noise=process_noise)
+        assert res.final_cash == ref.final_cash
+        np.testing.assert_allclose(res.portfolio_value.to_numpy(), ref.portfolio_value.to_numpy(), rtol=1e-9)
+        np.testing.assert_allclose(res.pnl_values, ref.pnl_values, rtol=1e-9)
+
+
+def test_portfolio_warns_when_dates_are_dropped(pair, initial_eig):
+    late = pair.copy()
+    late.iloc[:50, 0] = np.nan
+    with pytest.warns(UserWarning):
+        res = backtest_portfolio(late, [tuple(pair.columns)], 1_000_000, [initial_eig], 0.5)
+    assert len(res.portfolio_value) == len(pair) - 50
+    assert isinstance(res.portfolio_value, pd.Series)
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from data_sources import ChartAPISource, FetchError, StubChartServer
+from price_store import PriceStore
+from synthetic_data import cointegrated_universe
+
+
+@pytest.fixture(scope='module')
+def universe(tmp_path_factory):
+    prices, _ = cointegrated_universe(12, n_bars=800, n_sectors=2, seed=1)
+    store_dir = str(tmp_path_factory.mktemp('chart_store'))
+    store = PriceStore(store_dir)
+    for ticker in prices.columns:
+        store.write(ticker, prices[ticker])
+    return prices, store_dir
+
+
+def _assert_same_prices(got: pd.DataFrame, expected: pd.DataFrame):
+    pd.testing.assert_frame_equal(got, expected, check_freq=False, check_names=False, check_index_type=False)
+
+
+def test_fetch_matches_the_store(universe):
+    prices, store_dir = universe
+    with StubChartServer(store_dir) as server:
+        got = ChartAPISource(server.url, max_connections=4).fetch(list(prices.columns))
+    _assert_same_prices(got, prices)
+
+
+def test_fetch_retries_failed_requests_and_skips_unknown_tickers(universe):
+    prices, store_dir = universe
+    with StubChartServer(store_dir, failure_rate=0.3, seed=2) as server:
+        source = ChartAPISource(server.url, max_connections=4, retries=8, backoff=0.01)
+        got = source.fetch(list(prices.columns) + ['UNKNOWN'])
+        assert server.requests > len(prices.columns) + 1
+    _assert_same_prices(got, prices)
+
+
+def test_fetch_raises_with_the_failed_tickers(universe):
+    prices, store_dir = universe
+    tickers = list(prices.columns[:3])
+    with StubChartServer(store_dir, failure_rate=1.0) as server:
+        with pytest.raises(FetchError) as info:
+            ChartAPISource(server.url, retries=1, backoff=0.01).fetch(tickers)
+    assert sorted(info.value.tickers) == sorted(tickers)
+
+
+def test_fetch_from_start_and_store_update(universe, tmp_path):
+    prices, store_dir = universe
+    tickers = list(prices.columns[:4])
+    store = PriceStore(str(tmp_path))
+    for ticker in tickers[:2]:
+        stored = prices[ticker].iloc[:500].copy()
+        stored.iloc[-1] += 1.0
+        store.write(ticker, stored)
+
+    with StubChartServer(store_dir) as server:
+        source = ChartAPISource(server.url)
+        start = prices.index[700]
+        part = source.fetch(tickers[:1], start=start)
+        assert part.index[0] == start and len(part) == len(prices) - 700
+        store.update(tickers, source=source)
+
+    for ticker in tickers:
+        np.testing.assert_array_equal(store.read(ticker).to_numpy(), prices[ticker].to_numpy())
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+
+from data_sources import DataSource
+from price_store import PriceStore
+
+
+class _FrameSource(DataSource):
+    # Serves slices of a fixed frame and records what was asked
+    def __init__(self, frame: pd.DataFrame):
+        self.frame = frame
+        self.calls = []
+
+    def fetch(self, tickers: list, period: str = "15y", start=None) -> pd.DataFrame:
+        self.calls.append((tuple(tickers), start))
+        frame = self.frame.loc[:, tickers]
+        return frame if start is None else frame[frame.index >= start]
+
+
+def test_write_and_read_round_trip(pair, tmp_path):
+    store = PriceStore(str(tmp_path))
+    store.write('Y', pair['Y'])
+
+    assert store.has('Y') and not store.has('X')
+    assert store.last_date('Y') == pair.index[-1]
+    np.testing.assert_array_equal(store.read('Y').to_numpy(), pair['Y'].to_numpy())
+    assert (store.read('Y').index == pair.index).all()
+    # Only the two columns are left behind, no temporary files
+    assert sorted(path.name for path in (tmp_path / 'Y').iterdir()) == ['close.npy', 'dates.npy']
+
+
+def test_append_replaces_the_last_bar_and_ignores_older_ones(pair, tmp_path):
+    store = PriceStore(str(tmp_path))
+    prices = pair['Y']
+    stored = prices.iloc[:500].copy()
+    stored.iloc[-1] += 5.0  # a close stored during the session
+    store.write('Y', stored)
+
+    # The update overlaps the stored history and restates its last bar
+    store.append('Y', prices.iloc[300:800])
+    np.testing.assert_array_equal(store.read('Y').to_numpy(), prices.iloc[:800].to_numpy())
+
+    # Nothing newer than the last stored bar, nothing changes
+    store.append('Y', prices.iloc[:700])
+    np.testing.assert_array_equal(store.read('Y').to_numpy(), prices.iloc[:800].to_numpy())
+
+
+def test_update_fetches_missing_tickers_and_refreshes_stored_ones(pair, tmp_path):
+    store = PriceStore(str(tmp_path))
+    partial = pair['Y'].iloc[:600].copy()
+    partial.iloc[-1] -= 3.0
+    store.write('Y', partial)
+
+    source = _FrameSource(pair)
+    store.update(['Y', 'X'], source=source)
+
+    for ticker in pair.columns:
+        np.testing.assert_array_equal(store.read(ticker).to_numpy(), pair[ticker].to_numpy())
+    # X had no history, Y is fetched from its last stored date on, that date included
+    assert (('X',), None) in source.calls
+    assert (('Y',), pair.index[599]) in source.calls
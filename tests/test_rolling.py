@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from cointegration_functions import johansen
+from cointegration_monitor import CointegrationMonitor
+from rolling_johansen import RollingJohansen
+from rolling_stats import RollingStats, rolling_zscore_batch
+
+
+@pytest.mark.parametrize('k_ar_diff', [1, 2])
+def test_rolling_johansen_matches_refit(pair, k_ar_diff):
+    window = 252
+    rolling = RollingJohansen(window=window, k_ar_diff=k_ar_diff, resync=97)
+    values = pair.to_numpy()
+
+    checked = 0
+    for t, prices in enumerate(values):
+        rolling.update(prices)
+        if rolling.ready and t % 53 == 0:
+            eigenvector, critical_value95, trace_stat = rolling.result()
+            ref_vector, ref_critical, ref_trace = johansen(pair.iloc[t - window + 1:t + 1], k_ar_diff=k_ar_diff)
+            # The eigenvector is only defined up to its sign
+            sign = np.sign(eigenvector @ ref_vector)
+            np.testing.assert_allclose(sign * eigenvector, ref_vector, rtol=1e-6, atol=1e-9)
+            assert critical_value95 == ref_critical
+            assert trace_stat == pytest.approx(ref_trace, rel=1e-8)
+            checked += 1
+    assert checked > 10
+
+
+def test_rolling_stats_matches_refit():
+    rng = np.random.default_rng(0)
+    values = 1e4 + rng.normal(size=2000).cumsum()
+    values[[10, 300, 301, 1500]] = np.nan
+    window = 100
+
+    stats = RollingStats(window=window, resync=37)
+    for t, value in enumerate(values):
+        stats.update(value)
+        if t >= window - 1:
+            ref = values[t - window + 1:t + 1]
+            assert stats.mean == pytest.approx(np.nanmean(ref), rel=1e-12)
+            assert stats.std == pytest.approx(np.nanstd(ref), rel=1e-7)
+            assert stats.zscore(value) == pytest.approx((value - np.nanmean(ref)) / np.nanstd(ref), rel=1e-7, abs=1e-9,
+                                                         nan_ok=True)
+
+
+def test_rolling_zscore_batch_matches_rolling_stats():
+    rng = np.random.default_rng(1)
+    values = 5e4 + rng.normal(size=(1500, 3)).cumsum(axis=0)
+    values[:400, 2] = 5e4  # flat until the window moves past it
+    window = 120
+
+    batch = rolling_zscore_batch(values, window=window)
+    for j in range(values.shape[1]):
+        stats = RollingStats(window=window)
+        expected = []
+        for value in values[:, j]:
+            stats.update(value)
+            expected.append(stats.zscore(value))
+        np.testing.assert_allclose(batch[:, j], expected, rtol=1e-7, atol=1e-7, equal_nan=True)
+
+
+def test_cointegration_monitor_matches_adfuller(pair):
+    statsmodels = pytest.importorskip('statsmodels.api')
+    from statsmodels.tsa.stattools import adfuller
+
+    values = pair.to_numpy()
+    window, lag = 200, 1
+    every_bar = CointegrationMonitor(window, lag, resync=97)
+    sparse = CointegrationMonitor(window, lag, resync=97)
+
+    for t, (y, x) in enumerate(values):
+        every_bar.update(y, x)
+        sparse.update(y, x)
+        if every_bar.ready:
+            every_bar.stat
+        if t >= window - 1 and t % 61 == 0:
+            win = values[t - window + 1:t + 1]
+            resid = statsmodels.OLS(win[:, 0], statsmodels.add_constant(win[:, 1])).fit().resid
+            ref = adfuller(resid, maxlag=lag, autolag=None, regression='c')
+            # Reading on every bar or after many pending bars gives the same test
+            assert every_bar.stat == pytest.approx(ref[0], rel=1e-9)
+            assert sparse.stat == pytest.approx(ref[0], rel=1e-9)
+            assert sparse.pvalue == pytest.approx(ref[1], abs=1e-9)
@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+from Backtesting import backtest
+from sweep import run_sweep
+
+
+def test_sweep_with_cache_and_workers_matches_backtest(pair, initial_eig, tmp_path):
+    thetas = [0.3, 0.5, 1.0]
+    norm_windows = (100, 252)
+    cache_dir = str(tmp_path / 'signals')
+
+    first = run_sweep(pair, 1_000_000, initial_eig, thetas, norm_windows=norm_windows, n_workers=2,
+                      cache_dir=cache_dir)
+    # One cached file per signal group, and a second sweep reads them back
+    assert len([name for name in os.listdir(cache_dir) if name.endswith('.npz')]) == len(norm_windows)
+    second = run_sweep(pair, 1_000_000, initial_eig, thetas, norm_windows=norm_windows, n_workers=2,
+                       cache_dir=cache_dir)
+    assert first.equals(second)
+
+    assert len(first) == len(thetas) * len(norm_windows)
+    for row in first.itertuples():
+        ref = backtest(pair, 1_000_000, initial_eig, row.theta, norm_window=row.norm_window, record='equity')
+        assert row.final_cash == ref.final_cash
+        assert row.final_value == ref.portfolio_value.iloc[-1]
+        assert row.commission_costs == ref.commission_costs
+        assert row.borrow_costs == ref.borrow_costs
+
+
+def test_sweep_rejects_q_grid_without_process_noise(pair, initial_eig):
+    with pytest.raises(ValueError):
+        run_sweep(pair, 1_000_000, initial_eig, [0.5], Q_filters=(0.01, 0.1), n_workers=1)
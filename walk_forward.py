@@ -0,0 +1,242 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from Backtesting import backtest
+from cointegration_functions import johansen_from_moments, johansen_critical_value
+from data_utils import get_asset_data, walk_forward_windows
+from strategy import PairsStrategy
+from metrics import metrics_batch, all_metrics
+
+
+class JohansenWindowCache():
+    def __init__(self, prices):
+        """
+        Initialize a cache of Johansen fits over windows of one price series.
+
+        The running sums and cross products of the VECM rows [dx_t, dx_t-1, x_t-1]
+        are built once for the whole series, so the fit of any window only needs
+        two differences, and overlapping windows share all of that work. Fits are
+        memoized by window.
+
+        Parameters:
+        prices : array-like: The (T, 2) prices of the pair.
+        """
+
+        prices = np.asarray(prices, dtype=float)
+        prices = prices - prices[0]
+
+        dx = np.diff(prices, axis=0)
+        rows = np.concatenate([dx[1:], dx[:-1], prices[1:-1]], axis=1)
+
+        self.row_sum = np.concatenate([np.zeros((1, 6)), np.cumsum(rows, axis=0)])
+        self.row_prod = np.concatenate([np.zeros((1, 6, 6)), np.cumsum(rows[:, :, None] * rows[:, None, :], axis=0)])
+        self.critical_value95 = johansen_critical_value()
+        self.fits = {}
+
+    def fit_many(self, windows: list) -> list[tuple]:
+        """
+        Fit the Johansen test (constant term, one lagged difference) on many windows at once.
+
+        Parameters:
+        windows : list: The (start, end) positions of each window, end excluded.
+
+        Returns:
+        list[tuple]: For each window, the first eigenvector, the 95% critical value and the
+                     trace statistic, like cointegration_functions.johansen.
+        """
+
+        missing = [w for w in dict.fromkeys(windows) if w not in self.fits]
+        if missing:
+            starts = np.array([start for start, _ in missing])
+            ends = np.array([end for _, end in missing]) - 2
+            m = ends - starts
+
+            row_sum = self.row_sum[ends] - self.row_sum[starts]
+            cov = self.row_prod[ends] - self.row_prod[starts] - row_sum[:, :, None] * row_sum[:, None, :] / m[:, None, None]
+            eigenvectors, trace_stat = johansen_from_moments(cov, m)
+
+            for k, window in enumerate(missing):
+                self.fits[window] = (eigenvectors[k], self.critical_value95, trace_stat[k])
+
+        return [self.fits[w] for w in windows]
+
+    def fit(self, start: int, end: int) -> tuple:
+        """
+        Fit the Johansen test on one window.
+
+        Parameters:
+        start : int: First position of the window.
+        end : int: Position after the last one of the window.
+
+        Returns:
+        tuple: The first eigenvector, the 95% critical value and the trace statistic.
+        """
+
+        return self.fit_many([(start, end)])[0]
+
+
+def _out_of_sample(train: pd.DataFrame, test: pd.DataFrame, cash: float, eigenvector, theta: float,
+                   Q_filter: float, R_filter: float, norm_window: int,
+                   process_noise: bool = False) -> tuple[np.ndarray, float, int]:
+    """
+    Backtest the test part of a window, warmed up on the end of the training part.
+
+    The last 252 + norm_window training bars fill the Johansen window, the Kalman filters
+    and the VECM normalization without trading, so signals are live from the first test bar.
+
+    Returns:
+    tuple[np.ndarray, float, int]: The portfolio value of each test bar, the final cash after
+                                   closing the remaining positions and the number of legs opened.
+    """
+
+    strategy = PairsStrategy(tuple(train.columns[:2]), cash, eigenvector, np.inf, Q_filter=Q_filter,
+                             R_filter=R_filter, norm_window=norm_window, process_noise=process_noise)
+
+    warm_up = train.iloc[-(252 + norm_window):].to_numpy(dtype=float)
+    for p_y, p_x in warm_up:
+        strategy.on_bar(None, p_y, p_x)
+
+    strategy.theta = theta
+    n_trades = 0
+    portfolio_value = np.empty(len(test))
+    for t, (timestamp, (p_y, p_x)) in enumerate(zip(test.index, test.to_numpy(dtype=float))):
+        orders, portfolio_value[t] = strategy.on_bar(timestamp, p_y, p_x)
+        n_trades += sum(order.action == 'OPEN' for order in orders)
+    strategy.close_all()
+
+    return portfolio_value, strategy.cash, n_trades
+
+
+def _run_window(task: tuple) -> dict:
+    """
+    Fit theta on the training part of one window and backtest the test part with it.
+
+    Parameters:
+    task : tuple: The window number, training and testing data, eigenvector and backtest settings.
+
+    Returns:
+    dict: The window summary, its out-of-sample portfolio values and final cash.
+    """
+
+    k, train, test, eigenvector, thetas, cash, Q_filter, R_filter, norm_window, process_noise = task
+
+    # In-sample fit, the first 252 bars only fill the Johansen window
+    curves = []
+    for theta in thetas:
+        result = backtest(train, cash, eigenvector, theta, Q_filter=Q_filter, R_filter=R_filter,
+                          norm_window=norm_window, record='equity', process_noise=process_noise)
+        curves.append(result.portfolio_value.to_numpy()[252:])
+    sharpe = metrics_batch(np.column_stack(curves))['Sharpe Ratio'].to_numpy()
+    best = int(np.argmax(np.nan_to_num(sharpe, nan=-np.inf)))
+    theta = thetas[best]
+
+    portfolio_value, final_cash, n_trades = _out_of_sample(train, test, cash, eigenvector, theta, Q_filter,
+                                                           R_filter, norm_window, process_noise)
+
+    return {
+        'window': k,
+        'train_start': train.index[0],
+        'test_start': test.index[0],
+        'test_end': test.index[-1],
+        'eigenvector': eigenvector,
+        'theta': theta,
+        'in_sample_sharpe': sharpe[best],
+        'oos_return': final_cash / cash - 1,
+        'oos_trades': n_trades,
+        'portfolio_value': portfolio_value,
+        'final_cash': final_cash,
+    }
+
+
+def walk_forward(data: pd.DataFrame, cash: float = 1000000, train_size: int = 756, test_size: int = 252,
+                 thetas=(0.25, 0.33, 0.5, 0.75, 1.0), Q_filter: float = 0.01, R_filter: float = 0.0001,
+                 norm_window: int = 252, n_workers: int = 1,
+                 process_noise: bool = False) -> tuple[pd.Series, pd.DataFrame]:
+    """
+    Walk-forward evaluation of the pairs trading strategy.
+
+    For each rolling window the Johansen eigenvector is estimated on the training
+    part, theta is chosen by the in-sample Sharpe ratio of the backtest over
+    `thetas`, and the test part is backtested with both after a warm-up on the
+    end of the training part. The windows run in a
+    process pool and the Johansen fits of all windows come from one
+    JohansenWindowCache.
+
+    The out-of-sample curves are stitched by compounding: every window starts
+    flat, and its portfolio values are scaled by the capital left at the end of
+    the previous window, after its positions were closed.
+
+    Parameters:
+    data : pd.DataFrame: DataFrame containing price data for two assets.
+    cash : float: Initial cash.
+    train_size : int: Number of training bars of each window, at least 252 + norm_window.
+    test_size : int: Number of testing bars of each window.
+    thetas : list: Values of theta tried on each training part.
+    Q_filter : float: Process noise covariance of the Kalman filters, only used with process_noise.
+    R_filter : float: Measurement noise covariance of the Kalman filters.
+    norm_window : int: Number of bars used to normalize the VECM.
+    n_workers : int: Number of worker processes.
+    process_noise : bool: Add Q_filter to the error covariance of the Kalman filters before each update.
+
+    Returns:
+    tuple[pd.Series, pd.DataFrame]: The stitched out-of-sample portfolio value and one row per window.
+    """
+
+    if train_size < 252 + norm_window:
+        raise ValueError("train_size must cover the 252 bar Johansen window plus the normalization window")
+
+    data = data.dropna()
+    thetas = list(thetas)
+    windows = walk_forward_windows(len(data), train_size, test_size)
+
+    cache = JohansenWindowCache(data.to_numpy(dtype=float))
+    fits = cache.fit_many([(start, mid) for start, mid, _ in windows])
+
+    tasks = [
+        (k, data.iloc[start:mid], data.iloc[mid:end], eigenvector, thetas, cash, Q_filter, R_filter, norm_window,
+         process_noise)
+        for k, ((start, mid, end), (eigenvector, _, _)) in enumerate(zip(windows, fits))
+    ]
+
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            results = list(pool.map(_run_window, tasks))
+    else:
+        results = [_run_window(task) for task in tasks]
+
+    # Stitch the out-of-sample curves, compounding the capital from one window to the next
+    segments = []
+    capital = cash
+    for (_, mid, end), res in zip(windows, results):
+        scale = capital / cash
+        segments.append(pd.Series(res.pop('portfolio_value') * scale, index=data.index[mid:end]))
+        capital = res.pop('final_cash') * scale
+
+    equity = pd.concat(segments) if segments else pd.Series(dtype=float)
+    return equity, pd.DataFrame(results)
+
+
+def main(argv: list = None, prog: str = None):
+    parser = argparse.ArgumentParser(prog=prog, description="Walk-forward evaluation of the pairs trading backtest.")
+    parser.add_argument('--tickers', nargs=2, default=["MS", "SCHW"])
+    parser.add_argument('--cash', type=float, default=1000000)
+    parser.add_argument('--train', type=int, default=756, help="Training bars of each window.")
+    parser.add_argument('--test', type=int, default=252, help="Testing bars of each window.")
+    parser.add_argument('--theta', nargs='+', type=float, default=[0.25, 0.33, 0.5, 0.75, 1.0])
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--output', default=None, help="CSV file to write the stitched equity curve to.")
+    args = parser.parse_args(argv)
+
+    data = get_asset_data(args.tickers)
+    equity, windows = walk_forward(data, args.cash, args.train, args.test, args.theta, n_workers=args.workers)
+
+    print(windows.drop(columns=['eigenvector']).to_string(index=False))
+    print(all_metrics(equity))
+    if args.output:
+        equity.to_csv(args.output)
+
+
+if __name__ == "__main__":
+    main()